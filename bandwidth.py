@@ -0,0 +1,116 @@
+import time
+import threading
+
+INTERACTIVE_WEIGHT = 4.0  # A single video the user asked for gets this many shares of the link
+BULK_WEIGHT = 1.0  # Playlist entries and resumed jobs
+
+
+def parse_rate(text):
+    """
+    Parses '500K', '2M', '1.5m' or a plain number of bytes per second. Empty or 0 means unlimited (None).
+    """
+    text = (text or '').strip().upper().rstrip('B/S')
+    if not text:
+        return None
+    multiplier = {'K': 1024, 'M': 1024**2, 'G': 1024**3}.get(text[-1], 1)
+    if text[-1] in 'KMG':
+        text = text[:-1]
+    rate = float(text) * multiplier
+    return int(rate) if rate > 0 else None
+
+
+class _JobState:
+    __slots__ = ('weight', 'tokens', 'last_refill', 'last_bytes', 'filename', 'total_bytes', 'started', 'rate',
+                 'window_start', 'window_bytes')
+
+    def __init__(self, weight):
+        now = time.monotonic()
+        self.weight = weight
+        self.tokens = 0.0
+        self.last_refill = now
+        self.last_bytes = 0
+        self.filename = None
+        self.total_bytes = 0
+        self.started = now
+        self.rate = 0.0  # bytes/s actually achieved over the last measurement window
+        self.window_start = now
+        self.window_bytes = 0
+
+
+class BandwidthManager:
+    """
+    Process-wide bandwidth limit shared by all running downloads.
+    Each job gets a token bucket refilled at rate_limit * weight / total weight of running jobs, and
+    throttle() (called from the yt-dlp progress hook) sleeps the download thread when its bucket runs dry.
+    A job's weight is fixed when it registers; the limit can be changed while downloads are running.
+    """
+
+    def __init__(self, rate_limit=None, burst_seconds=1.0):
+        self.rate_limit = rate_limit  # bytes/s, None for unlimited
+        self.burst_seconds = burst_seconds
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def set_rate_limit(self, rate_limit):
+        with self._lock:
+            self.rate_limit = rate_limit or None
+
+    def register(self, job_id, weight=BULK_WEIGHT):
+        with self._lock:
+            self._jobs[job_id] = _JobState(weight)
+
+    def unregister(self, job_id):
+        """
+        Removes the job and returns its average throughput in bytes/s.
+        """
+        with self._lock:
+            state = self._jobs.pop(job_id, None)
+        if state is None:
+            return None
+        elapsed = time.monotonic() - state.started
+        return state.total_bytes / elapsed if elapsed > 0 else None
+
+    def throttle(self, job_id, filename, downloaded_bytes):
+        """
+        Accounts for the bytes a job received since the last call and blocks until it is within its share.
+        `downloaded_bytes` is yt-dlp's running total for `filename`.
+        """
+        with self._lock:
+            state = self._jobs.get(job_id)
+            if state is None:
+                return
+            if filename != state.filename or downloaded_bytes < state.last_bytes:
+                # New file (e.g. the audio stream after the video): yt-dlp restarts its count
+                state.filename = filename
+                state.last_bytes = 0
+            received = downloaded_bytes - state.last_bytes
+            state.last_bytes = downloaded_bytes
+            state.total_bytes += received
+
+            now = time.monotonic()
+            elapsed = now - state.last_refill
+            state.last_refill = now
+            state.window_bytes += received
+            if now - state.window_start >= 1.0:
+                state.rate = state.window_bytes / (now - state.window_start)
+                state.window_start = now
+                state.window_bytes = 0
+
+            if not self.rate_limit:
+                state.tokens = 0.0
+                return
+            total_weight = sum(job.weight for job in self._jobs.values())
+            share = self.rate_limit * state.weight / total_weight
+            state.tokens = min(state.tokens + elapsed * share, share * self.burst_seconds) - received
+            delay = -state.tokens / share if state.tokens < 0 else 0
+
+        if delay > 0:
+            time.sleep(min(delay, 5.0))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'rate_limit': self.rate_limit,
+                'jobs': len(self._jobs),
+                'throughput': sum(state.rate for state in self._jobs.values()),
+            }
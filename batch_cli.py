@@ -0,0 +1,223 @@
+import os
+import sys
+import json
+import argparse
+import threading
+from contextlib import redirect_stdout
+
+from bandwidth import parse_rate
+from daemon_client import DEFAULT_ADDRESS, DaemonError, connect_daemon
+from download_service import DownloadService, is_playlist_url
+from format_selection import RESOLUTION_FORMATS
+from output_writer import DEFAULT_BUFFER_SIZE
+from playlist_planner import parse_size
+from process_pool import default_processes
+from retry_policy import PERMANENT
+
+
+def read_urls(source):
+    """
+    Reads one URL per line from an open file, skipping blank lines and # comments.
+    """
+    urls = []
+    for line in source:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            urls.append(line)
+    return urls
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Download YouTube videos and playlists without any prompts.")
+    parser.add_argument('-i', '--input', default='-',
+                        help="File with one URL per line, '-' (default) reads from stdin")
+    parser.add_argument('-r', '--resolution', default='1080p', choices=list(RESOLUTION_FORMATS),
+                        help="Resolution policy applied to every URL (default: 1080p)")
+    parser.add_argument('-j', '--jobs', type=int, default=4, help="Number of downloads run in parallel (default: 4)")
+    parser.add_argument('--rate-limit', type=parse_rate, default=None,
+                        help="Total bandwidth cap shared by all jobs, e.g. 500K or 2M bytes/s (default: unlimited)")
+    parser.add_argument('--connections', type=int, default=4,
+                        help="HTTP connections used for each large single-file download, 1 disables segmenting (default: 4)")
+    parser.add_argument('--merge-jobs', type=int, default=None,
+                        help="Number of ffmpeg merges run in parallel, independent of --jobs (default: half the CPU cores)")
+    parser.add_argument('--processes', type=int, nargs='?', const=default_processes(), default=0, metavar='N',
+                        help="Download playlist entries in N worker processes, so extraction uses more than one core "
+                             "(default N: one per CPU core, at most --jobs; without the flag: threads only)")
+    parser.add_argument('--write-buffer', type=parse_size, default=DEFAULT_BUFFER_SIZE,
+                        help="Bytes per disk write for downloaded files, e.g. 1M or 8M (default: 4M)")
+    parser.add_argument('--budget', type=parse_size, default=None,
+                        help="Total size allowed for the playlists of this run, e.g. 20G; formats are stepped down "
+                             "to fit (default: free disk space). Best effort: entries whose size cannot be estimated "
+                             "are downloaded on top of it, see --skip-unknown-size")
+    parser.add_argument('--skip-unknown-size', action='store_true',
+                        help="Do not download playlist entries whose size cannot be estimated, so --budget is a hard cap")
+    parser.add_argument('--max-item-size', type=parse_size, default=None,
+                        help="Largest download allowed for a single playlist entry, e.g. 700M (default: no limit)")
+    parser.add_argument('--plan-only', action='store_true',
+                        help="Only print the projected format and size of every playlist entry, download nothing")
+    parser.add_argument('--daemon', nargs='?', const=DEFAULT_ADDRESS, default=None, metavar='ADDRESS',
+                        help="Submit the jobs to the running daemon (default address: %(const)s) instead of "
+                             "downloading in this process; the other download options are the daemon's")
+    parser.add_argument('-o', '--output', default=os.getcwd(), help="Download folder (default: current folder)")
+    return parser.parse_args(argv)
+
+
+def wants_plan(url, args, budget):
+    return is_playlist_url(url) and (budget is not None or args.max_item_size or args.skip_unknown_size or args.plan_only)
+
+
+def plan_playlist(service, url, args, budget, write_record):
+    """
+    Plans the formats of a playlist within `budget` and reports the projection (as a record with --plan-only).
+    Returns (plan, budget left for the next playlists).
+    """
+    plan = service.plan_playlist(url, args.resolution, download_path=args.output, budget=budget,
+                                 max_item_bytes=args.max_item_size, skip_unknown=args.skip_unknown_size)
+    print(f"Plan for {url}: {plan.summary()}")
+    if args.plan_only:
+        write_record({'job_id': None, 'url': url, 'format': args.resolution, 'status': 'planned', 'bytes': plan.total,
+                      'items': [{'url': item.url, 'title': item.title, 'format': item.selector, 'bytes': item.size,
+                                 'status': item.status} for item in plan.items]})
+    else:
+        # Left out of the plan's downloads, so no job reports them
+        for item in plan.items:
+            if item.status == 'archived':
+                write_record({'job_id': None, 'url': item.url, 'format': args.resolution, 'status': 'skipped'})
+    return plan, (max(budget - plan.total, 0) if budget is not None else None)
+
+
+def daemon_batch(service, urls, args, write_record):
+    """
+    --daemon: submits the URLs to the running daemon and writes the records of those jobs only,
+    the daemon's event stream also carries other clients' jobs.
+    """
+    finished = {}  # job_id -> result, results can arrive before submit() has told us the job id
+    wanted = set()
+    written = set()
+    cond = threading.Condition()
+
+    def on_result(result):
+        with cond:
+            finished[result['job_id']] = result
+            cond.notify_all()
+
+    service.job_listeners.append(on_result)
+    budget = args.budget
+    for url in urls:
+        try:
+            if wants_plan(url, args, budget):
+                plan, budget = plan_playlist(service, url, args, budget, write_record)
+                jobs = [] if args.plan_only else service.submit_plan(plan, args.output)
+            elif args.plan_only:
+                continue
+            else:
+                jobs = service.submit(url, args.output, args.resolution, interactive=False)
+        except (OSError, DaemonError) as e:
+            # No job ids to follow; whatever the daemon had queued for this URL still runs there
+            print(f"Submitting {url} to the daemon failed: {e}")
+            write_record({'job_id': None, 'url': url, 'format': args.resolution, 'status': 'failed', 'error': str(e)})
+            continue
+        for job in jobs:
+            if job['job_id'] is None:
+                write_record({'job_id': None, 'url': job['url'], 'format': args.resolution, 'status': 'skipped'})
+            else:
+                wanted.add(job['job_id'])
+    with cond:
+        while True:
+            for job_id in sorted(wanted - written):
+                if job_id in finished:
+                    write_record(finished[job_id])
+                    written.add(job_id)
+            if written == wanted:
+                return
+            cond.wait()
+
+
+def batch_main(argv=None):
+    """
+    Headless batch mode: downloads every URL from --input with the chosen resolution policy,
+    N jobs at a time, and writes one JSON record per job to stdout.
+    Jobs that failed on network errors or throttling get one more try once everything else is done,
+    their failed record is only written if that fails too.
+    Returns the process exit code: 0 if every job succeeded or was skipped, 1 otherwise, 130 on Ctrl+C,
+    2 when --daemon finds no daemon.
+    """
+    args = parse_args(argv)
+    if args.input == '-':
+        urls = read_urls(sys.stdin)
+    else:
+        with open(args.input, 'r', encoding='utf-8') as f:
+            urls = read_urls(f)
+
+    records_out = sys.stdout
+    output_lock = threading.Lock()
+    failures = []
+    # Failed records held back for the end-of-run retry pass, None once it started (the daemon retries on its own)
+    deferred = None if args.daemon else []
+
+    def write_record(result):
+        if result['status'] == 'failed' and deferred is not None and result.get('job_id') is not None \
+                and result.get('error_kind') != PERMANENT:
+            deferred.append(result)
+            return
+        if result['status'] == 'failed':
+            failures.append(result)
+        with output_lock:
+            records_out.write(json.dumps(result) + '\n')
+            records_out.flush()
+
+    os.makedirs(args.output, exist_ok=True)
+    # stdout is reserved for the JSON records, everything else (ours and yt-dlp's) goes to stderr
+    with redirect_stdout(sys.stderr):
+        if args.daemon:
+            service = connect_daemon(args.daemon)
+            if service is None:
+                print(f"No daemon is listening on {args.daemon}")
+                return 2
+            try:
+                daemon_batch(service, urls, args, write_record)
+            except KeyboardInterrupt:
+                print("Interrupted, the submitted jobs go on in the daemon")
+                return 130
+            finally:
+                service.close()
+            return 1 if failures else 0
+
+        service = DownloadService(max_workers=args.jobs, max_per_host=args.jobs, quiet=True, rate_limit=args.rate_limit,
+                                  connections=args.connections, merge_workers=args.merge_jobs,
+                                  write_buffer=args.write_buffer or DEFAULT_BUFFER_SIZE, processes=args.processes)
+        service.job_listeners.append(write_record)
+        try:
+            budget = args.budget
+            for url in urls:
+                if wants_plan(url, args, budget):
+                    plan, budget = plan_playlist(service, url, args, budget, write_record)
+                    if not args.plan_only:
+                        service.queue_plan(plan, args.output)
+                elif not args.plan_only:
+                    service.download_video(url, args.output, args.resolution)
+            service.join()
+            held, deferred = deferred, None
+            if held:
+                retried = set(service.retry_failed_jobs([result['job_id'] for result in held]))
+                print(f"Retrying {len(retried)} failed download(s)")
+                for result in held:
+                    if result['job_id'] not in retried:
+                        write_record(result)
+                service.join()
+        except KeyboardInterrupt:
+            # Running downloads stop at their next progress update and stay resumable from the journal
+            print("Interrupted, stopping downloads...")
+            service.stop_all()
+            held, deferred = deferred or [], None
+            for result in held:
+                write_record(result)
+            return 130
+        finally:
+            service.close()
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(batch_main())
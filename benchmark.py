@@ -0,0 +1,682 @@
+"""
+Offline benchmark suite. Nothing here touches the network: a local HTTP server serves synthetic media
+(with Range support) and paged playlists, and recorded info dicts pointing at that server are seeded
+into the metadata cache so yt-dlp never runs an extractor.
+
+    python benchmark.py                       # run everything, write benchmark_results/<time>-<commit>.json
+    python benchmark.py --only single_download --quick
+    python benchmark.py --compare benchmark_results/old.json
+
+Downloads still go through the real yt-dlp (for format selection and its HTTP downloader), so it has to be installed.
+"""
+import io
+import os
+import sys
+import json
+import time
+import heapq
+import shutil
+import argparse
+import platform
+import tempfile
+import itertools
+import threading
+import subprocess
+import statistics
+import urllib.request
+from contextlib import redirect_stdout
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from download_archive import DownloadArchive
+from download_service import DownloadService
+from job_journal import JobJournal
+from metadata_cache import MetadataCache
+from metrics import Metrics
+from playlist_expander import PlaylistEntry, _iter_pages
+from process_pool import default_processes
+from progress_bus import ProgressBus, ProgressPump
+from retry_policy import RetryPolicy, HostCircuitBreaker
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_results')
+_BLOCK = bytes(range(256)) * 4096  # 1 MiB of synthetic media, repeated
+
+
+def synthetic_media(size):
+    """
+    The `size` bytes the server sends for /media/<name>?size=<size>, to check a download against.
+    """
+    return (_BLOCK * (size // len(_BLOCK) + 1))[:size]
+
+
+class MediaServer:
+    """
+    Local HTTP server for the benchmarks:
+      /media/<name>?size=N             N bytes of synthetic media, honours Range unless &ranges=0
+      /playlist/<id>?start=S&count=C   one page of a registered playlist as JSON
+    Errors can be injected per media name with inject_errors().
+    """
+
+    def __init__(self):
+        self.playlists = {}  # playlist id -> list of flat entries
+        self.faults = {}  # media name -> HTTP statuses answered to the next requests, in order
+        self.requests = 0
+        self._faults_lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address
+        return f'http://{host}:{port}'
+
+    def media_url(self, name, size, ranges=True):
+        return f'{self.base_url}/media/{name}?size={size}' + ('' if ranges else '&ranges=0')
+
+    def inject_errors(self, name, *statuses):
+        """
+        The next len(statuses) requests for /media/<name> are answered with these statuses instead of the media.
+        """
+        with self._faults_lock:
+            self.faults.setdefault(name, []).extend(statuses)
+
+    def _next_fault(self, name):
+        with self._faults_lock:
+            statuses = self.faults.get(name)
+            return statuses.pop(0) if statuses else None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='bench-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                server.requests += 1
+                parsed = urlparse(self.path)
+                query = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+                if parsed.path.startswith('/media/'):
+                    status = server._next_fault(parsed.path.rsplit('/', 1)[1])
+                    if status:
+                        self.send_error(status)
+                        return
+                    self.send_media(int(query.get('size', 0)), ranges=query.get('ranges') != '0')
+                elif parsed.path.startswith('/playlist/'):
+                    entries = server.playlists.get(parsed.path.rsplit('/', 1)[1])
+                    if entries is None:
+                        self.send_error(404)
+                        return
+                    start, count = int(query.get('start', 0)), int(query.get('count', 50))
+                    body = json.dumps({'entries': entries[start:start + count], 'total': len(entries)}).encode()
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                else:
+                    self.send_error(404)
+
+            def send_media(self, size, ranges=True):
+                start, end = 0, size - 1
+                range_header = self.headers.get('Range', '') if ranges else ''
+                if range_header.startswith('bytes='):
+                    first, _, last = range_header[6:].partition('-')
+                    start = int(first or 0)
+                    end = min(int(last), size - 1) if last else size - 1
+                    if start >= size:
+                        self.send_response(416)
+                        self.send_header('Content-Range', f'bytes */{size}')
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                    self.send_response(206)
+                    self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+                else:
+                    self.send_response(200)
+                self.send_header('Content-Type', 'video/mp4')
+                self.send_header('Accept-Ranges', 'bytes')
+                self.send_header('Content-Length', str(end - start + 1))
+                self.end_headers()
+                position = start
+                try:
+                    while position <= end:
+                        offset = position % len(_BLOCK)
+                        chunk = _BLOCK[offset:offset + min(len(_BLOCK) - offset, end - position + 1)]
+                        self.wfile.write(chunk)
+                        position += len(chunk)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+        return Handler
+
+
+def progressive_info(server, video_id, size, title=None):
+    """
+    Recorded info dict for a video with progressive (video+audio) formats only, so no ffmpeg merge is needed.
+    The largest format has `size` bytes.
+    """
+    formats = []
+    for format_id, height, fraction in (('18', 360, 0.25), ('22', 720, 0.5), ('37', 1080, 1.0)):
+        format_size = max(int(size * fraction), 1)
+        formats.append({
+            'format_id': format_id, 'url': server.media_url(f'{video_id}-{format_id}.mp4', format_size),
+            'ext': 'mp4', 'protocol': 'http', 'vcodec': 'avc1.4d401f', 'acodec': 'mp4a.40.2',
+            'width': height * 16 // 9, 'height': height, 'fps': 30, 'tbr': format_size * 8 / 1000 / 60,
+            'filesize': format_size,
+        })
+    return _info_dict(video_id, title or f'Benchmark video {video_id}', formats)
+
+
+def dash_info(server, video_id, format_count=40):
+    """
+    Recorded info dict shaped like a real YouTube video: many video-only DASH formats plus audio-only ones.
+    Only used for listing, its formats are never downloaded.
+    """
+    formats = []
+    heights = (144, 240, 360, 480, 720, 1080, 1440, 2160)
+    for i in range(format_count):
+        height = heights[i % len(heights)]
+        codec = ('avc1.64001F', 'vp9', 'av01.0.08M.08')[i // len(heights) % 3]
+        size = height * 60_000 + i * 1000
+        formats.append({
+            'format_id': str(100 + i), 'url': server.media_url(f'{video_id}-{i}.mp4', size), 'ext': 'mp4',
+            'protocol': 'https', 'vcodec': codec, 'acodec': 'none', 'width': height * 16 // 9, 'height': height,
+            'fps': 60 if i % 2 else 30, 'tbr': size * 8 / 1000 / 600, 'filesize': size,
+        })
+    for i, abr in enumerate((48, 128, 160)):
+        formats.append({
+            'format_id': f'a{i}', 'url': server.media_url(f'{video_id}-a{i}.m4a', abr * 75_000), 'ext': 'm4a',
+            'protocol': 'https', 'vcodec': 'none', 'acodec': 'mp4a.40.2', 'abr': abr, 'tbr': abr,
+            'filesize': abr * 75_000,
+        })
+    return _info_dict(video_id, f'Listing video {video_id}', formats)
+
+
+class SyntheticPlaylist:
+    """
+    A playlist of `count` entries shaped like yt-dlp's flat YouTube entries (thumbnails, channel fields...),
+    generated page by page when the server is asked for them, so huge playlists cost the server nothing.
+    """
+
+    def __init__(self, playlist_id, count):
+        self.playlist_id = playlist_id
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, page):
+        return [self.entry(i) for i in range(*page.indices(self.count))]
+
+    def entry(self, index):
+        video_id = f'{self.playlist_id[:4]}{index:07d}'
+        return {
+            '_type': 'url', 'ie_key': 'Youtube', 'id': video_id, 'url': f'https://www.youtube.com/watch?v={video_id}',
+            'title': f'Synthetic entry {index} of {self.playlist_id}', 'description': None, 'duration': 600 + index % 900,
+            'channel_id': 'UCbenchmarkchannel00000', 'channel': 'Benchmark channel', 'channel_url': 'https://www.youtube.com/channel/UCbenchmarkchannel00000',
+            'uploader': 'Benchmark channel', 'uploader_id': '@benchmark', 'uploader_url': 'https://www.youtube.com/@benchmark',
+            'thumbnails': [{'url': f'https://i.ytimg.com/vi/{video_id}/{name}.jpg?sqp=-oaymwEbCKgBEF5IVfKriqkDDggBFQAAiEIYAXABwAEG&rs=AOn4CLB',
+                            'height': height, 'width': height * 16 // 9} for name, height in
+                           (('hqdefault', 94), ('hqdefault', 110), ('hqdefault', 138), ('hqdefault', 188), ('sddefault', 480), ('maxresdefault', 720))],
+            'timestamp': None, 'release_timestamp': None, 'availability': None, 'view_count': 1000 + index,
+            'live_status': None, 'channel_is_verified': None, '__x_forwarded_for_ip': None,
+        }
+
+
+def iter_server_playlist(base_url, playlist_id, page_size=50, project=True):
+    """
+    Pages through a playlist of the benchmark server with playlist_expander's own paging: the pages
+    come from a yt-dlp OnDemandPagedList, as YouTube's do, read by _iter_pages. Yields PlaylistEntry
+    records (or the raw entry dicts with project=False).
+    """
+    from yt_dlp.utils import OnDemandPagedList
+
+    def fetch_page(pagenum):
+        url = f'{base_url}/playlist/{playlist_id}?start={pagenum * page_size}&count={page_size}'
+        with urllib.request.urlopen(url) as response:
+            return json.load(response)['entries']
+
+    for entry in _iter_pages(OnDemandPagedList(fetch_page, page_size)):
+        yield PlaylistEntry.from_entry(entry) if project else entry
+
+
+def _info_dict(video_id, title, formats):
+    return {
+        'id': video_id, 'title': title, 'duration': 600, 'formats': formats,
+        'extractor': 'youtube', 'extractor_key': 'Youtube',
+        'webpage_url': f'https://www.youtube.com/watch?v={video_id}',
+    }
+
+
+class OfflineDownloadService(DownloadService):
+    """
+    DownloadService whose playlist listing pages through the benchmark server instead of YouTube.
+    Everything else (journal, archive, scheduler, metadata cache, yt-dlp downloads) is the real code.
+    """
+
+    def __init__(self, server, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.server = server
+
+    def fetch_playlist_items(self, playlist_url, page_size=50):
+        playlist_id = parse_qs(urlparse(playlist_url).query)['list'][0]
+        return iter_server_playlist(self.server.base_url, playlist_id, page_size)
+
+
+class BenchmarkEnvironment:
+    """
+    A scratch directory holding the journal, archive, metadata cache and downloads of one benchmark,
+    removed on exit.
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.root = tempfile.mkdtemp(prefix='ytdl-bench-')
+        self.download_path = os.path.join(self.root, 'downloads')
+        os.makedirs(self.download_path)
+        self.metadata_cache = MetadataCache(cache_dir=os.path.join(self.root, 'metadata'), max_entries=4096)
+
+    def seed(self, info_dict):
+        self.metadata_cache.put(info_dict['id'], info_dict)
+
+    def service(self, **kwargs):
+        return OfflineDownloadService(
+            self.server, quiet=True, metadata_cache=self.metadata_cache,
+            journal=JobJournal(os.path.join(self.root, 'jobs.sqlite3'), progress_interval=0.5),
+            archive=DownloadArchive(os.path.join(self.root, 'archive.sqlite3')),
+            metrics=Metrics(os.path.join(self.root, 'metrics.jsonl'), os.path.join(self.root, 'metrics.prom')), **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+def summarize(samples):
+    """
+    median / p95 / max / mean of a list of timings, in the unit they were given in.
+    """
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return {
+        'n': len(ordered),
+        'median': statistics.median(ordered),
+        'p95': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        'max': ordered[-1],
+        'mean': statistics.fmean(ordered),
+    }
+
+
+def run_service(service, urls, download_path, format_id='1080p'):
+    """
+    Downloads `urls` through `service`, returns (seconds, job results).
+    """
+    results = []
+    service.job_listeners.append(results.append)
+    started = time.perf_counter()
+    for url in urls:
+        service.download_video(url, download_path, format_id)
+    service.join()
+    return time.perf_counter() - started, results
+
+
+def bench_format_listing(server, quick=False):
+    """
+    Latency of get_format_table: cold (info dict read from the disk cache, table built) and warm (memoized).
+    """
+    iterations = 20 if quick else 200
+    with BenchmarkEnvironment(server) as env:
+        video_ids = [f'list{i:07d}' for i in range(iterations)]
+        for video_id in video_ids:
+            env.seed(dash_info(server, video_id))
+        service = env.service()
+        try:
+            cold, warm = [], []
+            for video_id in video_ids:
+                url = f'https://www.youtube.com/watch?v={video_id}'
+                env.metadata_cache._memory.clear()  # Force the disk path
+                service._format_tables.clear()
+                started = time.perf_counter()
+                table, _ = service.get_format_table(url)
+                cold.append((time.perf_counter() - started) * 1000)
+                started = time.perf_counter()
+                service.get_format_table(url)
+                warm.append((time.perf_counter() - started) * 1000)
+        finally:
+            service.close()
+    return {'formats_per_video': len(table), 'cold_ms': summarize(cold), 'warm_ms': summarize(warm)}
+
+
+def bench_single_download(server, quick=False):
+    """
+    Throughput of one large progressive download, over one connection and segmented.
+    """
+    size = (48 if quick else 256) * 1024**2
+    results = {}
+    for connections in (1, 4):
+        with BenchmarkEnvironment(server) as env:
+            video_id = f'single{connections:05d}'
+            env.seed(progressive_info(server, video_id, size))
+            service = env.service(connections=connections)
+            try:
+                seconds, jobs = run_service(service, [f'https://www.youtube.com/watch?v={video_id}'], env.download_path)
+            finally:
+                service.close()
+        results[f'connections_{connections}'] = {
+            'bytes': size, 'seconds': seconds, 'mb_per_s': size / seconds / 1024**2,
+            'status': [job['status'] for job in jobs], 'phases_s': jobs[0].get('phases') if jobs else None,
+            'io': jobs[0].get('io') if jobs else None,
+        }
+    return results
+
+
+def bench_playlist_fanout(server, quick=False):
+    """
+    Throughput of a playlist of small videos fanned out over the worker pool, from listing to last file.
+    The last run shards the entries over one worker process per core (8 threads in total).
+    """
+    entry_count = 20 if quick else 100
+    entry_size = 2 * 1024**2
+    results = {}
+    for workers, processes in ((1, 0), (4, 0), (8, 0), (8, default_processes())):
+        with BenchmarkEnvironment(server) as env:
+            playlist_id = f'PLbench{workers}p{processes}'
+            entries = []
+            for i in range(entry_count):
+                video_id = f'pl{workers}p{processes}v{i:03d}'
+                env.seed(progressive_info(server, video_id, entry_size))
+                entries.append({'id': video_id, 'title': f'Entry {i}', 'url': video_id})
+            server.playlists[playlist_id] = entries
+            service = env.service(max_workers=workers, max_per_host=workers, processes=processes)
+            try:
+                seconds, jobs = run_service(service, [f'https://www.youtube.com/playlist?list={playlist_id}'],
+                                            env.download_path)
+            finally:
+                service.close()
+        done = [job for job in jobs if job['status'] == 'done']
+        results[f'workers_{workers}' + (f'_processes_{processes}' if processes else '')] = {
+            'entries': entry_count, 'done': len(done), 'seconds': seconds,
+            'videos_per_s': len(done) / seconds, 'mb_per_s': sum(job['bytes'] or 0 for job in done) / seconds / 1024**2,
+            'queue_wait_s': summarize([job['queue_wait'] for job in done if job['queue_wait'] is not None]),
+            'phases_s': {phase: summarize([job['phases'][phase] for job in done if phase in job['phases']])
+                         for phase in ('extract', 'download', 'finalize')},
+        }
+    return results
+
+
+def bench_retry(server, quick=False):
+    """
+    A playlist where some entries first get server errors, some get throttled (429) and one is refused (401):
+    how long until everything that can be downloaded is, with retries, backoff and the circuit breaker.
+    Delays are scaled down from the defaults so the run stays short.
+    """
+    entry_count = 12 if quick else 48
+    with BenchmarkEnvironment(server) as env:
+        entries = []
+        for i in range(entry_count):
+            video_id = f'retry{i:06d}'
+            env.seed(progressive_info(server, video_id, 1024**2))
+            entries.append({'id': video_id, 'title': f'Entry {i}', 'url': video_id})
+            media = f'{video_id}-37.mp4'
+            if i == 0:
+                server.inject_errors(media, *[401] * 10)
+            elif i % 3 == 1:
+                server.inject_errors(media, 503, 503)
+            elif i % 3 == 2:
+                server.inject_errors(media, 429)
+        server.playlists['PLretry'] = entries
+        service = env.service(max_workers=4, max_per_host=4,
+                              retry_policy=RetryPolicy(base_delay=0.05, throttle_delay=0.2, max_delay=1.0),
+                              breaker=HostCircuitBreaker(cooldown=0.5, max_cooldown=2.0))
+        try:
+            seconds, jobs = run_service(service, ['https://www.youtube.com/playlist?list=PLretry'], env.download_path)
+            retried = service.retry_failed_jobs()
+            service.join()
+        finally:
+            service.close()
+        trips = service.breaker.trips_total
+    return {
+        'entries': entry_count, 'seconds': seconds, 'breaker_trips': trips, 'end_of_run_retries': len(retried),
+        'status': {status: sum(job['status'] == status for job in jobs) for status in ('done', 'failed')},
+        'error_kinds': sorted({job.get('error_kind') for job in jobs if job['status'] == 'failed'}),
+        'retries': sum(job.get('retries') or 0 for job in jobs),
+    }
+
+
+MEMORY_SLACK_MB = 8  # Growth of the streamed peak RSS, smallest to largest playlist, still counted as flat
+
+
+def _peak_rss():
+    # VmHWM where there is one: Linux carries ru_maxrss over exec, so a fresh interpreter would report
+    # at least the RSS of the process that started it
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024  # bytes on macOS, KB elsewhere
+
+
+def _memory_probe(base_url, playlist_id, mode):
+    # Runs in a fresh interpreter (see bench_memory_ceiling), so its peak RSS only covers this one listing
+    import yt_dlp.utils  # Before the baseline, yt-dlp's own import is not the listing's
+    baseline = _peak_rss()
+    if mode == 'streamed':  # What enqueue_playlist does: queue each entry and drop it
+        kept = sum(1 for _ in iter_server_playlist(base_url, playlist_id))
+    elif mode == 'listed':  # What plan_playlist and the daemon's /playlist do: keep every record
+        kept = len(list(iter_server_playlist(base_url, playlist_id)))
+    else:  # The entry dicts as yt-dlp returns them, kept like before records existed
+        kept = len(list(iter_server_playlist(base_url, playlist_id, project=False)))
+    return kept, baseline, _peak_rss()
+
+
+def bench_memory_ceiling(server, quick=False):
+    """
+    Peak RSS while listing playlists of growing size, each listing in a fresh process. Streaming the
+    entries must stay flat; keeping every PlaylistEntry grows by its few hundred bytes per entry,
+    against a few KB for the raw entry dicts it replaces.
+    """
+    if _peak_rss() is None:
+        return {'skipped': 'peak RSS needs the resource module'}
+    sizes = (500, 5000) if quick else (1000, 10_000, 50_000)
+    results = {}
+    for count in sizes:
+        playlist_id = f'PLmem{count}'
+        server.playlists[playlist_id] = SyntheticPlaylist(playlist_id, count)
+        results[f'entries_{count}'] = sizes_result = {}
+        for mode in ('streamed', 'listed', 'raw_dicts'):
+            # A plain interpreter per probe: a multiprocessing child would import the parent's __main__
+            # (pytest, say) first, adding its memory to the peak
+            code = f'import json, benchmark; print(json.dumps(benchmark._memory_probe({server.base_url!r}, {playlist_id!r}, {mode!r})))'
+            completed = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       capture_output=True, text=True, timeout=600, check=True)
+            kept, baseline, peak = json.loads(completed.stdout.splitlines()[-1])
+            sizes_result[mode] = {'entries': kept, 'peak_rss_mb': peak / 1024**2, 'growth_mb': (peak - baseline) / 1024**2}
+        del server.playlists[playlist_id]
+    smallest, largest = results[f'entries_{sizes[0]}'], results[f'entries_{sizes[-1]}']
+    added = sizes[-1] - sizes[0]
+    results['streamed_growth_mb'] = largest['streamed']['peak_rss_mb'] - smallest['streamed']['peak_rss_mb']
+    results['streamed_flat'] = results['streamed_growth_mb'] < MEMORY_SLACK_MB
+    for mode in ('listed', 'raw_dicts'):
+        results[f'{mode}_bytes_per_entry'] = (largest[mode]['peak_rss_mb'] - smallest[mode]['peak_rss_mb']) * 1024**2 / added
+    return results
+
+
+class _FakeRoot:
+    """
+    Stands in for the Tk root in the pump benchmark: runs after() callbacks on the calling thread.
+    """
+
+    def __init__(self):
+        self._calls = []
+        self._sequence = itertools.count()
+
+    def after(self, ms, callback):
+        heapq.heappush(self._calls, (time.monotonic() + ms / 1000, next(self._sequence), callback))
+
+    def run_until(self, deadline):
+        while self._calls and time.monotonic() < deadline:
+            due, _, callback = heapq.heappop(self._calls)
+            time.sleep(max(0.0, due - time.monotonic()))
+            callback()
+
+
+def bench_event_pump(server=None, quick=False, publishers=8, rate_hz=200, render_cost_ms=2.0):
+    """
+    Latency from ProgressBus.publish on a download thread to the render that shows it,
+    with `publishers` threads each publishing `rate_hz` events/s and a render that costs `render_cost_ms`.
+    """
+    duration = 1.0 if quick else 5.0
+    bus = ProgressBus()
+    root = _FakeRoot()
+    latencies = []
+    renders = []
+    drained = []
+
+    def drain(max_events=None):
+        events = ProgressBus.drain(bus, max_events)
+        drained[:] = events
+        return events
+
+    def render(snapshot):
+        now = time.monotonic()
+        latencies.extend((now - event.timestamp) * 1000 for event in drained)
+        renders.append(now)
+        time.sleep(render_cost_ms / 1000)
+
+    bus.drain = drain
+    pump = ProgressPump(root, bus, render, fps=10)
+    stop = threading.Event()
+    published = [0] * publishers
+
+    def publish(index):
+        total = 100 * 1024**2
+        downloaded = 0
+        while not stop.is_set():
+            downloaded = min(downloaded + 64 * 1024, total)
+            bus.publish(index, {'status': 'downloading', 'downloaded_bytes': downloaded, 'total_bytes': total,
+                                'speed': 5 * 1024**2, 'filename': f'video{index}.mp4'})
+            published[index] += 1
+            time.sleep(1 / rate_hz)
+
+    threads = [threading.Thread(target=publish, args=(i,), daemon=True) for i in range(publishers)]
+    for thread in threads:
+        thread.start()
+    pump.start()
+    root.run_until(time.monotonic() + duration)
+    stop.set()
+    pump.stop()
+    for thread in threads:
+        thread.join()
+    return {
+        'publishers': publishers, 'events': sum(published), 'events_per_s': sum(published) / duration,
+        'renders': len(renders), 'renders_per_s': len(renders) / duration, 'latency_ms': summarize(latencies),
+    }
+
+
+BENCHMARKS = {
+    'format_listing': bench_format_listing,
+    'single_download': bench_single_download,
+    'playlist_fanout': bench_playlist_fanout,
+    'event_pump': bench_event_pump,
+    'retry': bench_retry,
+    'memory_ceiling': bench_memory_ceiling,
+}
+
+
+def environment_info():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    try:
+        from yt_dlp.version import __version__ as yt_dlp_version
+    except ImportError:
+        yt_dlp_version = None
+    return {'commit': commit, 'python': platform.python_version(), 'platform': platform.platform(),
+            'cpus': os.cpu_count(), 'yt_dlp': yt_dlp_version, 'timestamp': time.time()}
+
+
+def flatten(results, prefix=''):
+    """
+    {'a': {'b': 1}} -> {'a.b': 1}, numbers only. Used to compare two result files.
+    """
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{prefix}{key}.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f'{prefix}{key}'] = value
+    return flat
+
+
+def compare(old_results, new_results):
+    old, new = flatten(old_results['benchmarks']), flatten(new_results['benchmarks'])
+    print(f"{'metric':<55} {'old':>12} {'new':>12} {'change':>8}")
+    for key in sorted(old.keys() & new.keys()):
+        change = f'{(new[key] - old[key]) / old[key] * 100:+.1f}%' if old[key] else ''
+        print(f'{key:<55} {old[key]:>12.3f} {new[key]:>12.3f} {change:>8}')
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the downloader (no network needed).")
+    parser.add_argument('--only', action='append', choices=list(BENCHMARKS), help="Run only this benchmark (repeatable)")
+    parser.add_argument('--quick', action='store_true', help="Smaller inputs, for a fast sanity run")
+    parser.add_argument('-o', '--output', help=f"Results file (default: {RESULTS_DIR}/<time>-<commit>.json)")
+    parser.add_argument('--compare', metavar='RESULTS_JSON', help="Print the change of every metric against an earlier results file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    results = {'environment': environment_info(), 'quick': args.quick, 'benchmarks': {}}
+    server = MediaServer().start()
+    try:
+        for name in args.only or BENCHMARKS:
+            print(f"Running {name}...", file=sys.stderr)
+            log = io.StringIO()  # The service and yt-dlp print per-job messages, keep them out of the report
+            with redirect_stdout(log):
+                results['benchmarks'][name] = BENCHMARKS[name](server, quick=args.quick)
+    finally:
+        server.stop()
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        output = os.path.join(RESULTS_DIR, f"{stamp}-{results['environment']['commit'] or 'nocommit'}.json")
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results['benchmarks'], indent=2))
+    print(f"Results written to {output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == '__main__':
+    main()
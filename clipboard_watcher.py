@@ -0,0 +1,104 @@
+import sys
+import time
+import queue
+import threading
+
+from url_utils import canonicalize_url
+
+
+def _clipboard_sequence_reader():
+    """
+    Returns a function giving a number that changes whenever the clipboard changes, or None when the
+    platform has no cheap way to ask. On Windows this is GetClipboardSequenceNumber, which lets us skip
+    reading the clipboard contents entirely while nothing changed.
+    """
+    if sys.platform == 'win32':
+        try:
+            import ctypes
+            return ctypes.windll.user32.GetClipboardSequenceNumber
+        except (ImportError, AttributeError, OSError):
+            return None
+    return None
+
+
+class ClipboardWatcher:
+    """
+    Watches the clipboard on a background thread and posts each new http(s) URL to `events`.
+    `on_url`, if given, is also called with the URL right away on the watcher thread (e.g. to start
+    prefetching its metadata before the Tk loop gets to the event).
+    URLs are canonicalized (see url_utils.canonicalize_url) and debounced, so copying the same video
+    with a different &t= or si= parameter, or copying it several times in a row, posts it only once.
+    """
+
+    def __init__(self, poll_interval=0.5, debounce=0.3, on_url=None):
+        self.poll_interval = poll_interval
+        self.on_url = on_url
+        self.debounce = debounce
+        self.events = queue.SimpleQueue()
+        self.last_key = None
+        self._read_sequence = _clipboard_sequence_reader()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._watch, name='clipboard-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def mark_handled(self, url):
+        """
+        Records a URL handled some other way (typed or pasted), so the watcher won't post it again.
+        """
+        self.last_key = canonicalize_url(url)[0]
+
+    def get_event(self):
+        """
+        Returns the next canonical URL posted by the watcher, or None. Safe to call from the Tk thread.
+        """
+        try:
+            return self.events.get_nowait()
+        except queue.Empty:
+            return None
+
+    def _watch(self):
+        import pyperclip
+
+        last_sequence = None
+        last_content = None
+        changed_at = None
+        while not self._stop.wait(self.poll_interval):
+            if self._read_sequence:
+                sequence = self._read_sequence()
+                if sequence == last_sequence and changed_at is None:
+                    continue
+                last_sequence = sequence
+            try:
+                content = pyperclip.paste()
+            except Exception as e:
+                print(f"Could not read the clipboard: {e}")
+                continue
+
+            now = time.monotonic()
+            if content != last_content:
+                # Wait until the clipboard has been stable for `debounce` seconds before acting on it
+                last_content = content
+                changed_at = now
+                continue
+            if changed_at is None or now - changed_at < self.debounce:
+                continue
+            changed_at = None
+
+            content = content.strip()
+            if not (content.startswith("http://") or content.startswith("https://")):
+                continue
+            key, url = canonicalize_url(content)
+            if key != self.last_key:
+                self.last_key = key
+                self.events.put(url)
+                if self.on_url:
+                    try:
+                        self.on_url(url)
+                    except Exception as e:
+                        print(f"Clipboard URL handler failed: {e}")
@@ -0,0 +1,336 @@
+"""
+Long-running local download service. It owns one DownloadService (job queue, journal, archive,
+metadata cache, warm yt-dlp sessions) and exposes it as JSON over HTTP, on localhost or a Unix socket:
+
+    python daemon.py                          # listens on 127.0.0.1:8719 (or $YTDL_DAEMON)
+    python daemon.py --address unix:/tmp/ytdl.sock
+
+The GUI and batch mode use it automatically when it is running (see daemon_client.py), scripts can
+talk to it directly:
+
+    curl -H 'Content-Type: application/json' -d '{"url": "https://youtu.be/...", "format": "1080p"}' 127.0.0.1:8719/downloads
+
+    GET  /status                      queue sizes, bandwidth, event sequence number
+    GET  /formats?url=                ranked formats of a video (or kind=playlist)
+    GET  /playlist?url=               flat entries of a playlist
+    GET  /jobs?state=&since=          journal rows, GET /jobs/<id> for one
+    GET  /events?after=&wait=         long-poll: job results and latest progress since sequence `after`
+    GET  /metrics                     Prometheus text
+    POST /downloads                   {url, format, download_path, interactive} - playlists are expanded
+    POST /prefetch                    {url}
+    POST /plans, /plans/queue         playlist byte-budget planning, see playlist_planner.py
+    POST /jobs/<id>/pause|resume|cancel
+    POST /settings                    {rate_limit}
+    POST /archive/scan                {folders}
+    POST /shutdown
+"""
+import os
+import sys
+import json
+import signal
+import argparse
+import threading
+import socketserver
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from bandwidth import parse_rate, BULK_WEIGHT, INTERACTIVE_WEIGHT
+from daemon_client import DEFAULT_ADDRESS
+from download_service import DownloadService, is_playlist_url
+from process_pool import default_processes
+from startup import prewarm_in_background
+
+PROGRESS_FIELDS = ('status', 'downloaded_bytes', 'total_bytes', 'total_bytes_estimate', 'speed', 'eta',
+                   'elapsed', 'filename', 'tmpfilename')
+MAX_EVENT_WAIT = 30
+
+
+class EventLog:
+    """
+    What clients see of the service's listeners: every job result in order, plus only the latest
+    progress of each running job (progress hooks fire many times a second). Clients long-poll with
+    the last sequence number they saw.
+    """
+
+    def __init__(self, max_results=10000):
+        self.sequence = 0
+        self._results = deque(maxlen=max_results)  # (sequence, event)
+        self._progress = {}  # job_id -> (sequence, event)
+        self._cond = threading.Condition()
+
+    def on_progress(self, d, job_id):
+        progress = {field: d[field] for field in PROGRESS_FIELDS if d.get(field) is not None}
+        title = (d.get('info_dict') or {}).get('title')
+        if title:
+            progress['info_dict'] = {'title': title}
+        with self._cond:
+            self.sequence += 1
+            self._progress[job_id] = (self.sequence, {'job_id': job_id, 'progress': progress})
+            self._cond.notify_all()
+
+    def on_result(self, result):
+        with self._cond:
+            self.sequence += 1
+            self._progress.pop(result.get('job_id'), None)
+            self._results.append((self.sequence, {'job_id': result.get('job_id'), 'result': result}))
+            self._cond.notify_all()
+
+    def read(self, after, wait=0):
+        """
+        Returns (sequence, events newer than `after`), waiting up to `wait` seconds for one.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self.sequence > after, min(wait, MAX_EVENT_WAIT))
+            events = [item for item in self._results if item[0] > after]
+            events += [item for item in self._progress.values() if item[0] > after]
+            return self.sequence, [event for _, event in sorted(events, key=lambda item: item[0])]
+
+
+class DaemonServer:
+    """
+    HTTP front of a DownloadService. Requests are handled on their own threads; everything slow
+    (downloads, merges, prefetching) already runs on the service's pools.
+    """
+
+    def __init__(self, service, address=DEFAULT_ADDRESS):
+        self.service = service
+        self.address = address
+        self.events = EventLog()
+        service.progress_listeners.append(self.events.on_progress)
+        service.job_listeners.append(self.events.on_result)
+        if address.startswith('unix:'):
+            socket_path = address[len('unix:'):]
+            if os.path.exists(socket_path):
+                os.remove(socket_path)  # Left over from a daemon that did not shut down cleanly
+            self._httpd = socketserver.ThreadingUnixStreamServer(socket_path, self._make_handler())
+        else:
+            host, _, port = address.rpartition(':')
+            self._httpd = ThreadingHTTPServer((host or '127.0.0.1', int(port)), self._make_handler())
+        self._httpd.daemon_threads = True
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def shutdown(self):
+        # Called from a request thread: serve_forever() returns once that request is answered
+        threading.Thread(target=self._httpd.shutdown, daemon=True).start()
+
+    def close(self):
+        self._httpd.server_close()
+        if self.address.startswith('unix:') and os.path.exists(self.address[len('unix:'):]):
+            os.remove(self.address[len('unix:'):])
+
+    def status(self):
+        service = self.service
+        return {
+            'pid': os.getpid(),
+            'unfinished': service.unfinished_count(),
+            'queued': service.scheduler.pending_count(),
+            'running': len(service.scheduler.running()),
+            'merges': service.postprocess.pending_count(),
+            'bandwidth': service.bandwidth.stats(),
+            'prefetch': service.prefetcher.stats(),
+            'throttled_hosts': service.breaker.snapshot(),
+            'sequence': self.events.sequence,
+        }
+
+    def formats(self, url):
+        table, info_dict = self.service.get_format_table(url)
+        if table is None:
+            return {'kind': 'playlist' if info_dict and 'entries' in info_dict else 'unknown', 'formats': []}
+        return {'kind': 'video', 'title': info_dict.get('title'), 'formats': [
+            {'format_id': record.format_id, 'label': label, 'height': record.height, 'size': table.download_size(record)}
+            for record, label in zip(table, table.labels())]}
+
+    def submit(self, url, download_path, format_id, interactive=True):
+        """
+        Queues a video, or every entry of a playlist (listed now, so each one is in the journal before we answer).
+        """
+        if is_playlist_url(url):
+            urls = [item.url for item in self.service.fetch_playlist_items(url)]
+            weight = BULK_WEIGHT
+        else:
+            urls = [url]
+            weight = INTERACTIVE_WEIGHT if interactive else BULK_WEIGHT
+        return [self._queue(item_url, download_path, format_id, weight) for item_url in urls]
+
+    def _queue(self, url, download_path, format_id, weight):
+        created = self.service.queue_download(url, download_path, format_id, weight=weight)
+        job = self.service.journal.find_job(url, format_id, download_path)
+        # No job: already in the archive, the 'skipped' result went out on the event stream
+        return {'url': url, 'job_id': job['id'] if job else None, 'state': job['state'] if job else 'skipped',
+                'created': created}
+
+    def plan(self, body):
+        plan = self.service.plan_playlist(body['url'], body.get('resolution') or '1080p',
+                                          download_path=body.get('download_path'), budget=body.get('budget'),
+                                          max_item_bytes=body.get('max_item_size'), skip_unknown=bool(body.get('skip_unknown')))
+        return {'summary': plan.summary(), 'total': plan.total, 'downloads': plan.downloads(),
+                'items': [{'url': item.url, 'title': item.title, 'format': item.selector, 'bytes': item.size,
+                           'status': item.status} for item in plan.items]}
+
+    def queue_plan(self, body):
+        jobs = [self._queue(url, body['download_path'], selector, BULK_WEIGHT) for url, selector in body['downloads']]
+        return {'queued': sum(job['created'] for job in jobs), 'jobs': jobs}
+
+    def jobs(self, state=None, since=None):
+        journal = self.service.journal
+        rows = journal.jobs_in_state(state) if state else journal.unfinished_jobs()
+        if since:
+            rows = [row for row in rows if row['updated_at'] >= float(since)]
+        return {'jobs': rows}
+
+    def job_action(self, job_id, action):
+        actions = {'pause': self.service.pause_job, 'resume': self.service.resume_job, 'cancel': self.service.cancel_job}
+        if action not in actions:
+            raise LookupError(f"Unknown action {action}")
+        return {'ok': actions[action](job_id)}
+
+    def settings(self, body):
+        if 'rate_limit' in body:
+            rate_limit = body['rate_limit']
+            self.service.set_rate_limit(parse_rate(rate_limit) if isinstance(rate_limit, str) else rate_limit)
+        return {'bandwidth': self.service.bandwidth.stats()}
+
+    def stop(self):
+        self.service.stop_all()
+        self.shutdown()
+        return {'ok': True}
+
+    def route(self, method, path, query, body):
+        parts = [part for part in path.split('/') if part]
+        if method == 'GET':
+            if parts == ['status']:
+                return self.status()
+            if parts == ['formats']:
+                return self.formats(query['url'])
+            if parts == ['playlist']:
+                return {'entries': [item.as_dict() for item in self.service.fetch_playlist_items(query['url'])]}
+            if parts == ['jobs']:
+                return self.jobs(query.get('state'), query.get('since'))
+            if len(parts) == 2 and parts[0] == 'jobs':
+                job = self.service.journal.get_job(int(parts[1]))
+                if job is None:
+                    raise LookupError(f"No job {parts[1]}")
+                return job
+            if parts == ['events']:
+                sequence, events = self.events.read(int(query.get('after', 0)), float(query.get('wait', 0)))
+                return {'sequence': sequence, 'events': events}
+        elif method == 'POST':
+            if parts == ['downloads']:
+                return {'jobs': self.submit(body['url'], body.get('download_path') or os.getcwd(),
+                                            body.get('format') or '1080p', body.get('interactive', True))}
+            if parts == ['prefetch']:
+                self.service.prefetch_metadata(body['url'])
+                return {'ok': True}
+            if parts == ['plans']:
+                return self.plan(body)
+            if parts == ['plans', 'queue']:
+                return self.queue_plan(body)
+            if len(parts) == 3 and parts[0] == 'jobs':
+                return self.job_action(int(parts[1]), parts[2])
+            if parts == ['settings']:
+                return self.settings(body)
+            if parts == ['archive', 'scan']:
+                return {'added': self.service.archive.scan_folders(body['folders'], with_hashes=body.get('with_hashes', False))}
+            if parts == ['shutdown']:
+                return self.stop()
+        raise LookupError(f"No route for {method} {path}")
+
+    def _make_handler(self):
+        daemon = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if urlparse(self.path).path == '/metrics':
+                    self.send_body(200, daemon.service.metrics.prometheus_text().encode(), 'text/plain; version=0.0.4')
+                    return
+                self.handle_json('GET')
+
+            def do_POST(self):
+                self.handle_json('POST')
+
+            def handle_json(self, method):
+                # Browsers send an Origin and can only POST JSON after a CORS preflight we never answer,
+                # so a web page cannot drive the daemon
+                if self.headers.get('Origin') or (method == 'POST' and self.headers.get_content_type() != 'application/json'):
+                    self.send_json(403, {'error': "Only local non-browser clients with JSON bodies are accepted"})
+                    return
+                parsed = urlparse(self.path)
+                query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+                try:
+                    length = int(self.headers.get('Content-Length') or 0)
+                    body = json.loads(self.rfile.read(length)) if length else {}
+                    self.send_json(200, daemon.route(method, parsed.path, query, body))
+                except (KeyError, ValueError) as e:
+                    self.send_json(400, {'error': f"Bad request: {e}"})
+                except LookupError as e:
+                    self.send_json(404, {'error': str(e)})
+                except Exception as e:
+                    self.send_json(500, {'error': str(e)})
+
+            def send_json(self, status, data):
+                self.send_body(status, json.dumps(data, default=str).encode(), 'application/json')
+
+            def send_body(self, status, body, content_type):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Run the downloader as a local service with a JSON API.")
+    parser.add_argument('--address', default=DEFAULT_ADDRESS,
+                        help="host:port or unix:/path/to/socket to listen on (default: %(default)s)")
+    parser.add_argument('-j', '--jobs', type=int, default=4, help="Number of downloads run in parallel (default: 4)")
+    parser.add_argument('--rate-limit', type=parse_rate, default=None,
+                        help="Total bandwidth cap shared by all jobs, e.g. 500K or 2M bytes/s (default: unlimited)")
+    parser.add_argument('--connections', type=int, default=4,
+                        help="HTTP connections used for each large single-file download (default: 4)")
+    parser.add_argument('--merge-jobs', type=int, default=None,
+                        help="Number of ffmpeg merges run in parallel (default: half the CPU cores)")
+    parser.add_argument('--processes', type=int, nargs='?', const=default_processes(), default=0, metavar='N',
+                        help="Download playlist entries in N worker processes (default N: one per CPU core, "
+                             "at most --jobs and the 3 jobs allowed per host; without the flag: threads only)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    service = DownloadService(max_workers=args.jobs, max_per_host=3, rate_limit=args.rate_limit,
+                              connections=args.connections, merge_workers=args.merge_jobs, processes=args.processes)
+    try:
+        server = DaemonServer(service, args.address)
+    except OSError as e:
+        print(f"Could not listen on {args.address}: {e}")
+        service.close()
+        return 1
+    # SIGTERM stops like Ctrl+C: running jobs keep their partial files and resume on the next start
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.shutdown())
+    resumed = service.resume_unfinished_jobs()
+    prewarm_in_background(service.session_pool)
+    print(f"Listening on {args.address}" + (f", resuming {resumed} unfinished job(s)" if resumed else ""))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("Stopping, unfinished jobs resume on the next start")
+        service.stop_all()
+        server.close()
+        service.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,265 @@
+import os
+import json
+import time
+import socket
+import threading
+import http.client
+from types import SimpleNamespace
+from urllib.parse import urlencode
+
+from playlist_expander import PlaylistEntry
+
+# 'host:port' or 'unix:/path/to/socket'
+DEFAULT_ADDRESS = os.environ.get('YTDL_DAEMON', '127.0.0.1:8719')
+# The daemon lists (or plans) a whole playlist before it answers, which can take minutes on a big channel
+LISTING_TIMEOUT = 3600
+
+
+class DaemonError(Exception):
+    pass
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class DaemonClient:
+    """
+    JSON over HTTP to a running daemon (see daemon.py), on TCP or a Unix socket.
+    Each request uses its own connection, so one client can be shared by several threads.
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, timeout=60):
+        self.address = address
+        self.timeout = timeout
+
+    def _connect(self, timeout):
+        if self.address.startswith('unix:'):
+            return _UnixHTTPConnection(self.address[len('unix:'):], timeout)
+        host, _, port = self.address.rpartition(':')
+        return http.client.HTTPConnection(host or '127.0.0.1', int(port), timeout=timeout)
+
+    def request(self, method, path, body=None, params=None, timeout=None):
+        if params:
+            path = f'{path}?{urlencode({k: v for k, v in params.items() if v is not None})}'
+        connection = self._connect(timeout or self.timeout)
+        try:
+            headers = {'Content-Type': 'application/json'}
+            connection.request(method, path, body=json.dumps(body or {}) if method == 'POST' else None, headers=headers)
+            response = connection.getresponse()
+            payload = response.read()
+        finally:
+            connection.close()
+        data = json.loads(payload) if payload else {}
+        if response.status >= 400:
+            raise DaemonError(data.get('error') or f"Daemon answered {response.status}")
+        return data
+
+    def get(self, path, **params):
+        return self.request('GET', path, params=params)
+
+    def post(self, path, body=None, timeout=None):
+        return self.request('POST', path, body=body, timeout=timeout)
+
+    def ping(self, timeout=0.5):
+        try:
+            self.request('GET', '/status', timeout=timeout)
+            return True
+        except (OSError, ValueError, DaemonError):
+            return False
+
+
+class RemoteFormatTable:
+    """
+    The part of FormatTable the GUI binds to, built from the daemon's /formats answer.
+    """
+
+    def __init__(self, formats):
+        self.formats = formats
+
+    def __len__(self):
+        return len(self.formats)
+
+    def format_ids(self):
+        return [f['format_id'] for f in self.formats]
+
+    def labels(self):
+        return [f['label'] for f in self.formats]
+
+
+class RemotePlan:
+    """
+    A PlaylistPlan computed by the daemon: summary() and downloads() like the local one.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.items = [SimpleNamespace(url=item['url'], title=item['title'], selector=item['format'], size=item['bytes'],
+                                      status=item['status']) for item in data['items']]
+        self.total = data['total']
+
+    def summary(self):
+        return self.data['summary']
+
+    def downloads(self):
+        return [tuple(download) for download in self.data['downloads']]
+
+
+class _RemoteArchive:
+    def __init__(self, client):
+        self.client = client
+
+    def scan_folders(self, folders, with_hashes=False):
+        return self.client.post('/archive/scan', {'folders': list(folders), 'with_hashes': with_hashes})['added']
+
+
+class _RemoteJournal:
+    def __init__(self, client):
+        self.client = client
+
+    def jobs_in_state(self, state):
+        return self.client.get('/jobs', state=state)['jobs']
+
+
+class RemoteDownloadService:
+    """
+    Stands in for DownloadService when a daemon is running: same methods and listeners as far as the
+    GUI and batch mode use them, but jobs, caches and yt-dlp sessions live in the daemon, shared with
+    every other client. Listeners are fed from the daemon's event stream on a background thread.
+    """
+    detached = True  # Jobs keep running in the daemon after this process exits
+    session_pool = None
+
+    def __init__(self, client):
+        self.client = client
+        self.archive = _RemoteArchive(client)
+        self.journal = _RemoteJournal(client)
+        self.progress_listeners = []  # called as listener(d, job_id) from the event thread
+        self.job_listeners = []  # called as listener(result) when a job finishes, fails or is skipped
+        self.session_started = time.time()
+        self._closed = threading.Event()
+        self._sequence = client.get('/status')['sequence']  # Only events from now on
+        self._events_thread = threading.Thread(target=self._events_loop, name='daemon-events', daemon=True)
+        self._events_thread.start()
+
+    def _events_loop(self):
+        while not self._closed.is_set():
+            try:
+                data = self.client.get('/events', after=self._sequence, wait=20)
+            except (OSError, ValueError, DaemonError) as e:
+                print(f"Lost the daemon event stream ({e}), retrying")
+                self._closed.wait(2)
+                continue
+            self._sequence = data['sequence']
+            for event in data['events']:
+                if 'result' in event:
+                    for listener in self.job_listeners:
+                        listener(event['result'])
+                else:
+                    for listener in self.progress_listeners:
+                        listener(event['progress'], event['job_id'])
+
+    def get_format_table(self, video_url):
+        data = self.client.get('/formats', url=video_url)
+        if data['kind'] == 'playlist':
+            return None, {'entries': []}
+        return RemoteFormatTable(data['formats']), {'title': data['title']}
+
+    def prefetch_metadata(self, video_url):
+        try:
+            self.client.post('/prefetch', {'url': video_url})
+        except (OSError, DaemonError) as e:
+            print(f"Could not prefetch {video_url}: {e}")
+
+    def fetch_playlist_items(self, playlist_url):
+        return (PlaylistEntry(**entry) for entry in self.client.get('/playlist', url=playlist_url)['entries'])
+
+    def submit(self, video_url, download_path, format_id, interactive=True):
+        """
+        Queues a video or every entry of a playlist. Returns one dict per video: {'url', 'job_id', 'state', 'created'},
+        job_id is None for videos skipped because they are in the archive.
+        """
+        return self.client.post('/downloads', {'url': video_url, 'download_path': os.path.abspath(download_path),
+                                               'format': format_id, 'interactive': interactive},
+                                timeout=LISTING_TIMEOUT)['jobs']
+
+    def download_video(self, video_url, download_path, format_id):
+        self.submit(video_url, download_path, format_id)
+
+    def queue_download(self, video_url, download_path, format_id, weight=None):
+        jobs = self.submit(video_url, download_path, format_id, interactive=False)
+        return any(job['created'] for job in jobs)
+
+    def plan_playlist(self, playlist_url, resolution, download_path=None, budget=None, max_item_bytes=None, on_progress=None,
+                      skip_unknown=False):
+        return RemotePlan(self.client.post('/plans', {
+            'url': playlist_url, 'resolution': resolution, 'budget': budget, 'max_item_size': max_item_bytes,
+            'skip_unknown': skip_unknown,
+            'download_path': os.path.abspath(download_path) if download_path else None}, timeout=LISTING_TIMEOUT))
+
+    def queue_plan(self, plan, download_path):
+        return sum(job['created'] for job in self.submit_plan(plan, download_path))
+
+    def submit_plan(self, plan, download_path):
+        """
+        Queues the entries of a plan, returns one dict per video like submit().
+        """
+        return self.client.post('/plans/queue', {'downloads': plan.downloads(),
+                                                 'download_path': os.path.abspath(download_path)},
+                                timeout=LISTING_TIMEOUT)['jobs']
+
+    def set_rate_limit(self, rate_limit):
+        """
+        Changes the daemon's total bandwidth cap, shared by every client's downloads.
+        """
+        self.client.post('/settings', {'rate_limit': rate_limit})
+
+    def pause_job(self, job_id):
+        return self.client.post(f'/jobs/{job_id}/pause')['ok']
+
+    def resume_job(self, job_id):
+        return self.client.post(f'/jobs/{job_id}/resume')['ok']
+
+    def cancel_job(self, job_id):
+        return self.client.post(f'/jobs/{job_id}/cancel')['ok']
+
+    def resume_unfinished_jobs(self):
+        return 0  # The daemon resumed them when it started
+
+    def stop_all(self):
+        pass  # Nothing runs here, the daemon's jobs are shared with other clients
+
+    def unfinished_count(self):
+        return self.client.get('/status')['unfinished']
+
+    def join(self, poll_interval=1.0):
+        while self.unfinished_count():
+            time.sleep(poll_interval)
+
+    @property
+    def failed_files(self):
+        return [job['url'] for job in self.client.get('/jobs', state='failed', since=self.session_started)['jobs']]
+
+    @property
+    def downloaded_files(self):
+        return [job['url'] for job in self.client.get('/jobs', state='done', since=self.session_started)['jobs']]
+
+    def close(self):
+        self._closed.set()
+
+
+def connect_daemon(address=DEFAULT_ADDRESS):
+    """
+    Returns a RemoteDownloadService when a daemon answers at `address`, else None.
+    """
+    client = DaemonClient(address)
+    if not client.ping():
+        return None
+    return RemoteDownloadService(client)
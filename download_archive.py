@@ -0,0 +1,226 @@
+import os
+import re
+import time
+import shutil
+import sqlite3
+import hashlib
+import threading
+import subprocess
+
+from playlist_planner import RESOLUTION_HEIGHTS
+
+DEFAULT_ARCHIVE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'youtube_downloader', 'archive.sqlite3')
+
+# Output template used for downloads. The [id] part is what lets us rebuild the archive from file names.
+OUTPUT_TEMPLATE = '%(title)s [%(id)s].%(ext)s'
+
+# Entries found by scanning folders: we know the video is there but not which format was asked for,
+# they only satisfy a resolution request once the file's own resolution is known to meet it.
+# There can be several per video (copies at different resolutions), they are kept per path.
+ANY_FORMAT = '*'
+
+ARCHIVED_FILE_RE = re.compile(r'\[(?P<id>[A-Za-z0-9_-]{11})\]\.(?P<ext>[A-Za-z0-9]+)$')
+PARTIAL_SUFFIXES = ('.part', '.ytdl', '.temp', '.tmp')
+
+
+def probe_height(path):
+    """
+    Height of the video in a media file, 0 for audio only (cover art does not count), None when
+    ffprobe is not installed or cannot read the file.
+    """
+    ffprobe = shutil.which('ffprobe')
+    if not ffprobe:
+        return None
+    command = [ffprobe, '-v', 'error', '-select_streams', 'V:0', '-show_entries', 'stream=height', '-of', 'csv=p=0', path]
+    try:
+        completed = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, timeout=30)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    if completed.returncode != 0:
+        return None
+    height = completed.stdout.strip().split('\n')[0].strip(',')
+    return int(height) if height.isdigit() else 0
+
+
+def scanned_file_fits(height, format_selector):
+    """
+    Whether a file found by a folder scan, `height` pixels high, is what `format_selector` asks for:
+    audio for 'audio only', at least the resolution's height for the others. 'best' and explicit
+    formats cannot be told from the file, so they never match.
+    """
+    if height is None:
+        return False
+    if format_selector == 'audio only':
+        return height == 0
+    target = RESOLUTION_HEIGHTS.get(format_selector)
+    return target is not None and height >= target
+
+
+def _unchanged(record):
+    # The file is still there with the size it was archived with
+    try:
+        return os.path.getsize(record['path']) == record['size']
+    except OSError:
+        return False
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class DownloadArchive:
+    """
+    Index of finished downloads keyed by (video ID, format selector) -> (path, size, sha256), plus the
+    files found by folder scans, video ID -> {path: record}. Both are kept in dicts for O(1) lookups
+    and mirrored to SQLite. The index is global, so a video downloaded into one folder is found when
+    queued for another.
+    """
+
+    def __init__(self, db_path=DEFAULT_ARCHIVE_PATH):
+        if db_path != ':memory:':
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS archive (
+                    video_id TEXT NOT NULL,
+                    format_selector TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    sha256 TEXT,
+                    added_at REAL NOT NULL,
+                    PRIMARY KEY (video_id, format_selector)
+                )''')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS scanned (
+                    path TEXT PRIMARY KEY,
+                    video_id TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    sha256 TEXT,
+                    added_at REAL NOT NULL
+                )''')
+            # Archives from before the scanned table kept one scanned file per video in `archive`
+            self._conn.execute("INSERT OR IGNORE INTO scanned (path, video_id, size, sha256, added_at)"
+                               " SELECT path, video_id, size, sha256, added_at FROM archive WHERE format_selector = ?",
+                               (ANY_FORMAT,))
+            self._conn.execute("DELETE FROM archive WHERE format_selector = ?", (ANY_FORMAT,))
+            rows = self._conn.execute("SELECT video_id, format_selector, path, size, sha256 FROM archive").fetchall()
+            scanned_rows = self._conn.execute("SELECT video_id, path, size, sha256 FROM scanned").fetchall()
+        self._index = {(row[0], row[1]): {'path': row[2], 'size': row[3], 'sha256': row[4]} for row in rows}
+        self._scanned = {}
+        for video_id, path, size, sha256 in scanned_rows:
+            self._scanned.setdefault(video_id, {})[path] = {'path': path, 'size': size, 'sha256': sha256}
+        self._paths = {record['path'] for record in self._index.values()}.union(*self._scanned.values())
+
+    def __len__(self):
+        return len(self._index) + sum(len(files) for files in self._scanned.values())
+
+    def lookup(self, video_id, format_selector):
+        """
+        Returns the archived record for the video/format pair, or None. Otherwise files from folder
+        scans match when their resolution, probed on first use, fits the request (see scanned_file_fits);
+        of several, the highest one. Records whose file is gone or changed size are dropped.
+        """
+        if not video_id:
+            return None
+        key = (video_id, format_selector)
+        record = self._index.get(key)
+        if record is not None:
+            if _unchanged(record):
+                return record
+            self._remove(key)
+        best = None
+        for record in list(self._scanned.get(video_id, {}).values()):
+            if not _unchanged(record):
+                self._remove_scanned(video_id, record['path'])
+                continue
+            if 'height' not in record:
+                record['height'] = probe_height(record['path'])
+            if scanned_file_fits(record['height'], format_selector) and (best is None or record['height'] > best['height']):
+                best = record
+        return best
+
+    def add(self, video_id, format_selector, path, sha256=None, hash_file=True):
+        """
+        Records a finished download. The hash is computed from the file if not given and hash_file is set.
+        """
+        size = os.path.getsize(path)
+        if sha256 is None and hash_file:
+            sha256 = file_sha256(path)
+        record = {'path': os.path.abspath(path), 'size': size, 'sha256': sha256}
+        with self._lock, self._conn:
+            self._paths.add(record['path'])
+            if format_selector == ANY_FORMAT:
+                self._scanned.setdefault(video_id, {})[record['path']] = record
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO scanned (path, video_id, size, sha256, added_at) VALUES (?, ?, ?, ?, ?)",
+                    (record['path'], video_id, size, sha256, time.time()))
+            else:
+                self._index[(video_id, format_selector)] = record
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO archive (video_id, format_selector, path, size, sha256, added_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (video_id, format_selector, record['path'], size, sha256, time.time()))
+        return record
+
+    def scan_folders(self, folders, with_hashes=False):
+        """
+        Adds every finished '<title> [<id>].<ext>' file found in `folders` that isn't indexed yet.
+        Hashing is optional since it means reading every file. Returns the number of files added.
+        """
+        added = 0
+        for folder in folders:
+            try:
+                names = os.listdir(folder)
+            except OSError as e:
+                print(f"Could not scan {folder}: {e}")
+                continue
+            for name in names:
+                if name.endswith(PARTIAL_SUFFIXES):
+                    continue
+                match = ARCHIVED_FILE_RE.search(name)
+                if not match:
+                    continue
+                path = os.path.abspath(os.path.join(folder, name))
+                if path in self._paths:
+                    continue
+                self.add(match.group('id'), ANY_FORMAT, path, hash_file=with_hashes)
+                added += 1
+        return added
+
+    def rebuild(self, folders, with_hashes=False):
+        """
+        Throws the index away and rebuilds it from the files in `folders`.
+        """
+        with self._lock, self._conn:
+            self._index.clear()
+            self._scanned.clear()
+            self._paths.clear()
+            self._conn.execute("DELETE FROM archive")
+            self._conn.execute("DELETE FROM scanned")
+        return self.scan_folders(folders, with_hashes=with_hashes)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _remove(self, key):
+        with self._lock, self._conn:
+            record = self._index.pop(key, None)
+            if record:
+                self._paths.discard(record['path'])
+            self._conn.execute("DELETE FROM archive WHERE video_id = ? AND format_selector = ?", key)
+
+    def _remove_scanned(self, video_id, path):
+        with self._lock, self._conn:
+            files = self._scanned.get(video_id, {})
+            if files.pop(path, None):
+                self._paths.discard(path)
+            if not files:
+                self._scanned.pop(video_id, None)
+            self._conn.execute("DELETE FROM scanned WHERE path = ?", (path,))
@@ -0,0 +1,183 @@
+import time
+import heapq
+import bisect
+import itertools
+import threading
+from collections import defaultdict
+from urllib.parse import urlparse
+
+# Lower runs first
+INTERACTIVE_PRIORITY = 0  # A video the user asked for right now
+BULK_PRIORITY = 10  # Playlist entries and resumed jobs
+
+
+class DownloadScheduler:
+    """
+    Fixed size worker pool for download jobs.
+    Jobs are taken by priority, then in FIFO order, skipping over jobs whose host already has
+    `max_per_host` downloads running, or fewer while the host's circuit breaker (see retry_policy)
+    holds it back. Jobs can be submitted with a delay (retries). Queued jobs can be cancelled by key.
+    """
+
+    def __init__(self, max_workers=4, max_per_host=3, breaker=None):
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host
+        self.breaker = breaker
+        self._jobs = []  # (priority, sequence, host, url, key, fn, args), kept sorted
+        self._delayed = []  # (due, job) heap of jobs submitted with a delay
+        self._sequence = itertools.count()
+        self._running = {}  # key -> (priority, started_at, host) for jobs submitted with a key
+        self._active_per_host = defaultdict(int)
+        self._unfinished = 0
+        self._shutdown = False
+        self._cond = threading.Condition()
+        self._workers = []
+        for i in range(max_workers):
+            worker = threading.Thread(target=self._worker_loop, name=f'download-worker-{i}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, url, fn, *args, priority=BULK_PRIORITY, key=None, delay=0):
+        """
+        Queues fn(*args) as a job for `url`. The URL's host is used for the per-host limit,
+        `key` (e.g. a job id) identifies the job for cancel() and running().
+        With `delay` the job only joins the queue after that many seconds.
+        """
+        host = urlparse(url).hostname or ''
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("Scheduler has been shut down")
+            job = (priority, next(self._sequence), host, url, key, fn, args)
+            if delay > 0:
+                heapq.heappush(self._delayed, (time.monotonic() + delay, job))
+            else:
+                bisect.insort(self._jobs, job)
+            self._unfinished += 1
+            self._cond.notify_all()
+
+    def wake(self):
+        """
+        Makes the workers look at the queue again, e.g. after a host's circuit breaker changed.
+        """
+        with self._cond:
+            self._cond.notify_all()
+
+    def cancel(self, key):
+        """
+        Drops the queued job submitted with `key`. Returns False if it is not queued (running or unknown).
+        """
+        with self._cond:
+            for index, job in enumerate(self._jobs):
+                if job[4] == key:
+                    del self._jobs[index]
+                    self._unfinished -= 1
+                    self._cond.notify_all()
+                    return True
+            for index, (_, job) in enumerate(self._delayed):
+                if job[4] == key:
+                    self._delayed[index] = self._delayed[-1]
+                    self._delayed.pop()
+                    heapq.heapify(self._delayed)
+                    self._unfinished -= 1
+                    self._cond.notify_all()
+                    return True
+        return False
+
+    def is_queued(self, key):
+        with self._cond:
+            return any(job[4] == key for job in self._jobs) or any(job[4] == key for _, job in self._delayed)
+
+    def running(self):
+        """
+        {key: (priority, started_at, host)} of the running jobs that were submitted with a key.
+        """
+        with self._cond:
+            return dict(self._running)
+
+    def pending_count(self):
+        with self._cond:
+            return len(self._jobs) + len(self._delayed)
+
+    def upcoming_urls(self, limit):
+        """
+        URLs of the next `limit` queued jobs, in the order they are likely to start.
+        """
+        with self._cond:
+            return [job[3] for job in self._jobs[:limit]]
+
+    def unfinished_count(self):
+        with self._cond:
+            return self._unfinished
+
+    def join(self, timeout=None):
+        """
+        Blocks until every submitted job has finished. Returns False if the timeout expired first.
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self._unfinished == 0, timeout)
+
+    def shutdown(self, wait=True, cancel_pending=False):
+        """
+        Stops the workers. With cancel_pending, queued jobs that haven't started are dropped.
+        """
+        with self._cond:
+            if cancel_pending:
+                self._unfinished -= len(self._jobs) + len(self._delayed)
+                self._jobs.clear()
+                self._delayed.clear()
+            self._shutdown = True
+            self._cond.notify_all()
+        if wait:
+            for worker in self._workers:
+                worker.join()
+
+    def _host_limit(self, host):
+        limit = self.breaker.limit(host) if self.breaker else None
+        return self.max_per_host if limit is None else min(limit, self.max_per_host)
+
+    def _take_job(self):
+        # Called with the condition held. Returns the most urgent job whose host has a free slot.
+        now = time.monotonic()
+        while self._delayed and self._delayed[0][0] <= now:
+            bisect.insort(self._jobs, heapq.heappop(self._delayed)[1])
+        limits = {}
+        for index, job in enumerate(self._jobs):
+            host = job[2]
+            if host not in limits:
+                limits[host] = self._host_limit(host)
+            if self._active_per_host[host] < limits[host]:
+                del self._jobs[index]
+                return job
+        return None
+
+    def _next_wakeup(self):
+        # Seconds until a delayed job is due or a held back host opens again, None to wait for a notify
+        waits = [self._delayed[0][0] - time.monotonic()] if self._delayed else []
+        if self.breaker:
+            waits += [wait for wait in map(self.breaker.retry_in, {job[2] for job in self._jobs}) if wait]
+        return max(min(waits), 0.01) if waits else None
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                job = self._take_job()
+                while job is None:
+                    if self._shutdown and not self._jobs and not self._delayed:
+                        return
+                    self._cond.wait(self._next_wakeup())
+                    job = self._take_job()
+                priority, _, host, _, key, fn, args = job
+                self._active_per_host[host] += 1
+                if key is not None:
+                    self._running[key] = (priority, time.monotonic(), host)
+
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"Download job failed: {e}")
+            finally:
+                with self._cond:
+                    self._active_per_host[host] -= 1
+                    self._running.pop(key, None)
+                    self._unfinished -= 1
+                    self._cond.notify_all()
@@ -0,0 +1,810 @@
+import os
+import copy
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from bandwidth import BandwidthManager, BULK_WEIGHT, INTERACTIVE_WEIGHT
+from download_archive import DownloadArchive, OUTPUT_TEMPLATE
+from download_scheduler import DownloadScheduler, BULK_PRIORITY, INTERACTIVE_PRIORITY
+from format_selection import FormatTable, build_format_selection
+from job_control import JobControl, JobInterrupted, CANCELLED, PAUSED, PREEMPTED, STOPPED
+from job_journal import JobJournal
+from metadata_cache import MetadataCache, extract_info_cached, download_with_cached_info
+from metrics import Metrics
+from output_writer import IOStats, DEFAULT_BUFFER_SIZE
+from playlist_expander import iter_playlist_entries
+from playlist_planner import PlaylistPlan, free_space_budget
+from postprocess_stage import PostProcessStage
+from prefetcher import MetadataPrefetcher, CLIPBOARD_PRIORITY
+from process_pool import ProcessPool
+from retry_policy import RetryPolicy, HostCircuitBreaker, classify_error, PERMANENT
+from segmented_download import SegmentedDownloader, remove_partial, discard_interrupted
+from session_pool import YoutubeDLPool
+from startup import INFO_OPTIONS
+from url_utils import canonical_video_id, cache_key_for_url
+
+
+def is_playlist_url(video_url):
+    """
+    Enhanced check to determine if a URL is likely a playlist. This method attempts to catch more edge cases
+    by looking for common playlist indicators in YouTube URLs.
+    """
+    from urllib.parse import urlparse, parse_qs
+
+    parsed_url = urlparse(video_url)
+    query_params = parse_qs(parsed_url.query)
+
+    # Common query parameters that indicate a playlist
+    playlist_indicators = ['list', 'p']
+
+    # Check for standard playlist URLs
+    if any(indicator in query_params for indicator in playlist_indicators):
+        return True
+
+    # Check for other YouTube URL structures that might indicate a playlist or channel
+    path_segments = parsed_url.path.split('/')
+    if 'channel' in path_segments or 'c' in path_segments or 'user' in path_segments:
+        return True
+
+    return False
+
+
+class DownloadService:
+    """
+    Everything needed to fetch formats and run downloads, without any GUI: the job journal,
+    download archive, metadata cache, YoutubeDL session pool and the download scheduler.
+    Front ends subscribe to progress and job-finished events through listeners.
+    """
+
+    # Metrics phase of each yt-dlp post-processor key, anything else counts as 'postprocess'
+    POSTPROCESSOR_PHASES = {'Merger': 'merge', 'MoveFiles': 'finalize'}
+    detached = False  # Jobs run in this process (RemoteDownloadService: in the daemon, they outlive us)
+    # Single-file formats at least this big are fetched over several HTTP connections
+    SEGMENTED_MIN_SIZE = 32 * 1024**2
+
+    def __init__(self, max_workers=4, max_per_host=3, quiet=False, rate_limit=None, connections=4,
+                 merge_workers=None, prefetch_lookahead=8, journal=None, archive=None, metadata_cache=None, metrics=None,
+                 write_buffer=DEFAULT_BUFFER_SIZE, processes=0, retry_policy=None, breaker=None):
+        self.quiet = quiet
+        self.connections = connections  # HTTP connections per large single-file download, 1 disables segmenting
+        self.write_buffer = write_buffer  # Bytes per write() for the files we write, also yt-dlp's first read size
+        self.bandwidth = BandwidthManager(rate_limit)
+        self.journal = journal or JobJournal()
+        self.archive = archive if archive is not None else DownloadArchive()  # An empty archive is falsy (__len__)
+        self.metadata_cache = metadata_cache or MetadataCache()
+        self.metrics = metrics or Metrics()
+        self.session_pool = YoutubeDLPool()
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.breaker = breaker or HostCircuitBreaker()  # Throttling on a host holds back every job on it
+        self.scheduler = DownloadScheduler(max_workers=max_workers, max_per_host=max_per_host, breaker=self.breaker)
+        self.postprocess = PostProcessStage(max_workers=merge_workers)  # ffmpeg merges, sized separately from downloads
+        self.prefetch_lookahead = prefetch_lookahead  # Queued downloads whose metadata is resolved ahead of time
+        self.prefetcher = MetadataPrefetcher(self._extract_info, self._has_metadata)
+        self.control = JobControl()  # Cancel / pause / preempt requests, acted on by the jobs' own threads
+        self.stopping = False
+        self.playlist_threads = []
+        self.progress_listeners = []  # called as listener(d, job_id) from worker threads
+        self.job_listeners = []  # called as listener(result) when a job finishes, fails or is skipped
+        self.throttle_listeners = []  # called as listener(host, seconds) when the circuit breaker opens for a host
+        self.job_stats = {}
+        self.failed_kinds = {}  # job_id -> error kind of the jobs that failed in this session, for retry_failed_jobs()
+        self._stats_lock = threading.Lock()
+        self._format_tables = OrderedDict()  # cache key -> (info_dict, FormatTable)
+        # Bulk jobs (playlist entries) run in this many worker processes, 0 keeps them on our own threads.
+        # max_workers and max_per_host are split between the workers so they still hold in total, which
+        # leaves no use for more workers than either; merges and the rate limit are split too.
+        self.processes = min(processes, max_workers, max_per_host)
+        self.process_pool = None
+        self._pool_options = {'max_workers': max_workers, 'max_per_host': max_per_host, 'rate_limit': rate_limit,
+                              'connections': connections, 'merge_workers': merge_workers,
+                              'prefetch_lookahead': prefetch_lookahead, 'write_buffer': write_buffer}
+        self._pool_lock = threading.Lock()
+        if self.processes and ':memory:' in (self.journal.db_path, self.archive.db_path):
+            raise ValueError("Worker processes need the journal and archive in files they can open")
+
+    def get_video_info(self, video_url):
+        """
+        Returns the info dict for `video_url`, from the metadata cache when possible.
+        """
+        self.prefetcher.wait_for(video_url)
+        return self._extract_info(video_url)
+
+    def prefetch_metadata(self, video_url):
+        """
+        Starts resolving a single video's metadata in the background, e.g. as soon as its URL is copied.
+        """
+        if not is_playlist_url(video_url):
+            self.prefetcher.prefetch(video_url, CLIPBOARD_PRIORITY)
+
+    # Format listing is waited on by the user, its retries are fewer and shorter than a download's
+    LISTING_ATTEMPTS = 3
+    LISTING_MAX_DELAY = 10.0
+
+    def _extract_info(self, video_url):
+        attempt = 0
+        while True:
+            try:
+                with self.metrics.span('extract_info', url=video_url), self.session_pool.session(INFO_OPTIONS) as ydl:
+                    return extract_info_cached(ydl, video_url, self.metadata_cache)
+            except Exception as e:
+                attempt += 1
+                kind, _ = self._record_error(video_url, e)
+                if not self.retry_policy.should_retry(kind, attempt, self.LISTING_ATTEMPTS):
+                    raise
+                delay = self.retry_policy.delay(kind, attempt, self.LISTING_MAX_DELAY)
+                print(f"Fetching {video_url} failed ({kind}: {e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def get_format_table(self, video_url):
+        """
+        Returns (FormatTable, info_dict) for a single video. The table is built once per info dict.
+        For playlists the table is None.
+        """
+        info_dict = self.get_video_info(video_url)
+        if not info_dict or 'entries' in info_dict:
+            return None, info_dict
+        key = cache_key_for_url(video_url)
+        with self._stats_lock:
+            cached = self._format_tables.get(key)
+            if cached and cached[0] is info_dict:
+                self._format_tables.move_to_end(key)
+                return cached[1], info_dict
+        format_table = FormatTable(info_dict)
+        with self._stats_lock:
+            self._format_tables[key] = (info_dict, format_table)
+            while len(self._format_tables) > 32:
+                self._format_tables.popitem(last=False)
+        return format_table, info_dict
+
+    def fetch_playlist_items(self, playlist_url):
+        """
+        Returns a generator of PlaylistEntry records. Pages are fetched as the generator is consumed,
+        formats are resolved later, per entry, by download_single_video.
+        """
+        return iter_playlist_entries(playlist_url)
+
+    def plan_playlist(self, playlist_url, resolution, download_path=None, budget=None, max_item_bytes=None, on_progress=None,
+                      skip_unknown=False):
+        """
+        Resolves the metadata of every entry and picks each one's format so the projected total fits
+        `budget` bytes (and the free space of `download_path`), with no entry over `max_item_bytes`.
+        Entries of unknown size are downloaded on top of the budget unless `skip_unknown`. Entries already
+        in the archive at `resolution` are not resolved, they are in the plan as 'archived'.
+        Nothing is downloaded; the metadata stays cached for the downloads. on_progress(done, total)
+        is called as entries are resolved.
+        """
+        if download_path:
+            free = free_space_budget(download_path)
+            budget = min(budget, free) if budget is not None else free
+        plan = PlaylistPlan(resolution, budget=budget, max_item_bytes=max_item_bytes, skip_unknown=skip_unknown)
+        urls = []
+        for item in self.fetch_playlist_items(playlist_url):
+            if self.archive.lookup(canonical_video_id(item.url), resolution):
+                plan.add_archived(item.url, item.title)
+            else:
+                urls.append(item.url)
+
+        def resolve(url):
+            try:
+                info_dict = self.get_video_info(url)
+                return info_dict.get('title'), FormatTable(info_dict)
+            except Exception as e:
+                print(f"Could not resolve {url} for planning: {e}")
+                return None, None
+
+        with ThreadPoolExecutor(max_workers=self.scheduler.max_workers, thread_name_prefix='planner') as executor:
+            for done, (url, (title, table)) in enumerate(zip(urls, executor.map(resolve, urls)), start=1):
+                plan.add(url, title, table)
+                if on_progress:
+                    on_progress(done, len(urls))
+        return plan.fit()
+
+    def queue_plan(self, plan, download_path):
+        """
+        Queues the entries of a PlaylistPlan with their planned formats. Returns the number queued.
+        """
+        return sum(bool(self.queue_download(url, download_path, selector)) for url, selector in plan.downloads())
+
+    def download_video(self, video_url, download_path, format_id):
+        if is_playlist_url(video_url):
+            # Playlists are always expanded again so new entries get picked up, finished entries are skipped
+            job_id, _ = self.journal.add_job(video_url, format_id, download_path, kind='playlist')
+            self.start_playlist_expansion(video_url, download_path, format_id, job_id)
+        else:
+            # A single video the user asked for gets a bigger share of the bandwidth than playlist entries
+            self.queue_download(video_url, download_path, format_id, weight=INTERACTIVE_WEIGHT)
+
+    def queue_download(self, video_url, download_path, format_id, weight=BULK_WEIGHT):
+        archived = self.archive.lookup(canonical_video_id(video_url), format_id)
+        if archived:
+            print(f"Skipping {video_url}, already downloaded to {archived['path']}")
+            self._notify_job_finished({'job_id': None, 'url': video_url, 'format': format_id, 'status': 'skipped',
+                                       'filename': archived['path'], 'bytes': archived['size']})
+            return False
+        job_id, created = self.journal.add_job(video_url, format_id, download_path)
+        if created:
+            self.submit_job(job_id, video_url, download_path, format_id, weight)
+            return True
+        job = self.journal.get_job(job_id)
+        with self._stats_lock:
+            known = job_id in self.job_stats
+        if job['state'] in ('queued', 'running') and not known:
+            # Left unfinished by an earlier run that nobody resumed (batch mode doesn't), nothing else would finish it
+            print(f"Resuming {video_url} from an earlier run")
+            self.submit_job(job_id, video_url, download_path, format_id, weight)
+            return True
+        print(f"Skipping {video_url}, already queued or downloaded")
+        if job['state'] == 'paused':
+            self.resume_job(job_id)
+        elif job['state'] == 'done':
+            self._notify_job_finished({'job_id': job_id, 'url': video_url, 'format': format_id, 'status': 'skipped',
+                                       'filename': job['filename'], 'bytes': job['bytes_done']})
+        return False
+
+    def submit_job(self, job_id, video_url, download_path, format_id, weight=BULK_WEIGHT):
+        # Interactive jobs (bigger bandwidth weight) also jump the queue and may preempt a running bulk job
+        priority = INTERACTIVE_PRIORITY if weight > BULK_WEIGHT else BULK_PRIORITY
+        with self._stats_lock:
+            self.job_stats[job_id] = dict(self._new_stats(time.time()), weight=weight, priority=priority,
+                                          args=(video_url, download_path, format_id))
+        self.metrics.start_job(job_id, video_url)
+        self._schedule(job_id)
+        if priority == INTERACTIVE_PRIORITY:
+            self._preempt_bulk_job(video_url)
+        self._prefetch_upcoming()
+
+    def _schedule(self, job_id, delay=0):
+        stats = self._job_stats(job_id)
+        video_url, download_path, format_id = stats['args']
+        if self.processes and stats['priority'] == BULK_PRIORITY:
+            self._get_process_pool().submit(job_id, video_url, download_path, format_id)
+            return
+        self.scheduler.submit(video_url, self.download_single_video, video_url, download_path, format_id, job_id,
+                              priority=stats['priority'], key=job_id, delay=delay)
+
+    def _get_process_pool(self):
+        # Started with the first bulk job, a single video never pays for the worker processes
+        with self._pool_lock:
+            if self.process_pool is None:
+                options = self._pool_options
+                merge_workers = options['merge_workers'] or self.postprocess.max_workers
+                self.process_pool = ProcessPool(self.processes, {
+                    'max_workers': options['max_workers'],
+                    'max_per_host': options['max_per_host'],
+                    'merge_workers': -(-merge_workers // self.processes),  # Rounded up, merges are not per host
+                    'rate_limit': options['rate_limit'] / self.processes if options['rate_limit'] else None,
+                    'connections': options['connections'],
+                    'prefetch_lookahead': options['prefetch_lookahead'],
+                    'write_buffer': options['write_buffer'],
+                    'journal_path': self.journal.db_path,
+                    'archive_path': self.archive.db_path,
+                    'cache_dir': self.metadata_cache.cache_dir,
+                }, on_progress=self._shard_progress, on_result=self._shard_finished, on_lost=self._shard_lost,
+                    on_throttled=self.breaker.hold)
+            return self.process_pool
+
+    def _remove_from_pool(self, job_id):
+        # A bulk job waiting for a worker process, like one still in our scheduler's queue
+        return bool(self.process_pool) and self.process_pool.remove(job_id)
+
+    def _shard_progress(self, job_id, status, downloaded_bytes, total_bytes, speed, eta, filename, title):
+        d = {'status': status, 'downloaded_bytes': downloaded_bytes, 'total_bytes': total_bytes, 'speed': speed,
+             'eta': eta, 'filename': filename}
+        if title:
+            d['info_dict'] = {'title': title}
+        self._notify_progress(d, job_id)
+
+    def _shard_finished(self, result):
+        # The worker did the journal and archive bookkeeping in the shared files, our archive index only
+        # needs the new entry; queue times are ours, the worker only saw the job once it took it
+        job_id = result['job_id']
+        with self._stats_lock:
+            stats = self.job_stats.pop(job_id, None)
+        if stats and result.get('started_at'):
+            result['queued_at'] = stats['queued_at']
+            result['queue_wait'] = result['started_at'] - stats['queued_at']
+        video_id = canonical_video_id(result['url'])
+        if result['status'] == 'done' and video_id and result.get('filename') and os.path.exists(result['filename']):
+            self.archive.add(video_id, result['format'], result['filename'], sha256=result.get('sha256'), hash_file=False)
+        if result['status'] == 'failed':
+            with self._stats_lock:
+                self.failed_kinds[job_id] = result.get('error_kind')
+        self.metrics.record_job(job_id, result)
+        self._notify_job_finished(result)
+
+    def _shard_lost(self, job_id):
+        video_url, _, format_id = self._job_stats(job_id)['args']
+        self._fail_job(job_id, video_url, format_id, RuntimeError("The download worker process exited"))
+
+    def _preempt_bulk_job(self, video_url):
+        """
+        Makes room for an interactive job that was just queued. When no worker (or no slot for its host)
+        is free, the bulk job that started last is sent back to the queue; it resumes from its .part file
+        (a segmented download from the contiguous part its resume state records).
+        """
+        host = urlparse(video_url).hostname or ''
+        running = self.scheduler.running()
+        same_host = {job_id: job for job_id, job in running.items() if job[2] == host}
+        if len(running) < self.scheduler.max_workers and len(same_host) < self.scheduler.max_per_host:
+            return
+        candidates = same_host if len(same_host) >= self.scheduler.max_per_host else running
+        bulk_jobs = [(started_at, job_id) for job_id, (priority, started_at, _) in candidates.items()
+                     if priority >= BULK_PRIORITY and not self.control.requested(job_id)]
+        if bulk_jobs:
+            self.control.request(max(bulk_jobs)[1], PREEMPTED)
+
+    def set_rate_limit(self, rate_limit):
+        """
+        Changes the total bandwidth cap (bytes/s, None for unlimited), worker processes included.
+        """
+        self.bandwidth.set_rate_limit(rate_limit)
+        self._pool_options['rate_limit'] = rate_limit
+        if self.process_pool:
+            self.process_pool.set_rate_limit(rate_limit)
+
+    def cancel_job(self, job_id):
+        """
+        Cancels a queued, running or paused job and removes its partial file. Running jobs stop at their
+        next progress update; a playlist stops queueing entries.
+        """
+        job = self.journal.get_job(job_id)
+        if not job or job['state'] in ('done', 'failed', 'cancelled'):
+            return False
+        if self.scheduler.cancel(job_id) or self._remove_from_pool(job_id) or job['state'] == 'paused':
+            self._interrupted(job_id, job['url'], job['format_selector'], CANCELLED)
+        elif self.process_pool and self.process_pool.request(job_id, CANCELLED):
+            pass  # The worker process running it cancels it
+        else:
+            self.control.request(job_id, CANCELLED)
+        return True
+
+    def pause_job(self, job_id):
+        """
+        Pauses a queued or running job, keeping its partial file. Its worker slot is freed straight away.
+        """
+        job = self.journal.get_job(job_id)
+        if not job or job['kind'] != 'video' or job['state'] not in ('queued', 'running'):
+            return False
+        if self.scheduler.cancel(job_id) or self._remove_from_pool(job_id):
+            self._interrupted(job_id, job['url'], job['format_selector'], PAUSED)
+        elif self.process_pool and self.process_pool.request(job_id, PAUSED):
+            pass
+        else:
+            self.control.request(job_id, PAUSED)
+        return True
+
+    def resume_job(self, job_id):
+        """
+        Queues a paused job again (also one paused in an earlier session). It continues its partial file.
+        """
+        job = self.journal.get_job(job_id)
+        if not job or job['state'] != 'paused':
+            return False
+        self.control.clear(job_id)
+        self.journal.mark_queued(job_id)
+        with self._stats_lock:
+            known = job_id in self.job_stats
+        if known:
+            self.metrics.enter(job_id, 'queued')
+            self._schedule(job_id)
+        else:
+            self.submit_job(job_id, job['url'], job['download_path'], job['format_selector'])
+        return True
+
+    def stop_all(self):
+        """
+        Stops everything for a quick exit. Queued jobs stay queued in the journal and running ones are
+        interrupted with their partial files kept, so resume_unfinished_jobs() picks them up on the next start.
+        """
+        self.stopping = True
+        self.prefetcher.close()
+        self.scheduler.shutdown(wait=False, cancel_pending=True)
+        for job_id in self.scheduler.running():
+            self.control.request(job_id, STOPPED)
+        self.postprocess.shutdown(wait=False)
+        if self.process_pool:
+            self.process_pool.stop()
+
+    def _interrupted(self, job_id, video_url, format_id, reason):
+        self.control.clear(job_id)
+        self.bandwidth.unregister(job_id)
+        if reason == CANCELLED:
+            job = self.journal.get_job(job_id)
+            if job and job['partial_path']:
+                remove_partial(job['partial_path'])
+            self.journal.mark_cancelled(job_id)
+            self._finish_job(job_id, video_url, format_id, 'cancelled')
+        elif reason == PREEMPTED:
+            self.journal.mark_queued(job_id)
+            self.metrics.enter(job_id, 'queued')
+            self._notify_progress({'status': 'queued'}, job_id)
+            self._schedule(job_id)
+        elif reason == PAUSED:
+            self.journal.mark_paused(job_id)
+            self.metrics.enter(job_id, 'paused')
+            self._notify_progress({'status': 'paused'}, job_id)
+        else:
+            # Shutting down: left queued in the journal for the next start
+            self.journal.mark_queued(job_id)
+
+    def start_playlist_expansion(self, playlist_url, download_path, format_id, job_id):
+        # Expand the playlist in the background so the first items start downloading right away
+        playlist_thread = threading.Thread(target=self.enqueue_playlist, args=(playlist_url, download_path, format_id, job_id), daemon=True)
+        playlist_thread.start()
+        self.playlist_threads.append(playlist_thread)
+
+    def enqueue_playlist(self, playlist_url, download_path, format_id, job_id):
+        self.journal.mark_running(job_id)
+        queued = 0
+        try:
+            for item in self.fetch_playlist_items(playlist_url):
+                if self.stopping:
+                    return  # Still 'running' in the journal, so it is expanded again on the next start
+                if self.control.requested(job_id) == CANCELLED:
+                    self.control.clear(job_id)
+                    self.journal.mark_cancelled(job_id)
+                    self._notify_job_finished({'job_id': job_id, 'url': playlist_url, 'format': format_id, 'status': 'cancelled'})
+                    return
+                if self.queue_download(item.url, download_path, format_id):
+                    queued += 1
+            self.journal.mark_done(job_id)
+        except Exception as e:
+            print(f"Error listing playlist {playlist_url}: {e}")
+            self.journal.mark_failed(job_id, e)
+            self._notify_job_finished({'job_id': job_id, 'url': playlist_url, 'format': format_id, 'status': 'failed', 'error': str(e)})
+        finally:
+            print(f"Queued {queued} playlist item(s) from {playlist_url}")
+
+    def resume_unfinished_jobs(self):
+        """
+        Re-queues jobs left queued or running by a previous run. yt-dlp continues their .part files
+        since the output template and format are the same as before. Returns the number of jobs resumed.
+        """
+        unfinished_jobs = self.journal.unfinished_jobs()
+        for job in unfinished_jobs:
+            if job['kind'] == 'playlist':
+                self.start_playlist_expansion(job['url'], job['download_path'], job['format_selector'], job['id'])
+            else:
+                self.submit_job(job['id'], job['url'], job['download_path'], job['format_selector'])
+        return len(unfinished_jobs)
+
+    def download_single_video(self, video_url, download_path, format_id, job_id):
+        stats = self._job_stats(job_id)
+        stats['started_at'] = time.time()
+        timer = self.metrics.job(job_id) or self.metrics.start_job(job_id, video_url)
+        timer.enter('extract')
+        self._prefetch_upcoming()
+        if self.control.requested(job_id):
+            self._interrupted(job_id, video_url, format_id, self.control.requested(job_id))
+            return
+        video_id = canonical_video_id(video_url)
+        archived = self.archive.lookup(video_id, format_id)
+        if archived:
+            self.journal.mark_done(job_id, archived['path'], archived['sha256'])
+            self._finish_job(job_id, video_url, format_id, 'skipped', filename=archived['path'], sha256=archived['sha256'])
+            return
+        video_path = os.path.join(download_path, OUTPUT_TEMPLATE)
+        ydl_opts = {
+            'format': build_format_selection(format_id),
+            'outtmpl': video_path,
+            'buffersize': self.write_buffer,
+            'progress_hooks': [lambda d: self.progress_hook(d, job_id)],
+            'postprocessor_hooks': [lambda d: self.postprocessor_hook(d, job_id)],
+            # 'verbose': True,
+        }
+        if self.quiet:
+            ydl_opts.update({'quiet': True, 'noprogress': True, 'no_warnings': True})
+        self.journal.mark_running(job_id)
+        self.bandwidth.register(job_id, stats.get('weight', BULK_WEIGHT))
+        try:
+            with self.session_pool.session(ydl_opts) as ydl:
+                selected = self.select_formats(ydl, video_url)
+                if self.download_for_merge(ydl, video_url, selected, format_id, job_id):
+                    return  # The post-processing stage finishes the job once the streams are merged
+                if not self.download_segmented(ydl, video_url, selected, job_id):
+                    download_with_cached_info(ydl, video_url, self.metadata_cache)
+            self._complete_job(job_id, video_url, format_id)
+        except JobInterrupted as e:
+            self._interrupted(job_id, video_url, format_id, e.reason)
+        except Exception as e:
+            self._retry_or_fail(job_id, video_url, format_id, e)
+
+    def _record_error(self, video_url, error):
+        # Classifies the error and lets the host's circuit breaker count it, returns (kind, HTTP status)
+        kind, status = classify_error(error)
+        host = urlparse(video_url).hostname or ''
+        seconds = self.breaker.record_failure(host, kind)
+        if seconds:
+            self.scheduler.wake()
+            if self.process_pool:
+                self.process_pool.hold_host(host, seconds)  # Our interactive jobs were throttled, the workers hold too
+            for listener in self.throttle_listeners:
+                listener(host, seconds)
+        return kind, status
+
+    def _retry_or_fail(self, job_id, video_url, format_id, error):
+        """
+        Sends a failed download back to the queue after a backoff delay, unless the error is permanent,
+        the job is out of attempts or we are shutting down. It continues its .part file.
+        """
+        kind, status = self._record_error(video_url, error)
+        stats = self._job_stats(job_id)
+        stats['attempts'] += 1
+        self.bandwidth.unregister(job_id)
+        if self.stopping or not self.retry_policy.should_retry(kind, stats['attempts']):
+            self._fail_job(job_id, video_url, format_id, error, kind)
+            return
+        delay = self.retry_policy.delay(kind, stats['attempts'])
+        print(f"Download of {video_url} failed ({kind}: {error}), "
+              f"retry {stats['attempts']}/{self.retry_policy.max_attempts - 1} in {delay:.1f}s")
+        if status == 403:
+            # Stream URLs expire and a 403 often means ours did: resolve the metadata again
+            self.metadata_cache.invalidate(cache_key_for_url(video_url))
+        self.metrics.add_retries(job_id)
+        self.journal.mark_queued(job_id)
+        self.metrics.enter(job_id, 'queued')
+        self._notify_progress({'status': 'queued'}, job_id)
+        self._schedule(job_id, delay=delay)
+
+    def retry_failed_jobs(self, job_ids=None):
+        """
+        End-of-run retry pass: queues again the jobs of this session (or those of `job_ids`) that failed
+        with a transient or throttled error once their own retries ran out. Returns the ids queued.
+        """
+        if self.stopping:
+            return []  # stop_all() shut the scheduler down, failed jobs stay failed
+        with self._stats_lock:
+            failed = [(job_id, kind) for job_id, kind in self.failed_kinds.items()
+                      if kind != PERMANENT and (job_ids is None or job_id in job_ids)]
+        retried = []
+        for job_id, kind in failed:
+            job = self.journal.get_job(job_id)
+            if not job or job['state'] != 'failed':
+                continue
+            with self._stats_lock:
+                self.failed_kinds.pop(job_id, None)
+            self.journal.mark_queued(job_id)
+            self.submit_job(job_id, job['url'], job['download_path'], job['format_selector'])
+            retried.append(job_id)
+        return retried
+
+    def select_formats(self, ydl, video_url):
+        """
+        Runs format selection on the (cached) info dict without downloading anything.
+        Returns the selected info dict, or None when `video_url` is not a single video.
+        """
+        self.prefetcher.wait_for(video_url)
+        info_dict = extract_info_cached(ydl, video_url, self.metadata_cache)
+        if not info_dict or info_dict.get('_type', 'video') != 'video':
+            return None
+        return ydl.process_ie_result(copy.deepcopy(info_dict), download=False)
+
+    def download_for_merge(self, ydl, video_url, selected, format_id, job_id):
+        """
+        Downloads each stream of a video+audio selection with yt-dlp but leaves the merge to the
+        post-processing stage, so this worker can start its next download while ffmpeg runs.
+        Returns False when nothing needs merging, the merged file already exists or there is no ffmpeg;
+        yt-dlp then handles the job on its own.
+        """
+        if not selected or not selected.get('requested_formats') or not self.postprocess.available:
+            return False
+        output_path = ydl.prepare_filename(selected)
+        if os.path.exists(output_path):
+            return False
+        base_path = os.path.splitext(output_path)[0]
+        stream_paths = []
+        try:
+            os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+            for f in selected['requested_formats']:
+                stream_info = {k: v for k, v in selected.items() if k != 'requested_formats'}
+                stream_info.update(f)
+                # Same names yt-dlp uses, so a fallback or a resumed job continues these files
+                stream_path = f"{base_path}.f{f['format_id']}.{f['ext']}"
+                ydl.dl(stream_path, stream_info)
+                stream_paths.append(stream_path)
+        except JobInterrupted:
+            raise
+        except Exception as e:
+            print(f"Downloading the streams of {video_url} failed ({e}), letting yt-dlp retry with fresh metadata")
+            self.metadata_cache.invalidate(cache_key_for_url(video_url))
+            self.metrics.add_retries(job_id)
+            return False
+
+        # The network part is over: give the bandwidth share to the jobs still downloading
+        self._job_stats(job_id)['throughput'] = self.bandwidth.unregister(job_id)
+        self.metrics.enter(job_id, 'merge_wait')
+        self.postprocess.submit_merge(
+            stream_paths, output_path,
+            on_started=lambda: self._merge_started(job_id),
+            on_done=lambda path, error: self._merge_done(job_id, video_url, format_id, path, error))
+        return True
+
+    def _prefetch_upcoming(self):
+        # Resolve the next few queued downloads while the current ones run, so workers start on cached metadata
+        for url in self.scheduler.upcoming_urls(self.prefetch_lookahead):
+            self.prefetcher.prefetch(url)
+
+    def _has_metadata(self, video_url):
+        return self.metadata_cache.contains(cache_key_for_url(video_url))
+
+    def _merge_started(self, job_id):
+        self.control.check(job_id)  # Cancelled or paused while waiting for a merge slot
+        self.metrics.enter(job_id, 'merge')
+
+    def _merge_done(self, job_id, video_url, format_id, output_path, error):
+        if isinstance(error, JobInterrupted):
+            self._interrupted(job_id, video_url, format_id, error.reason)
+            return
+        if error:
+            self._fail_job(job_id, video_url, format_id, error)
+            return
+        self.journal.set_filename(job_id, output_path)
+        try:
+            self._complete_job(job_id, video_url, format_id)
+        except Exception as e:
+            self._fail_job(job_id, video_url, format_id, e)
+
+    def _complete_job(self, job_id, video_url, format_id):
+        self.metrics.enter(job_id, 'finalize')
+        filename = self.journal.get_job(job_id)['filename']
+        # Files we wrote ourselves were hashed while downloading, the archive only reads the others (yt-dlp / ffmpeg output)
+        sha256 = self._job_stats(job_id)['hashes'].get(filename)
+        video_id = canonical_video_id(video_url)
+        if video_id and filename and os.path.exists(filename):
+            sha256 = self.archive.add(video_id, format_id, filename, sha256=sha256)['sha256']
+        self.journal.mark_done(job_id, sha256=sha256)
+        self.breaker.record_success(urlparse(video_url).hostname or '')
+        self.scheduler.wake()  # The host may take more jobs again
+        self._finish_job(job_id, video_url, format_id, 'done', filename=filename, sha256=sha256)
+
+    def _fail_job(self, job_id, video_url, format_id, error, kind=None):
+        print(f"An error occurred during download: {error}")
+        kind = kind or classify_error(error)[0]
+        self.journal.mark_failed(job_id, error)
+        with self._stats_lock:
+            self.failed_kinds[job_id] = kind
+        self._finish_job(job_id, video_url, format_id, 'failed', error=str(error), error_kind=kind)
+
+    def download_segmented(self, ydl, video_url, selected, job_id):
+        """
+        Downloads the selected format with SegmentedDownloader when it is a single large file served over
+        plain HTTP(S). Returns False when the format does not qualify or the segmented download failed,
+        so the caller lets yt-dlp download it instead.
+        """
+        if not selected:
+            return False
+        size = selected.get('filesize') or selected.get('filesize_approx') or 0
+        if (self.connections < 2 or selected.get('requested_formats') or selected.get('protocol') not in ('http', 'https')
+                or size < self.SEGMENTED_MIN_SIZE):
+            if not selected.get('requested_formats'):
+                discard_interrupted(ydl.prepare_filename(selected))  # E.g. --connections lowered since
+            return False
+
+        filename = ydl.prepare_filename(selected)
+        if not os.path.exists(filename):
+            downloader = SegmentedDownloader(selected['url'], filename, headers=selected.get('http_headers'),
+                                             connections=self.connections, buffer_size=self.write_buffer,
+                                             progress_callback=lambda d: self.progress_hook(d, job_id))
+            try:
+                os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+                downloader.download()
+            except JobInterrupted:
+                raise  # Paused, preempted or stopped: the next attempt continues the .part from its resume state
+            except Exception as e:
+                downloader.discard()
+                print(f"Segmented download of {video_url} failed ({e}), falling back to yt-dlp")
+                self.metrics.add_retries(job_id, downloader.segment_retries + 1)
+                return False
+            self.metrics.add_retries(job_id, downloader.segment_retries)
+            stats = self._job_stats(job_id)
+            stats['hashes'][filename] = downloader.sha256
+            stats['io'].add(downloader.io)
+        self.journal.set_filename(job_id, filename)
+        return True
+
+    def progress_hook(self, d, job_id):
+        # Runs on the download thread: this is where cancel, pause and preemption requests take effect
+        self.control.check(job_id)
+        if d['status'] in ('downloading', 'finished'):
+            total_bytes = d.get('total_bytes') or d.get('total_bytes_estimate')
+            downloaded_bytes = d.get('downloaded_bytes', 0)
+            self._job_stats(job_id)['files'][d.get('filename')] = downloaded_bytes
+            if d['status'] == 'downloading':
+                self.metrics.enter(job_id, 'download')
+                self.bandwidth.throttle(job_id, d.get('filename'), downloaded_bytes)
+            self.journal.update_progress(job_id, downloaded_bytes, total_bytes, d.get('tmpfilename'),
+                                         force=d['status'] == 'finished')
+        self._notify_progress(d, job_id)
+
+    def _notify_progress(self, d, job_id):
+        for listener in self.progress_listeners:
+            listener(d, job_id)
+
+    def postprocessor_hook(self, d, job_id):
+        if d['status'] == 'started':
+            self.metrics.enter(job_id, self.POSTPROCESSOR_PHASES.get(d.get('postprocessor'), 'postprocess'))
+        # MoveFiles (MoveFilesAfterDownloadPP.pp_key()) runs last, its filepath is where the finished file ended up
+        if d['status'] == 'finished' and d.get('postprocessor') == 'MoveFiles':
+            self.journal.set_filename(job_id, d['info_dict'].get('filepath'))
+
+    @property
+    def failed_files(self):
+        return self.journal.urls_in_state('failed', since=self.journal.session_started)
+
+    @property
+    def downloaded_files(self):
+        return self.journal.urls_in_state('done', since=self.journal.session_started)
+
+    def unfinished_count(self):
+        """
+        Downloads queued or running (here or in worker processes) plus merges waiting in the post-processing stage.
+        """
+        pool_count = self.process_pool.pending_count() if self.process_pool else 0
+        return self.scheduler.unfinished_count() + self.postprocess.pending_count() + pool_count
+
+    def join(self):
+        """
+        Waits for playlists still being listed, then for queued and running downloads, then for their merges.
+        """
+        for playlist_thread in self.playlist_threads:
+            playlist_thread.join()
+        self.scheduler.join()
+        self.postprocess.join()
+        if self.process_pool:
+            self.process_pool.join()
+
+    def close(self):
+        self.prefetcher.close()
+        self.scheduler.shutdown()
+        self.postprocess.shutdown()
+        if self.process_pool:
+            self.process_pool.close()
+        self.session_pool.close()
+        self.journal.close()
+        self.archive.close()
+        self.metrics.write_textfile()
+
+    def _job_stats(self, job_id):
+        with self._stats_lock:
+            return self.job_stats.setdefault(job_id, self._new_stats(time.time()))
+
+    @staticmethod
+    def _new_stats(queued_at=None):
+        # files: filename -> bytes downloaded, hashes: filename -> sha256 of files we wrote, io: write counters
+        # attempts: failed tries so far
+        return {'queued_at': queued_at, 'started_at': None, 'files': {}, 'hashes': {}, 'io': IOStats(), 'attempts': 0}
+
+    def _finish_job(self, job_id, video_url, format_id, status, filename=None, error=None, sha256=None, error_kind=None):
+        with self._stats_lock:
+            stats = self.job_stats.pop(job_id, None) or self._new_stats()
+        throughput = self.bandwidth.unregister(job_id) or stats.get('throughput')
+        self.control.clear(job_id)
+        finished_at = time.time()
+        result = {
+            'job_id': job_id,
+            'url': video_url,
+            'format': format_id,
+            'status': status,
+            'filename': filename,
+            'bytes': sum(stats['files'].values()),
+            'queued_at': stats['queued_at'],
+            'started_at': stats['started_at'],
+            'finished_at': finished_at,
+            'queue_wait': stats['started_at'] - stats['queued_at'] if stats['started_at'] and stats['queued_at'] else None,
+            'elapsed': finished_at - stats['started_at'] if stats['started_at'] else None,
+            'throughput': throughput,
+            'sha256': sha256,
+            'io': stats['io'].as_dict(),
+        }
+        if error:
+            result['error'] = error
+            result['error_kind'] = error_kind
+        self.metrics.finish_job(job_id, result)
+        self._notify_job_finished(result)
+
+    def _notify_job_finished(self, result):
+        for listener in self.job_listeners:
+            listener(result)
@@ -1,9 +1,10 @@
 import os
-from yt_dlp import YoutubeDL
+
+from startup import load_youtube_dl
 
 def list_and_choose_format(url):
     ydl_opts = {}
-    with YoutubeDL(ydl_opts) as ydl:
+    with load_youtube_dl()(ydl_opts) as ydl:
         info_dict = ydl.extract_info(url, download=False)
         formats = info_dict['formats']
 
@@ -64,7 +65,7 @@ def download_video(url, download_path='.', format_id='best'):
         'format': format_id,
         'outtmpl': f'{download_path}/%(title)s.%(ext)s',
     }
-    with YoutubeDL(ydl_opts) as ydl:
+    with load_youtube_dl()(ydl_opts) as ydl:
         ydl.download([url])
 
 if __name__ == "__main__":
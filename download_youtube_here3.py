@@ -1,34 +1,79 @@
+from startup import StartupProfiler, prewarm_in_background
+startup_profiler = StartupProfiler()
+
 import os
 import threading
 import tkinter as tk
 from tkinter import messagebox, filedialog, ttk
-import pyperclip
-from yt_dlp import YoutubeDL
-from yt_dlp.utils import DownloadError, PostProcessingError
 
-from print_tricks import pt
+from bandwidth import parse_rate
+from clipboard_watcher import ClipboardWatcher
+from daemon_client import connect_daemon
+from download_service import DownloadService, is_playlist_url
+from format_selection import map_resolution_to_format
+from playlist_planner import parse_size
+from progress_bus import ProgressBus, ProgressPump, format_speed, format_eta
+from url_utils import canonicalize_url
+
+# yt_dlp and pyperclip (on the clipboard thread) are imported on first use, the window comes up before any of them load
+startup_profiler.mark('modules imported')
+startup_profiler.expect('window shown', 'extractors loaded')
 
 class YouTubeDownloader:
     def __init__(self):
         self.last_handled_content = ""
+        self.last_handled_key = None
         self.disable_clipboard_check = False
-        self.failed_files = []
-        self.downloaded_files = []
+        # A running daemon already has warm sessions, caches and the shared queue, otherwise run everything here
+        self.service = connect_daemon() or DownloadService(max_workers=4, max_per_host=3)
+        if self.service.detached:
+            print("Using the running download daemon")
+        # Metadata of copied URLs starts resolving on the watcher thread, before the Tk loop sees the URL
+        self.clipboard_watcher = ClipboardWatcher(on_url=self.service.prefetch_metadata)
+        self.progress_bus = ProgressBus()
+        self.service.progress_listeners.append(self.progress_hook)
+        self.service.job_listeners.append(self.on_job_finished)
+        startup_profiler.mark('service created')
         self.setup_gui()
 
     def setup_gui(self):
         self.root = tk.Tk()
         self.root.title("YouTube Downloader")
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        startup_profiler.mark('Tk root created')
         self.create_widgets()
+        startup_profiler.mark('widgets built')
+        self.progress_pump = ProgressPump(self.root, self.progress_bus, self.render_progress, fps=10)
+        self.progress_pump.start()
+        self.scan_download_folder(self.download_path_var.get())
+        resumed = self.service.resume_unfinished_jobs()
+        if resumed:
+            self.update_queue_status(f"Resuming {resumed} unfinished job(s)")
+        # Jobs paused in an earlier session are listed so they can be resumed
+        for job in self.service.journal.jobs_in_state('paused'):
+            self.progress_bus.publish(job['id'], {'status': 'paused', 'filename': job['url']})
+        self.clipboard_watcher.start()
         self.check_clipboard()
+        self.root.after(0, self.on_window_shown)
         self.root.mainloop()
 
+    def on_window_shown(self):
+        # Load yt_dlp while the user is still pasting a URL, not before the window appears
+        startup_profiler.mark('window shown')
+        if not self.service.detached:
+            prewarm_in_background(self.service.session_pool, profiler=startup_profiler)
+        startup_profiler.report()
+
     def create_widgets(self):
         self.url_entry = self.create_url_entry()
         self.format_var, self.format_menu = self.create_format_menu()
+        self.format_ids = []  # format_id (or playlist resolution) for each format_menu entry, by position
         self.download_path_var = self.create_download_path_entry()
         self.create_download_button()
+        self.create_rate_limit_entry()
+        self.create_budget_entry()
         self.create_progress_bar()  # Ensure this is called here
+        self.create_job_controls()
 
     def create_url_entry(self):
         url_entry = tk.Entry(self.root, width=50, fg='grey')
@@ -59,6 +104,28 @@ class YouTubeDownloader:
         self.download_button = tk.Button(self.root, text="Download", command=self.on_format_select, state='disabled')
         self.download_button.pack()
 
+    def create_rate_limit_entry(self):
+        tk.Label(self.root, text="Max speed (e.g. 500K, 2M; empty = unlimited):").pack()
+        self.rate_limit_var = tk.StringVar(self.root)
+        tk.Entry(self.root, textvariable=self.rate_limit_var, width=12).pack()
+        tk.Button(self.root, text="Apply Speed Limit", command=self.apply_rate_limit).pack()
+
+    def create_budget_entry(self):
+        tk.Label(self.root, text="Playlist size budget (e.g. 20G; empty = free disk space):").pack()
+        self.budget_var = tk.StringVar(self.root)
+        tk.Entry(self.root, textvariable=self.budget_var, width=12).pack()
+
+    def apply_rate_limit(self):
+        # Takes effect on running downloads too (worker processes and the daemon included), the bandwidth
+        # manager re-splits the limit on the next progress update
+        try:
+            rate_limit = parse_rate(self.rate_limit_var.get())
+        except ValueError:
+            messagebox.showerror("Invalid speed", f"Could not parse '{self.rate_limit_var.get()}'")
+            return
+        self.service.set_rate_limit(rate_limit)
+        self.update_queue_status(f"Speed limit: {format_speed(rate_limit) if rate_limit else 'unlimited'}")
+
     def on_paste(self, event):
         self.root.after(2, lambda: self.update_last_handled_content_and_fetch_formats(self.url_entry.get()))
 
@@ -72,35 +139,60 @@ class YouTubeDownloader:
         path = filedialog.askdirectory(initialdir=self.download_path_var.get())
         if path:
             self.download_path_var.set(path)
+            self.scan_download_folder(path)
 
-    def is_playlist_url(self, video_url):
-        """
-        Enhanced check to determine if a URL is likely a playlist. This method attempts to catch more edge cases
-        by looking for common playlist indicators in YouTube URLs.
-        """
-        from urllib.parse import urlparse, parse_qs
+    def scan_download_folder(self, path):
+        # Index files that are already in the folder so they are not downloaded again
+        threading.Thread(target=self.service.archive.scan_folders, args=([path],), daemon=True).start()
 
-        parsed_url = urlparse(video_url)
-        query_params = parse_qs(parsed_url.query)
-
-        # Common query parameters that indicate a playlist
-        playlist_indicators = ['list', 'p']
-
-        # Check for standard playlist URLs
-        if any(indicator in query_params for indicator in playlist_indicators):
-            return True
-
-        # Check for other YouTube URL structures that might indicate a playlist or channel
-        path_segments = parsed_url.path.split('/')
-        if 'channel' in path_segments or 'c' in path_segments or 'user' in path_segments:
-            return True
-
-        return False
+    def is_playlist_url(self, video_url):
+        return is_playlist_url(video_url)
 
     def on_format_select(self):
         video_url = self.url_entry.get()
-        format_id = self.format_var.get().split(' - ')[0]
-        self.download_video(video_url, self.download_path_var.get(), format_id)
+        choice = self.format_menu.current()
+        if not 0 <= choice < len(self.format_ids):
+            return
+        if self.is_playlist_url(video_url) and self.budget_var.get().strip():
+            # Planning resolves every entry before the first download, only worth it to fit a budget
+            self.plan_playlist(video_url, self.download_path_var.get(), self.format_ids[choice])
+        else:
+            self.download_video(video_url, self.download_path_var.get(), self.format_ids[choice])
+
+    def plan_playlist(self, playlist_url, download_path, resolution):
+        """
+        Resolves every entry, picks formats that fit the budget and asks before queueing anything.
+        """
+        try:
+            budget = parse_size(self.budget_var.get())
+        except ValueError:
+            messagebox.showerror("Invalid budget", f"Could not parse '{self.budget_var.get()}'")
+            return
+
+        def on_progress(done, total):
+            self.root.after(0, lambda: self.update_queue_status(f"Planning playlist: {done}/{total} videos checked"))
+
+        def plan_thread():
+            try:
+                plan = self.service.plan_playlist(playlist_url, resolution, download_path=download_path, budget=budget,
+                                                  on_progress=on_progress)
+            except Exception as e:
+                print(f"Error planning playlist {playlist_url}: {e}")
+                self.root.after(0, lambda: self.update_queue_status("Could not list the playlist"))
+                return
+            self.root.after(0, lambda: self.confirm_plan(plan, download_path))
+
+        threading.Thread(target=plan_thread, daemon=True).start()
+
+    def confirm_plan(self, plan, download_path):
+        if not plan.downloads():
+            messagebox.showinfo("Nothing to download", plan.summary())
+            return
+        if messagebox.askokcancel("Download playlist?", plan.summary()):
+            queued = self.service.queue_plan(plan, download_path)
+            self.update_queue_status(f"Queued {queued} playlist video(s)")
+        else:
+            self.update_queue_status("Playlist download cancelled")
 
     def fetch_formats(self, event=None):
         def fetch_thread():
@@ -112,22 +204,23 @@ class YouTubeDownloader:
                     # Handle playlist differently without fetching all formats
                     playlist_formats = self.prepare_playlist_formats()
                     # Schedule updating the combobox values for playlist formats
-                    self.root.after(0, lambda: self.update_combobox_values(playlist_formats))
-                    self.root.after(0, lambda: self.format_var.set(playlist_formats[0]))
-                    self.root.after(0, lambda: self.download_button.config(state='normal'))
+                    self.root.after(0, lambda: self.set_format_choices(playlist_formats, playlist_formats))
                     self.root.after(0, lambda: self.update_queue_status(f'Playlist Ready. Choose a Preferred Format'))
                 else:
                     # Schedule setting the combobox to "Fetching..."
                     self.root.after(0, lambda: self.update_combobox_values(["Fetching..."]))
                     self.root.after(0, lambda: self.update_queue_status(f'Fetching formats for {video_url[:25]}...'))
-                    formats, info_dict = self.list_and_choose_format(video_url, gui=True)
+                    format_table, info_dict = self.list_and_choose_format(video_url, gui=True)
                     self.root.after(0, lambda: self.update_queue_status(f'Video Ready. Choose a Format'))
 
-                    if formats:
+                    if format_table:
                         # Schedule updating the combobox with fetched formats
-                        self.root.after(0, lambda: self.update_combobox_values(formats))
-                        self.root.after(0, lambda: self.format_var.set(formats[0]))
-                        self.root.after(0, lambda: self.download_button.config(state='normal'))
+                        labels, format_ids = format_table.labels(), format_table.format_ids()
+                        self.root.after(0, lambda: self.set_format_choices(labels, format_ids))
+                    elif info_dict and 'entries' in info_dict:
+                        # Turned out to be a playlist after all
+                        playlist_formats = self.prepare_playlist_formats()
+                        self.root.after(0, lambda: self.set_format_choices(playlist_formats, playlist_formats))
                     else:
                         # Schedule updating the combobox to show "No formats found"
                         self.root.after(0, lambda: self.update_combobox_values(["No formats found"]))
@@ -138,37 +231,23 @@ class YouTubeDownloader:
     def update_combobox_values(self, values):
         self.format_menu['values'] = values
 
+    def set_format_choices(self, labels, format_ids):
+        self.format_ids = list(format_ids)
+        self.update_combobox_values(labels)
+        self.format_menu.current(0)
+        self.download_button.config(state='normal')
+
     def list_and_choose_format(self, video_url, gui=False):
         """
-        Fetches available formats for a given YouTube video URL and returns a list of format strings.
-        If gui is True, it also prepares the format list for GUI display.
-        Adjusts behavior based on whether the URL is for a single video or a playlist.
+        Fetches available formats for a given YouTube video URL and returns (FormatTable, info_dict).
+        The table holds ranked format records with their estimated sizes; for playlists it is None.
         """
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-        }
         try:
-            with YoutubeDL(ydl_opts) as ydl:
-                pt.t(1)
-                info_dict = ydl.extract_info(video_url, download=False)
-                pt.t(1)
-                # Check if the URL is for a playlist
-                if 'entries' in info_dict:
-                    # It's a playlist
-                    if gui:
-                        return self.prepare_playlist_formats(), info_dict
-                    else:
-                        # Handle non-GUI logic if necessary
-                        pass
-                else:
-                    # It's a single video
-                    formats = info_dict.get('formats', [{}])
-                    format_list = [f"{f['format_id']} - {f['format_note']} - {f['ext']}" for f in formats if f.get('format_note')]
-                    return format_list, info_dict
+            # Timed by the service's metrics ('extract_info' span)
+            return self.service.get_format_table(video_url)
         except Exception as e:
             print(f"Error fetching formats: {e}")
-            return [], {}
+            return None, {}
 
     def prepare_playlist_formats(self):
         """
@@ -177,92 +256,119 @@ class YouTubeDownloader:
         return ["4k", "1440p", "1080p", "720p", "360p", "audio only"]
 
     def fetch_playlist_items(self, playlist_url):
-        pt()
-        ydl_opts = {
-            # 'extract_flat': True,
-            'quiet': True,
-        }
-        with YoutubeDL(ydl_opts) as ydl:
-            result = ydl.extract_info(playlist_url, download=False)
-            pt(result)
-            if 'entries' in result:
-                return result['entries']
-            else:
-                return []
+        return self.service.fetch_playlist_items(playlist_url)
 
     def download_video(self, video_url, download_path, format_id):
-        if self.is_playlist_url(video_url):
-            playlist_items = self.fetch_playlist_items(video_url)
-            for item in playlist_items:
-                item_url = f"https://www.youtube.com/watch?v={item['id']}"
-                threading.Thread(target=self.download_single_video, args=(item_url, download_path, format_id)).start()
-        else:
-            threading.Thread(target=self.download_single_video, args=(video_url, download_path, format_id)).start()
-
-    def download_single_video(self, video_url, download_path, format_id):
-        video_path = os.path.join(download_path, '%(title)s.%(ext)s')
-        format_selection = f'{format_id}+bestaudio/bestvideo[height<=720]+bestaudio/bestvideo[height<=480]+bestaudio/bestvideo[height<=360]+bestaudio/best'
-        ydl_opts = {
-            'format': format_selection,
-            'outtmpl': video_path,
-            'progress_hooks': [self.progress_hook],
-            # 'verbose': True,
-        }
-        try:
-            with YoutubeDL(ydl_opts) as ydl:
-                ydl.download([video_url])
-        except Exception as e:
-            print(f"An error occurred during download: {e}")
-            self.failed_files.append(video_url)
-        finally:
-            print(f"Download completed or failed for: {video_url}")
+        self.service.download_video(video_url, download_path, format_id)
 
+    def download_single_video(self, video_url, download_path, format_id, job_id):
+        self.service.download_single_video(video_url, download_path, format_id, job_id)
+
+    @property
+    def failed_files(self):
+        return self.service.failed_files
+
+    @property
+    def downloaded_files(self):
+        return self.service.downloaded_files
 
     def finalize(self):
-        # Method to print failed files at the end
-        if self.failed_files:
+        self.clipboard_watcher.stop()
+        if self.service.detached:
+            print("Downloads continue in the daemon")
+            self.service.close()
+            return
+        # Wait for queued and running downloads before reporting what failed
+        remaining = self.service.unfinished_count()
+        if remaining:
+            print(f"Waiting for {remaining} download(s) to finish...")
+        self.service.join()
+        # One more try for downloads that failed on network errors or throttling, now that the rest is done
+        # (none after stop_all(), when the window was closed with downloads running)
+        retried = self.service.retry_failed_jobs()
+        if retried:
+            print(f"Retrying {len(retried)} failed download(s)...")
+            self.service.join()
+        failed_files = self.failed_files
+        if failed_files:
             print("Failed files:")
-            for file in self.failed_files:
+            for file in failed_files:
                 print(file)
+        self.service.close()
 
     def map_resolution_to_format(self, resolution_choice):
-        """
-        Maps the user's resolution choice to yt-dlp's format selection syntax.
-        This is a simplified example and needs to be adjusted based on actual requirements.
-        """
-        format_map = {
-            "4k": "bestvideo[height<=2160]+bestaudio/best[height<=2160]",
-            "1440p": "bestvideo[height<=1440]+bestaudio/best[height<=1440]",
-            "1080p": "bestvideo[height<=1080]+bestaudio/best[height<=1080]",
-            "720p": "bestvideo[height<=720]+bestaudio/best[height<=720]",
-            "360p": "bestvideo[height<=360]+bestaudio/best[height<=360]",
-            "audio only": "bestaudio",
-        }
-        return format_map.get(resolution_choice, "best")
-
-    def progress_hook(self, d):
-        if d['status'] == 'downloading':
-            total_bytes = d.get('total_bytes') or d.get('total_bytes_estimate')
-            downloaded_bytes = d.get('downloaded_bytes', 0)
-            if total_bytes:
-                progress_percent = int(downloaded_bytes / total_bytes * 100)
-                self.update_progress_bar(progress_percent)
-                self.update_queue_status(f"Downloading... {progress_percent}%")
-        elif d['status'] == 'finished':
-            self.update_progress_bar(0)  # Reset progress bar for the next download
-            self.update_queue_status("Processing downloaded video...")
+        return map_resolution_to_format(resolution_choice)
+
+    def progress_hook(self, d, job_id=None):
+        # Runs on download threads: only queue the event, the progress pump renders it on the main thread
+        self.progress_bus.publish(job_id, d)
 
+    def on_job_finished(self, result):
+        self.progress_bus.publish_finished(result['job_id'], result['status'])
 
     def create_progress_bar(self):
         self.progress_bar = ttk.Progressbar(self.root, orient="horizontal", length=400, mode="determinate")
         self.progress_bar.pack()
         self.queue_status_label = tk.Label(self.root, text="Status: Waiting")
         self.queue_status_label.pack()
+        self.job_list = tk.Listbox(self.root, width=70, height=6)
+        self.job_list.pack()
+        self.job_row_ids = []  # job_id of each job_list row, by position
+
+    def create_job_controls(self):
+        controls = tk.Frame(self.root)
+        controls.pack()
+        tk.Button(controls, text="Pause", command=lambda: self.control_selected_job(self.service.pause_job)).pack(side=tk.LEFT)
+        tk.Button(controls, text="Resume", command=lambda: self.control_selected_job(self.service.resume_job)).pack(side=tk.LEFT)
+        tk.Button(controls, text="Cancel", command=lambda: self.control_selected_job(self.service.cancel_job)).pack(side=tk.LEFT)
+
+    def control_selected_job(self, action):
+        selection = self.job_list.curselection()
+        if not selection or selection[0] >= len(self.job_row_ids):
+            messagebox.showinfo("No job selected", "Select a download in the list first.")
+            return
+        action(self.job_row_ids[selection[0]])
+
+    def on_close(self):
+        if self.service.detached:
+            self.root.destroy()  # Downloads go on in the daemon
+            return
+        remaining = self.service.unfinished_count()
+        if remaining and not messagebox.askokcancel(
+                "Downloads running", f"{remaining} download(s) are not finished. Stop them and quit? They will resume next time."):
+            return
+        self.service.stop_all()
+        self.root.destroy()
+
+    def render_progress(self, snapshot):
+        """
+        Draws one coalesced progress snapshot: aggregate progress, throughput and ETA plus a row per job.
+        """
+        self.update_progress_bar(snapshot['percent'])
+        if snapshot['active']:
+            if all(row[4] == 'finished' for row in snapshot['jobs']):
+                self.update_queue_status("Processing downloaded video...")
+            else:
+                self.update_queue_status(
+                    f"Downloading {snapshot['active']} ({snapshot['completed']} done) - "
+                    f"{format_speed(snapshot['speed'])} - ETA {format_eta(snapshot['eta'])}")
+        else:
+            self.update_queue_status(f"Waiting ({snapshot['completed']} done)")
+
+        selection = self.job_list.curselection()
+        selected_job = self.job_row_ids[selection[0]] if selection and selection[0] < len(self.job_row_ids) else None
+        self.job_list.delete(0, tk.END)
+        self.job_row_ids = []
+        for job_id, label, percent, speed, status in snapshot['jobs']:
+            state = format_speed(speed) if status in ('downloading', 'finished') else status
+            self.job_list.insert(tk.END, f"{percent:3d}%  {state:>10}  {label or ''}")
+            if job_id == selected_job:
+                self.job_list.selection_set(len(self.job_row_ids))
+            self.job_row_ids.append(job_id)
 
     def update_progress_bar(self, progress):
         if hasattr(self, 'progress_bar'):  # Check if progress_bar exists
             self.progress_bar["value"] = progress
-            self.root.update_idletasks()
 
     def update_queue_status(self, status):
         if hasattr(self, 'queue_status_label'):  # Check if queue_status_label exists
@@ -285,21 +391,25 @@ class YouTubeDownloader:
 
     def check_clipboard(self):
         """
-        Checks the clipboard for a YouTube URL and updates the URL entry if found.
-        Only updates if the clipboard content is a new video URL different from the last handled content,
-        and if clipboard checking is enabled.
+        Takes new URLs posted by the background clipboard watcher and puts them in the URL entry.
+        The watcher already canonicalizes and debounces them; while clipboard checking is disabled
+        events simply stay queued.
         """
         if not self.disable_clipboard_check:
-            clipboard_content = pyperclip.paste()
-            if (clipboard_content.startswith("http://") or clipboard_content.startswith("https://")) and clipboard_content != self.last_handled_content:
+            clipboard_url = self.clipboard_watcher.get_event()
+            if clipboard_url and canonicalize_url(clipboard_url)[0] != self.last_handled_key:
                 self.url_entry.delete(0, tk.END)
-                self.url_entry.insert(0, clipboard_content)
-                self.update_last_handled_content_and_fetch_formats(clipboard_content)
-        self.root.after(1000, self.check_clipboard)
+                self.url_entry.insert(0, clipboard_url)
+                self.update_last_handled_content_and_fetch_formats(clipboard_url)
+        self.root.after(100, self.check_clipboard)
 
     def update_last_handled_content_and_fetch_formats(self, content):
-        if content != self.last_handled_content:
+        # Compare canonical keys so the same video with a different &t= or si= is only fetched once
+        key, _ = canonicalize_url(content)
+        if key != self.last_handled_key:
+            self.last_handled_key = key
             self.last_handled_content = content
+            self.clipboard_watcher.mark_handled(content)
             self.fetch_formats()
 
 
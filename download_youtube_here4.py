@@ -1,35 +1,52 @@
 import os
-from yt_dlp import YoutubeDL
-import tkinter as tk
-from tkinter import messagebox, filedialog, ttk
-import pyperclip
+import sys
+
+from metadata_cache import MetadataCache, extract_info_cached, download_with_cached_info
+from session_pool import YoutubeDLPool
+from batch_cli import batch_main
+from startup import prewarm_in_background
+from clipboard_watcher import ClipboardWatcher
+from url_utils import canonicalize_url
+from format_selection import FormatTable
+
+metadata_cache = MetadataCache()
+session_pool = YoutubeDLPool()
 
 
 
 
 def gui_main():
+    # Imported here so batch mode never loads Tk; yt_dlp itself is loaded lazily by the session pool
+    import tkinter as tk
+    from tkinter import messagebox, filedialog, ttk
+
     global last_handled_content
     last_handled_content = ""  # Variable to track the last content that was manually handled
+    clipboard_watcher = ClipboardWatcher()
+    format_ids = []  # format_id for each entry of format_menu, by position
 
     def fetch_formats(event=None):
         video_url = url_entry.get()
         if video_url and (video_url.startswith("http://") or video_url.startswith("https://")):
             format_menu['values'] = ["Fetching"]
             format_menu.set("Fetching")
-            formats, info_dict = list_and_choose_format(video_url, gui=True)
-            if formats:
-                # Directly use the formatted list without altering it
-                format_choices = formats
-                format_menu['values'] = format_choices
-                format_var.set(format_choices[0])
+            format_table, info_dict = list_and_choose_format(video_url, gui=True)
+            if format_table:
+                format_ids[:] = format_table.format_ids()
+                format_menu['values'] = format_table.labels()
+                format_menu.current(0)
                 download_button['state'] = 'normal'
             else:
+                format_ids.clear()
                 format_menu['values'] = ["No formats found"]
                 format_menu.set("No formats found")
 
     def on_format_select():
         video_url = url_entry.get()
-        format_id = format_var.get().split(' - ')[0]
+        choice = format_menu.current()
+        if not 0 <= choice < len(format_ids):
+            return
+        format_id = format_ids[choice]
         download_video(video_url, download_path_var.get(), format_id)
         messagebox.showinfo("Download Completed", "Ready for the next download.")
 
@@ -54,22 +71,20 @@ def gui_main():
 
     def update_last_handled_content_and_fetch_formats(content):
         global last_handled_content
-        if content != last_handled_content:  # Check if the content is new
+        # Compare canonical URLs so the same video with a different &t= or si= is only fetched once
+        if canonicalize_url(content)[0] != canonicalize_url(last_handled_content)[0]:  # Check if the content is new
             last_handled_content = content
+            clipboard_watcher.mark_handled(content)
             fetch_formats()  # Fetch formats
 
     def check_clipboard():
-        global last_handled_content
-        clipboard_content = pyperclip.paste()
-        current_content = url_entry.get()
-        # Check if the clipboard content is new and different from the last handled content
-        if clipboard_content.startswith("http://") or clipboard_content.startswith("https://"):
-            if clipboard_content != current_content and clipboard_content != last_handled_content:
-                url_entry.delete(0, tk.END)
-                url_entry.insert(0, clipboard_content)
-                last_handled_content = clipboard_content  # Update the last handled content
-                fetch_formats()
-        root.after(1000, check_clipboard)
+        # The watcher reads the clipboard on its own thread, here we only pick up the URLs it posts
+        clipboard_url = clipboard_watcher.get_event()
+        if clipboard_url and clipboard_url != url_entry.get():
+            url_entry.delete(0, tk.END)
+            url_entry.insert(0, clipboard_url)
+            update_last_handled_content_and_fetch_formats(clipboard_url)
+        root.after(100, check_clipboard)
 
     def on_entry_click(event):
         clear_entry()
@@ -99,9 +114,13 @@ def gui_main():
     download_button = tk.Button(root, text="Download", command=on_format_select, state='disabled')
     download_button.pack()
 
+    clipboard_watcher.start()
     check_clipboard()
+    # Load yt_dlp in the background once the window is up
+    root.after(0, lambda: prewarm_in_background(session_pool, ydl_opts={}))
 
     root.mainloop()
+    clipboard_watcher.stop()
     
 def cli_main():
     while True:
@@ -119,61 +138,27 @@ def cli_main():
 def list_and_choose_format(url, gui=False):
     ydl_opts = {}
     try:
-        with YoutubeDL(ydl_opts) as ydl:
-            info_dict = ydl.extract_info(url, download=False)
-            formats = info_dict['formats']
-
-        formats.sort(key=lambda f: (
-            f.get('width', 0) or 0,
-            f.get('fps', 0) or 0,
-            f.get('tbr', 0) or 0
-        ), reverse=True)
-
-        # Generate a common formatted list of formats
-        formatted_formats = []
-        for i, f in enumerate(formats, start=1):
-            resolution = f"{f.get('width', 'N/A')}x{f.get('height', 'N/A')}" if f.get('width') and f.get('height') else "(audio)"
-            fps = f"{int(f.get('fps', '0'))}" if f.get('fps') else "0"
-            ext = f['ext']
-            duration = info_dict.get('duration', None)
-            filesize = f.get('filesize', None)
-            if not filesize:
-                filesize = calculate_filesize(f.get('tbr', None), duration)
-            else:
-                filesize = f"~{filesize / 1024**2:.2f} MB"
-            bitrate = f"{f.get('tbr', 0):.1f}" if f.get('tbr') else "N/A"
-            format_note = f.get('format_note', '')
-            formatted_format = f"{i} - {resolution}, {fps} fps, {ext}, {filesize}, {bitrate} kbps, {format_note}"
-            formatted_formats.append(formatted_format)
-        print('--------- \n ', formatted_format)
+        with session_pool.session(ydl_opts) as ydl:
+            info_dict = extract_info_cached(ydl, url, metadata_cache)
+        # Built once per fetch: sizes are estimated and formats ranked here, not per displayed row
+        format_table = FormatTable(info_dict)
 
         if gui:
-            # For GUI, return the list as is for display in the dropdown
-            return formatted_formats, info_dict
+            # For GUI, return the table; the dropdown shows its labels and maps positions back to format IDs
+            return format_table, info_dict
         else:
             # For CLI, print the formatted list and let the user choose
             print("\nAvailable formats:")
-            for formatted_format in formatted_formats:
-                print(formatted_format)
+            for i, label in enumerate(format_table.labels(), start=1):
+                print(f"{i} - {label}")
             choice = int(input("\nEnter the number of the format to download: ")) - 1
-            format_id = formats[choice]['format_id']
-            return format_id
+            return format_table[choice].format_id
     except Exception as e:
         print(f"Error fetching video information: {e}")
         if gui:
-            return [], None  # Return empty list and None for GUI mode
+            return None, None  # Return no table and None for GUI mode
         else:
             return None  # Return None for CLI mode to indicate failure
-        
-        
-        
-def calculate_filesize(tbr, duration):
-    if tbr and duration:
-        # tbr is in kbit/s and duration is in seconds, so we convert tbr to bit/s, multiply by duration to get bits, then convert to MB
-        filesize_bytes = (tbr * 1000) * duration / 8
-        filesize_mb = filesize_bytes / (1024 ** 2)
-        return f"{filesize_mb:.2f} MB"
-    return "N/A"
 
 def download_video(url, download_path='.', format_id='best'):
     ydl_opts = {
@@ -182,18 +167,23 @@ def download_video(url, download_path='.', format_id='best'):
         'verbose': True,
     }
     try:
-        with YoutubeDL(ydl_opts) as ydl:
-            ydl.download([url])
+        with session_pool.session(ydl_opts) as ydl:
+            download_with_cached_info(ydl, url, metadata_cache)
     except Exception as e:
         print(f"Error downloading video: {e}")
 
 if __name__ == "__main__":
+    # Any command line arguments switch to the non-interactive batch mode (see batch_cli.py)
+    if len(sys.argv) > 1:
+        sys.exit(batch_main(sys.argv[1:]))
+
     USE_GUI = True
 
     if USE_GUI:
         gui_main()
     else:
         cli_main()
+    session_pool.close()
         
 # if __name__ == "__main__":
 #     while True:
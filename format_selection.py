@@ -0,0 +1,163 @@
+# Resolution choices offered for playlists and batch runs, mapped to yt-dlp format selectors
+RESOLUTION_FORMATS = {
+    "best": "bestvideo+bestaudio/best",
+    "4k": "bestvideo[height<=2160]+bestaudio/best[height<=2160]",
+    "1440p": "bestvideo[height<=1440]+bestaudio/best[height<=1440]",
+    "1080p": "bestvideo[height<=1080]+bestaudio/best[height<=1080]",
+    "720p": "bestvideo[height<=720]+bestaudio/best[height<=720]",
+    "360p": "bestvideo[height<=360]+bestaudio/best[height<=360]",
+    "audio only": "bestaudio",
+}
+
+FALLBACK_FORMATS = 'bestvideo[height<=720]+bestaudio/bestvideo[height<=480]+bestaudio/bestvideo[height<=360]+bestaudio/best'
+
+
+def map_resolution_to_format(resolution_choice):
+    """
+    Maps the user's resolution choice to yt-dlp's format selection syntax.
+    """
+    return RESOLUTION_FORMATS.get(resolution_choice, "best")
+
+
+def build_format_selection(format_id):
+    """
+    Turns what the user picked (a resolution choice or a format_id) into the selector passed to yt-dlp.
+    A picked video format_id is paired with the best audio and falls back to lower resolutions.
+    Full selectors (with '+' or '/', e.g. from the playlist planner) are passed through unchanged.
+    """
+    if format_id in RESOLUTION_FORMATS:
+        return RESOLUTION_FORMATS[format_id]
+    if '+' in format_id or '/' in format_id:
+        return format_id
+    return f'{format_id}+bestaudio/{FALLBACK_FORMATS}'
+
+
+def estimate_filesize(f, duration):
+    """
+    Size of a format in bytes: the reported filesize, yt-dlp's approximation, or tbr (kbit/s) * duration.
+    Returns None when none of those are known.
+    """
+    filesize = f.get('filesize') or f.get('filesize_approx')
+    if filesize:
+        return int(filesize)
+    if f.get('tbr') and duration:
+        return int(f['tbr'] * 1000 * duration / 8)
+    return None
+
+
+def format_size(size_bytes):
+    return f"{size_bytes / 1024**2:.2f} MB" if size_bytes else "N/A"
+
+
+class FormatRecord:
+    """
+    The fields of a yt-dlp format dict we actually use, with the estimated size worked out once.
+    """
+    __slots__ = ('format_id', 'width', 'height', 'fps', 'ext', 'tbr', 'vcodec', 'acodec', 'note', 'size', 'rank')
+
+    def __init__(self, f, duration):
+        self.format_id = str(f['format_id'])
+        self.width = f.get('width') or 0
+        self.height = f.get('height') or 0
+        self.fps = f.get('fps') or 0
+        self.ext = f.get('ext') or ''
+        self.tbr = f.get('tbr') or 0
+        self.vcodec = f.get('vcodec') or 'none'
+        self.acodec = f.get('acodec') or 'none'
+        self.note = f.get('format_note') or ''
+        self.size = estimate_filesize(f, duration)
+        self.rank = 0
+
+    @property
+    def has_video(self):
+        return self.vcodec != 'none' or bool(self.height)
+
+    @property
+    def has_audio(self):
+        return self.acodec != 'none'
+
+    def label(self):
+        resolution = f"{self.width}x{self.height}" if self.width and self.height else "(audio)"
+        bitrate = f"{self.tbr:.1f}" if self.tbr else "N/A"
+        note = f"{self.note} " if self.note else ""
+        return f"{resolution}, {int(self.fps)} fps, {self.ext}, ~{format_size(self.size)}, {bitrate} kbps, {note}[{self.format_id}]"
+
+
+class FormatTable:
+    """
+    All formats of one info dict, built once and ranked best first (by width, fps, then bitrate).
+    GUI and CLI bind to format_ids()/labels() by position instead of parsing display strings.
+    """
+
+    def __init__(self, info_dict):
+        duration = info_dict.get('duration')
+        records = [FormatRecord(f, duration) for f in info_dict.get('formats') or [] if f.get('format_id') is not None]
+        records.sort(key=lambda r: (r.width, r.fps, r.tbr), reverse=True)
+        for rank, record in enumerate(records):
+            record.rank = rank
+        self.records = records
+        self._by_id = {record.format_id: record for record in records}
+        self._labels = None
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __getitem__(self, index):
+        return self.records[index]
+
+    def by_id(self, format_id):
+        return self._by_id.get(str(format_id))
+
+    def format_ids(self):
+        return [record.format_id for record in self.records]
+
+    def labels(self):
+        if self._labels is None:
+            self._labels = [record.label() for record in self.records]
+        return self._labels
+
+    def best_audio(self):
+        audio_only = [r for r in self.records if r.has_audio and not r.has_video]
+        return max(audio_only, key=lambda r: (r.tbr, -r.rank), default=None)
+
+    def download_size(self, record):
+        """
+        Estimated bytes for downloading `record`, including the best audio stream for video-only formats.
+        """
+        if record.size is None:
+            return None
+        if record.has_video and not record.has_audio:
+            audio = self.best_audio()
+            if audio and audio.size:
+                return record.size + audio.size
+        return record.size
+
+    def filter(self, max_height=None, max_bytes=None, video=None, ext=None):
+        """
+        Records matching every given constraint, best first. Formats with an unknown size never match max_bytes.
+        """
+        matches = []
+        for record in self.records:
+            if video is not None and record.has_video != video:
+                continue
+            if max_height is not None and record.height > max_height:
+                continue
+            if ext is not None and record.ext != ext:
+                continue
+            if max_bytes is not None:
+                size = self.download_size(record)
+                if size is None or size > max_bytes:
+                    continue
+            matches.append(record)
+        return matches
+
+    def best(self, max_height=None, max_bytes=None):
+        """
+        Best video format with height <= max_height whose download (with audio) fits in max_bytes,
+        e.g. best(max_height=1080, max_bytes=500 * 1024**2). Returns None if nothing fits.
+        """
+        matches = self.filter(max_height=max_height, max_bytes=max_bytes, video=True)
+        return matches[0] if matches else None
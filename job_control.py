@@ -0,0 +1,49 @@
+import threading
+
+CANCELLED = 'cancelled'  # Stop for good and remove the partial file
+PAUSED = 'paused'  # Stop, keep the partial file, wait for resume_job()
+PREEMPTED = 'preempted'  # Stop, keep the partial file, go back to the queue behind more urgent work
+STOPPED = 'stopped'  # Shutting down: stop, keep the partial file, resume on next start
+
+
+class JobInterrupted(Exception):
+    """
+    Raised from our progress hook to unwind a running yt-dlp download. yt-dlp re-raises exceptions
+    it does not know from hooks, so this reaches download_single_video with the .part file intact.
+    """
+
+    def __init__(self, job_id, reason):
+        super().__init__(f"Job {job_id} {reason}")
+        self.job_id = job_id
+        self.reason = reason
+
+
+class JobControl:
+    """
+    Cooperative stop requests for running jobs. request() only records the wish, the job's own
+    thread acts on it the next time it calls check() (every progress update, and between phases).
+    """
+
+    def __init__(self):
+        self._requests = {}  # job_id -> reason
+        self._lock = threading.Lock()
+
+    def request(self, job_id, reason):
+        with self._lock:
+            # A cancel or shutdown is never downgraded to a pause or preemption
+            if self._requests.get(job_id) in (CANCELLED, STOPPED) and reason in (PAUSED, PREEMPTED):
+                return
+            self._requests[job_id] = reason
+
+    def requested(self, job_id):
+        with self._lock:
+            return self._requests.get(job_id)
+
+    def check(self, job_id):
+        reason = self.requested(job_id)
+        if reason:
+            raise JobInterrupted(job_id, reason)
+
+    def clear(self, job_id):
+        with self._lock:
+            return self._requests.pop(job_id, None)
@@ -0,0 +1,173 @@
+import os
+import time
+import sqlite3
+import threading
+
+DEFAULT_DB_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'youtube_downloader', 'jobs.sqlite3')
+
+
+class JobJournal:
+    """
+    SQLite backed record of every download job (URL, format selector, state, bytes done, partial file, hash).
+    States: queued, running, paused, done, failed, cancelled.
+    Every state change is committed straight away, so after a crash we know exactly which jobs
+    finished and which ones to resume.
+    """
+
+    def __init__(self, db_path=DEFAULT_DB_PATH, progress_interval=1.0):
+        if db_path != ':memory:':
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db_path = db_path
+        self.progress_interval = progress_interval
+        self.session_started = time.time()
+        self._last_progress_write = {}
+        self._lock = threading.Lock()
+        # Worker processes share the file, a write may have to wait for another process's transaction
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL DEFAULT 'video',
+                    url TEXT NOT NULL,
+                    format_selector TEXT NOT NULL,
+                    download_path TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    bytes_done INTEGER NOT NULL DEFAULT 0,
+                    total_bytes INTEGER,
+                    partial_path TEXT,
+                    filename TEXT,
+                    sha256 TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )''')
+            columns = {row['name'] for row in self._conn.execute('PRAGMA table_info(jobs)')}
+            if 'sha256' not in columns:  # Journals created before hashes were recorded
+                self._conn.execute('ALTER TABLE jobs ADD COLUMN sha256 TEXT')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS jobs_lookup ON jobs (url, format_selector, download_path)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state)')
+
+    def add_job(self, url, format_selector, download_path, kind='video'):
+        """
+        Records a new queued job and returns (job_id, created).
+        If the same job is already queued, running, paused or done, its id is returned with created=False.
+        Done jobs whose file has since been deleted are queued again.
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._find_job(url, format_selector, download_path, kind)
+            if row and not (row['state'] == 'done' and row['filename'] and not os.path.exists(row['filename'])):
+                return row['id'], False
+            cursor = self._conn.execute(
+                "INSERT INTO jobs (kind, url, format_selector, download_path, state, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, 'queued', ?, ?)",
+                (kind, url, format_selector, download_path, now, now))
+            return cursor.lastrowid, True
+
+    def find_job(self, url, format_selector, download_path, kind='video'):
+        """
+        The latest queued, running, paused or done job with these parameters (what add_job dedupes against), or None.
+        """
+        with self._lock:
+            row = self._find_job(url, format_selector, download_path, kind)
+        return dict(row) if row else None
+
+    def _find_job(self, url, format_selector, download_path, kind):
+        return self._conn.execute(
+            "SELECT * FROM jobs WHERE url = ? AND format_selector = ? AND download_path = ? AND kind = ?"
+            " AND state IN ('queued', 'running', 'paused', 'done') ORDER BY id DESC LIMIT 1",
+            (url, format_selector, download_path, kind)).fetchone()
+
+    def get_job(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def mark_running(self, job_id):
+        self._set_state(job_id, 'running', error=None)
+
+    def mark_queued(self, job_id):
+        self._set_state(job_id, 'queued', error=None)
+
+    def mark_paused(self, job_id):
+        self._last_progress_write.pop(job_id, None)
+        self._set_state(job_id, 'paused', error=None)
+
+    def mark_cancelled(self, job_id):
+        self._last_progress_write.pop(job_id, None)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET state = 'cancelled', partial_path = NULL, updated_at = ? WHERE id = ?", (time.time(), job_id))
+
+    def mark_done(self, job_id, filename=None, sha256=None):
+        self._last_progress_write.pop(job_id, None)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET state = 'done', filename = COALESCE(?, filename), sha256 = COALESCE(?, sha256),"
+                " partial_path = NULL, updated_at = ? WHERE id = ?", (filename, sha256, time.time(), job_id))
+
+    def mark_failed(self, job_id, error):
+        self._last_progress_write.pop(job_id, None)
+        self._set_state(job_id, 'failed', error=str(error))
+
+    def update_progress(self, job_id, bytes_done, total_bytes=None, partial_path=None, force=False):
+        """
+        Records download progress. Writes are throttled to one per `progress_interval` per job.
+        """
+        now = time.time()
+        if not force and now - self._last_progress_write.get(job_id, 0) < self.progress_interval:
+            return
+        self._last_progress_write[job_id] = now
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET bytes_done = ?, total_bytes = COALESCE(?, total_bytes),"
+                " partial_path = COALESCE(?, partial_path), updated_at = ? WHERE id = ?",
+                (bytes_done, total_bytes, partial_path, now, job_id))
+
+    def set_filename(self, job_id, filename):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE jobs SET filename = ?, updated_at = ? WHERE id = ?", (filename, time.time(), job_id))
+
+    def unfinished_jobs(self):
+        """
+        Jobs that were queued or running when the last process stopped, oldest first.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM jobs WHERE state IN ('queued', 'running') ORDER BY id").fetchall()
+        return [dict(row) for row in rows]
+
+    def jobs_in_state(self, state):
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM jobs WHERE state = ? ORDER BY id", (state,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def is_done(self, url, format_selector, download_path):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM jobs WHERE url = ? AND format_selector = ? AND download_path = ? AND state = 'done' LIMIT 1",
+                (url, format_selector, download_path)).fetchone()
+        return row is not None
+
+    def urls_in_state(self, state, since=None):
+        """
+        URLs of jobs in `state`, optionally only those updated after `since` (a timestamp).
+        """
+        since = since or 0
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT url FROM jobs WHERE state = ? AND updated_at >= ? ORDER BY id", (state, since)).fetchall()
+        return [row['url'] for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _set_state(self, job_id, state, error=None):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET state = ?, error = ?, updated_at = ? WHERE id = ?", (state, error, time.time(), job_id))
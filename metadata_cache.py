@@ -0,0 +1,219 @@
+import os
+import copy
+import json
+import time
+import threading
+from collections import OrderedDict
+
+from retry_policy import classify_error, STALE_URL_STATUSES
+from singleflight import SingleFlight
+from url_utils import cache_key_for_url
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'youtube_downloader', 'metadata')
+_extractions = SingleFlight()  # extract_info calls in flight, keyed by (cache, canonical video ID)
+
+# Top-level fields format selection adds besides the chosen format's own (a merged video+audio format has these)
+SELECTION_FIELDS = ('requested_formats', 'requested_downloads', 'requested_subtitles', 'format', 'format_id',
+                    'format_note', 'resolution', 'dynamic_range', 'aspect_ratio', 'stretched_ratio',
+                    'filesize_approx', 'asr', 'audio_channels', 'language')
+
+
+def strip_format_selection(info_dict):
+    """
+    extract_info(download=False) already ran format selection and copied the chosen format(s) into the
+    info dict. Returns a copy without them, so reprocessing it with another selector starts clean instead
+    of keeping e.g. the video+audio requested_formats of the default selector.
+    """
+    fields = set(SELECTION_FIELDS).union(*((f or {}).keys() for f in info_dict.get('formats') or []))
+    return {key: value for key, value in info_dict.items() if key not in fields}
+
+
+class MetadataCache:
+    """
+    Two level cache (in-memory LRU + on-disk JSON files) for info dicts returned by extract_info.
+    Entries expire after `ttl` seconds. YouTube stream URLs stop working after a few hours,
+    so the default TTL is kept well under that.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, ttl=3600, max_entries=64, max_disk_bytes=256 * 1024**2):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()  # key -> (fetched_at, info_dict)
+        self._lock = threading.Lock()
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _disk_path(self, key):
+        safe_key = ''.join(c if c.isalnum() or c in '-_' else '_' for c in key)
+        return os.path.join(self.cache_dir, f'{safe_key}.json')
+
+    def _is_fresh(self, fetched_at):
+        return time.time() - fetched_at < self.ttl
+
+    def get(self, key):
+        """
+        Returns the cached info dict for `key`, or None if it is missing or expired.
+        """
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and self._is_fresh(entry[0]):
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self._memory[key]
+
+            entry = self._read_disk(key)
+            if entry and self._is_fresh(entry[0]):
+                self._remember(key, entry[0], entry[1])
+                self.hits += 1
+                return entry[1]
+
+            self.misses += 1
+            return None
+
+    def contains(self, key):
+        """
+        True if a fresh entry exists for `key`. Does not count as a hit or a miss.
+        """
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                entry = self._read_disk(key)
+                if entry and self._is_fresh(entry[0]):
+                    self._remember(key, entry[0], entry[1])
+            return bool(entry) and self._is_fresh(entry[0])
+
+    def put(self, key, info_dict):
+        """
+        Stores a JSON serializable info dict (see YoutubeDL.sanitize_info) under `key`, without the
+        result of its format selection. Returns the dict as stored.
+        """
+        info_dict = strip_format_selection(info_dict)
+        fetched_at = time.time()
+        with self._lock:
+            self._remember(key, fetched_at, info_dict)
+            self._write_disk(key, fetched_at, info_dict)
+        return info_dict
+
+    def invalidate(self, key):
+        with self._lock:
+            self._memory.pop(key, None)
+            if self.cache_dir:
+                try:
+                    os.remove(self._disk_path(key))
+                except OSError:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._memory)}
+
+    def _remember(self, key, fetched_at, info_dict):
+        self._memory[key] = (fetched_at, info_dict)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _read_disk(self, key):
+        if not self.cache_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return data['fetched_at'], strip_format_selection(data['info'])  # Files written before put() stripped it
+        except (OSError, ValueError, KeyError, AttributeError):
+            return None
+
+    def _write_disk(self, key, fetched_at, info_dict):
+        if not self.cache_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f'{path}.{os.getpid()}.tmp'  # Worker processes may write the same entry
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'fetched_at': fetched_at, 'info': info_dict}, f)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"Could not write metadata cache entry for {key}: {e}")
+            return
+        self._evict_disk()
+
+    def _evict_disk(self):
+        # Drop expired files first, then the least recently written ones until we are under budget
+        entries = []
+        total_bytes = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if not self._is_fresh(stat.st_mtime):
+                os.remove(path)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total_bytes += stat.st_size
+
+        entries.sort()
+        while entries and total_bytes > self.max_disk_bytes:
+            _, size, path = entries.pop(0)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_bytes -= size
+
+
+def extract_info_cached(ydl, url, cache):
+    """
+    Returns the info dict for `url`, using `cache` when possible. Only single videos are cached,
+    playlist results are returned as-is.
+    """
+    key = cache_key_for_url(url)
+    info_dict = cache.get(key)
+    if info_dict is not None:
+        return info_dict
+    # Callers asking for the same video at the same time (paste + clipboard + click, the format menu and
+    # the download it starts, a prefetch) share one extraction
+    return _extractions.do((id(cache), key), _extract_and_cache, ydl, url, key, cache)
+
+
+def _extract_and_cache(ydl, url, key, cache):
+    if cache.contains(key):  # Somebody finished extracting it between our lookup and now
+        return cache.get(key)
+    info_dict = ydl.extract_info(url, download=False)
+    if info_dict and info_dict.get('_type', 'video') == 'video':
+        info_dict = cache.put(key, ydl.sanitize_info(info_dict))
+    return info_dict
+
+
+def download_with_cached_info(ydl, url, cache):
+    """
+    Downloads `url` reusing a cached info dict so we skip a second extraction.
+    Falls back to a normal download when nothing is cached or the cached stream URLs have gone stale.
+    Other errors (throttling, network) are raised for the job's retry to back off, not retried at once.
+    """
+    from yt_dlp.utils import DownloadError
+
+    key = cache_key_for_url(url)
+    info_dict = cache.get(key)
+    if info_dict is None:
+        ydl.download([url])
+        return
+    try:
+        # process_ie_result mutates the dict it is given, keep the cached copy intact
+        ydl.process_ie_result(copy.deepcopy(info_dict), download=True)
+    except DownloadError as e:
+        if classify_error(e)[1] not in STALE_URL_STATUSES:
+            raise
+        print(f"Cached metadata for {key} failed ({e}), extracting again")
+        cache.invalidate(key)
+        ydl.download([url])
@@ -0,0 +1,274 @@
+import os
+import json
+import time
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+DEFAULT_METRICS_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'youtube_downloader')
+DEFAULT_LOG_PATH = os.path.join(DEFAULT_METRICS_DIR, 'metrics.jsonl')
+DEFAULT_TEXTFILE_PATH = os.path.join(DEFAULT_METRICS_DIR, 'youtube_downloader.prom')
+SECONDS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+# Phases a download job goes through, in order. Every job is in exactly one of them until it finishes.
+#   queued      submitted (or preempted / resumed), waiting for a worker
+#   paused      paused by the user
+#   extract     worker started: metadata extraction (or cache lookup) and format selection
+#   download    first progress event until the last file is downloaded
+#   merge_wait  streams downloaded, waiting for a post-processing worker
+#   merge       ffmpeg merging video and audio
+#   postprocess any other post-processor (fixups, thumbnails...)
+#   finalize    moving the finished file into place, archive and journal bookkeeping
+PHASES = ('queued', 'paused', 'extract', 'download', 'merge_wait', 'merge', 'postprocess', 'finalize')
+
+
+class _Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * len(SECONDS_BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(SECONDS_BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class JobTimer:
+    """
+    Phase clock for one job. enter(phase) closes the current phase and opens the next one,
+    so hooks only need to say where the job is now. Time spent in a phase is accumulated,
+    e.g. a video and an audio stream both count towards 'download'.
+    """
+
+    def __init__(self, metrics, job_id, url):
+        self.metrics = metrics
+        self.job_id = job_id
+        self.url = url
+        self.phase = 'queued'
+        self.phase_started = time.monotonic()
+        self.phases = defaultdict(float)
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def enter(self, phase):
+        with self._lock:
+            if phase == self.phase:
+                return
+            closed, seconds = self._close_phase()
+            self.phase = phase
+        self.metrics.record_phase(self.job_id, closed, seconds)
+
+    def add_retries(self, count=1):
+        with self._lock:
+            self.retries += count
+
+    def finish(self):
+        """
+        Closes the last phase and returns {phase: seconds}.
+        """
+        with self._lock:
+            closed, seconds = self._close_phase()
+            self.phase = None
+        if closed:
+            self.metrics.record_phase(self.job_id, closed, seconds)
+        return dict(self.phases)
+
+    def _close_phase(self):
+        now = time.monotonic()
+        closed, seconds = self.phase, now - self.phase_started
+        if closed:
+            self.phases[closed] += seconds
+        self.phase_started = now
+        return closed, seconds
+
+
+class Metrics:
+    """
+    Per-phase timings, bytes, throughput, retries and queue wait of every job.
+    Each event is appended to a JSON-lines log and the aggregates are exported as a Prometheus
+    textfile (for node_exporter's textfile collector) whenever a job finishes.
+    Pass log_path=None / textfile_path=None to turn either export off.
+    """
+
+    def __init__(self, log_path=DEFAULT_LOG_PATH, textfile_path=DEFAULT_TEXTFILE_PATH, max_log_bytes=16 * 1024**2):
+        self.log_path = log_path
+        self.textfile_path = textfile_path
+        self.max_log_bytes = max_log_bytes
+        for path in (log_path, textfile_path):
+            if path:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.jobs = {}  # job_id -> JobTimer, for jobs that have not finished
+        self.jobs_total = defaultdict(int)  # status -> count
+        self.bytes_total = 0
+        self.retries_total = 0
+        self.io_total = defaultdict(float)  # bytes_written / writes / write_seconds / hash_seconds of our own writes
+        self.phase_seconds = defaultdict(_Histogram)
+        self.queue_wait = _Histogram()
+        self.span_seconds = defaultdict(_Histogram)  # Timings outside jobs, e.g. format listing
+        self._lock = threading.Lock()
+        self._log_lock = threading.Lock()
+
+    def start_job(self, job_id, url):
+        timer = JobTimer(self, job_id, url)
+        with self._lock:
+            self.jobs[job_id] = timer
+        return timer
+
+    def job(self, job_id):
+        """
+        The running job's timer, or None (jobs resumed from the journal are registered when they start).
+        """
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def enter(self, job_id, phase):
+        timer = self.job(job_id)
+        if timer:
+            timer.enter(phase)
+
+    def add_retries(self, job_id, count=1):
+        timer = self.job(job_id)
+        if timer:
+            timer.add_retries(count)
+
+    def record_phase(self, job_id, phase, seconds):
+        with self._lock:
+            self.phase_seconds[phase].observe(seconds)
+        self.log({'event': 'phase', 'job_id': job_id, 'phase': phase, 'seconds': round(seconds, 4)})
+
+    def finish_job(self, job_id, result):
+        """
+        Closes the job's timer and adds its phases, retries and counters to `result` (the job-finished dict).
+        """
+        with self._lock:
+            timer = self.jobs.pop(job_id, None)
+        phases = timer.finish() if timer else {}
+        retries = timer.retries if timer else 0
+        result['phases'] = {phase: round(seconds, 4) for phase, seconds in phases.items()}
+        result['retries'] = retries
+        self._count_job(result)
+
+    def record_job(self, job_id, result):
+        """
+        finish_job for a job timed in a worker process: `result` already carries its phases and retries,
+        the timer started here when it was queued is dropped.
+        """
+        with self._lock:
+            self.jobs.pop(job_id, None)
+            for phase, seconds in (result.get('phases') or {}).items():
+                self.phase_seconds[phase].observe(seconds)
+        self._count_job(result)
+
+    def _count_job(self, result):
+        with self._lock:
+            self.jobs_total[result['status']] += 1
+            self.bytes_total += result.get('bytes') or 0
+            self.retries_total += result.get('retries') or 0
+            for field in ('bytes_written', 'writes', 'write_seconds', 'hash_seconds'):
+                self.io_total[field] += (result.get('io') or {}).get(field) or 0
+            if result.get('queue_wait') is not None:
+                self.queue_wait.observe(result['queue_wait'])
+        self.log({'event': 'job', **result})
+        self.write_textfile()
+
+    @contextmanager
+    def span(self, name, **fields):
+        """
+        Times a block that is not part of a job (format listing, playlist listing...).
+        """
+        started = time.monotonic()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            seconds = time.monotonic() - started
+            with self._lock:
+                self.span_seconds[name].observe(seconds)
+            self.log({'event': 'span', 'span': name, 'seconds': round(seconds, 4), 'error': error, **fields})
+
+    def log(self, record):
+        if not self.log_path:
+            return
+        line = json.dumps({'ts': round(time.time(), 3), **record}, default=str) + '\n'
+        with self._log_lock:
+            try:
+                if os.path.exists(self.log_path) and os.path.getsize(self.log_path) > self.max_log_bytes:
+                    os.replace(self.log_path, self.log_path + '.1')
+                with open(self.log_path, 'a', encoding='utf-8') as f:
+                    f.write(line)
+            except OSError as e:
+                print(f"Could not write metrics log: {e}")
+
+    def prometheus_text(self):
+        with self._lock:
+            lines = [
+                '# HELP ytdl_jobs_total Download jobs finished, by status.',
+                '# TYPE ytdl_jobs_total counter',
+            ]
+            lines += [f'ytdl_jobs_total{{status="{status}"}} {count}' for status, count in sorted(self.jobs_total.items())]
+            lines += [
+                '# HELP ytdl_jobs_running Jobs that have been submitted and not finished, by current phase.',
+                '# TYPE ytdl_jobs_running gauge',
+            ]
+            running = defaultdict(int)
+            for timer in self.jobs.values():
+                running[timer.phase] += 1
+            lines += [f'ytdl_jobs_running{{phase="{phase}"}} {running[phase]}' for phase in PHASES]
+            lines += [
+                '# HELP ytdl_downloaded_bytes_total Bytes downloaded by finished jobs.',
+                '# TYPE ytdl_downloaded_bytes_total counter',
+                f'ytdl_downloaded_bytes_total {self.bytes_total}',
+                '# HELP ytdl_retries_total Retried segments and downloads.',
+                '# TYPE ytdl_retries_total counter',
+                f'ytdl_retries_total {self.retries_total}',
+                '# HELP ytdl_written_bytes_total Bytes written by our own output writer (segmented downloads).',
+                '# TYPE ytdl_written_bytes_total counter',
+                f'ytdl_written_bytes_total {int(self.io_total["bytes_written"])}',
+                '# HELP ytdl_write_calls_total write() calls made by the output writer.',
+                '# TYPE ytdl_write_calls_total counter',
+                f'ytdl_write_calls_total {int(self.io_total["writes"])}',
+                '# HELP ytdl_write_seconds_total Time spent in write() by the output writer.',
+                '# TYPE ytdl_write_seconds_total counter',
+                f'ytdl_write_seconds_total {self.io_total["write_seconds"]}',
+                '# HELP ytdl_hash_seconds_total Time spent hashing downloads as they were written.',
+                '# TYPE ytdl_hash_seconds_total counter',
+                f'ytdl_hash_seconds_total {self.io_total["hash_seconds"]}',
+            ]
+            lines += self._histogram_lines('ytdl_phase_seconds', 'Time jobs spent in each phase.', self.phase_seconds, 'phase')
+            lines += self._histogram_lines('ytdl_span_seconds', 'Duration of operations outside jobs.', self.span_seconds, 'span')
+            lines += self._histogram_lines('ytdl_queue_wait_seconds', 'Time from submission to a worker picking the job up.',
+                                           {None: self.queue_wait}, None)
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self):
+        if not self.textfile_path:
+            return
+        text = self.prometheus_text()
+        tmp_path = f'{self.textfile_path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(tmp_path, self.textfile_path)  # Atomic, the collector never sees half a file
+        except OSError as e:
+            print(f"Could not write metrics textfile: {e}")
+
+    @staticmethod
+    def _histogram_lines(name, help_text, histograms, label):
+        lines = [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+        for key, histogram in sorted(histograms.items(), key=lambda item: str(item[0])):
+            labels = f'{label}="{key}",' if label else ''
+            for bound, count in zip(SECONDS_BUCKETS, histogram.counts):
+                lines.append(f'{name}_bucket{{{labels}le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{{{labels}le="+Inf"}} {histogram.count}')
+            suffix = f'{{{labels.rstrip(",")}}}' if label else ''
+            lines.append(f'{name}_sum{suffix} {histogram.sum}')
+            lines.append(f'{name}_count{suffix} {histogram.count}')
+        return lines
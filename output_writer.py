@@ -0,0 +1,190 @@
+import os
+import time
+import errno
+import hashlib
+import threading
+
+DEFAULT_BUFFER_SIZE = 4 * 1024**2
+HASH_ALGORITHM = 'sha256'  # What the download archive records
+
+
+def preallocate(fd, size):
+    """
+    Reserves `size` bytes for the file behind `fd`. Where posix_fallocate exists the blocks are really
+    allocated (less fragmentation, and a full disk fails now instead of halfway through the download),
+    elsewhere the file is only extended. Returns True if blocks were allocated.
+    """
+    if hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return True
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                raise
+            # Filesystem without fallocate support, extending the file still lets segments write at their offsets
+    os.ftruncate(fd, size)
+    return False
+
+
+class IOStats:
+    """
+    Write side counters of one file: bytes, write calls, time spent in write() and in hashing.
+    """
+    __slots__ = ('bytes_written', 'writes', 'write_seconds', 'hash_seconds', 'preallocated', 'buffer_size')
+
+    def __init__(self, buffer_size=0):
+        self.bytes_written = 0
+        self.writes = 0
+        self.write_seconds = 0.0
+        self.hash_seconds = 0.0
+        self.preallocated = 0
+        self.buffer_size = buffer_size
+
+    def add(self, other):
+        """
+        Adds another file's counters, e.g. the video and audio streams of one job.
+        """
+        self.bytes_written += other.bytes_written
+        self.writes += other.writes
+        self.write_seconds += other.write_seconds
+        self.hash_seconds += other.hash_seconds
+        self.preallocated += other.preallocated
+        self.buffer_size = max(self.buffer_size, other.buffer_size)
+
+    def as_dict(self):
+        return {
+            'bytes_written': self.bytes_written,
+            'writes': self.writes,
+            'write_seconds': round(self.write_seconds, 4),
+            'hash_seconds': round(self.hash_seconds, 4),
+            'preallocated': self.preallocated,
+            'buffer_size': self.buffer_size,
+            'avg_write': self.bytes_written // self.writes if self.writes else 0,
+        }
+
+
+class OutputWriter:
+    """
+    Writes a download to disk in large blocks and hashes it as the bytes arrive, so the file never has
+    to be read again to get its checksum.
+
+    - write(data) appends, buffering up to `buffer_size` bytes per write() system call.
+    - write_at(offset, data) writes a block at its offset, from any thread (segmented downloads).
+      Blocks that arrive ahead of the hash position are held in memory until the gap before them is
+      written; callers bound how far ahead they write (see hashed_offset).
+
+    With `size` the file is preallocated, and trimmed on close() if fewer bytes were written.
+    With `resume_from` the file's first bytes are kept (read back once for the hash) and writing continues after them.
+    """
+
+    def __init__(self, path, size=None, buffer_size=DEFAULT_BUFFER_SIZE, hash_name=HASH_ALGORITHM, resume_from=0):
+        self.path = path
+        self.size = size
+        self.buffer_size = buffer_size
+        self.stats = IOStats(buffer_size)
+        self._hash = hashlib.new(hash_name)
+        self._hashed = 0  # Every byte before this offset went into the hash
+        self._ahead = {}  # offset -> block written but not hashed yet
+        self._buffer = bytearray()
+        self._position = 0
+        self._end = 0
+        self._lock = threading.Lock()
+        self._hashed_changed = threading.Condition(self._lock)
+        flags = os.O_WRONLY | os.O_CREAT | getattr(os, 'O_BINARY', 0) | (0 if resume_from else os.O_TRUNC)
+        self._fd = os.open(path, flags, 0o666)
+        if size:
+            if preallocate(self._fd, size):
+                self.stats.preallocated = size
+        if resume_from:
+            self._hash_existing(resume_from)
+
+    @property
+    def hashed_offset(self):
+        with self._lock:
+            return self._hashed
+
+    def wait_for_hash(self, offset, timeout=None):
+        """
+        Blocks until everything before `offset` has been hashed (or the timeout expires).
+        Returns True when it has.
+        """
+        with self._hashed_changed:
+            return self._hashed_changed.wait_for(lambda: self._hashed >= offset, timeout)
+
+    def write(self, data):
+        self._buffer += data
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            data = bytes(self._buffer)
+            self._buffer.clear()
+            self.write_at(self._position, data)
+            self._position += len(data)
+
+    def write_at(self, offset, data):
+        started = time.perf_counter()
+        view = memoryview(data)
+        written = 0
+        while written < len(view):
+            written += self._pwrite(view[written:], offset + written)
+        write_seconds = time.perf_counter() - started
+        with self._lock:
+            self.stats.bytes_written += len(data)
+            self.stats.writes += 1
+            self.stats.write_seconds += write_seconds
+            self._end = max(self._end, offset + len(data))
+            if offset == self._hashed:
+                self._update_hash(data)
+                while self._hashed in self._ahead:
+                    self._update_hash(self._ahead.pop(self._hashed))
+                self._hashed_changed.notify_all()
+            elif offset > self._hashed:
+                self._ahead[offset] = bytes(data)
+
+    def _pwrite(self, data, offset):
+        if hasattr(os, 'pwrite'):
+            return os.pwrite(self._fd, data, offset)
+        # No pwrite (Windows): seek + write must not interleave with another thread's
+        with self._lock:
+            os.lseek(self._fd, offset, os.SEEK_SET)
+            return os.write(self._fd, data)
+
+    def _hash_existing(self, length):
+        with open(self.path, 'rb') as f:
+            while self._hashed < length:
+                data = f.read(min(self.buffer_size, length - self._hashed))
+                if not data:
+                    break
+                self._update_hash(data)
+        self._position = self._end = self._hashed
+
+    def _update_hash(self, data):
+        started = time.perf_counter()
+        self._hash.update(data)
+        self._hashed += len(data)
+        self.stats.hash_seconds += time.perf_counter() - started
+
+    def close(self):
+        """
+        Flushes and closes the file. Returns the hex digest of its content, or None when the bytes
+        written were not contiguous from the start (the download did not complete).
+        """
+        try:
+            self.flush()
+            if self.size and self._end < self.size:
+                os.ftruncate(self._fd, self._end)
+        finally:
+            os.close(self._fd)
+        with self._lock:
+            if self._ahead or self._hashed != self._end:
+                return None
+            return self._hash.hexdigest()
+
+    def abort(self):
+        """
+        Closes the file without flushing, e.g. after a failed download.
+        """
+        self._buffer.clear()
+        os.close(self._fd)
@@ -0,0 +1,77 @@
+from startup import load_youtube_dl
+
+
+class PlaylistEntry:
+    """
+    The fields of a flat playlist entry we use. yt-dlp's entry dicts also carry thumbnail lists,
+    badges and uploader fields, a few KB each; on channels with thousands of videos keeping them
+    around costs far more than the downloads need, so each one is dropped once projected.
+    """
+    __slots__ = ('id', 'title', 'duration')
+
+    def __init__(self, id, title=None, duration=None):
+        self.id = id
+        self.title = title
+        self.duration = duration
+
+    @classmethod
+    def from_entry(cls, entry):
+        duration = entry.get('duration')
+        return cls(str(entry['id']), entry.get('title'), int(duration) if duration else None)
+
+    @property
+    def url(self):
+        return f"https://www.youtube.com/watch?v={self.id}"
+
+    def as_dict(self):
+        return {'id': self.id, 'title': self.title, 'duration': self.duration}
+
+
+def iter_playlist_entries(playlist_url):
+    """
+    Yields a PlaylistEntry per video as yt-dlp pages through the playlist, without resolving each
+    entry's formats. Nested playlists such as channel tabs are expanded in place.
+    """
+    ydl_opts = {
+        'extract_flat': 'in_playlist',
+        'lazy_playlist': True,
+        'quiet': True,
+        'no_warnings': True,
+    }
+    with load_youtube_dl()(ydl_opts) as ydl:
+        yield from _iter_entries(ydl, playlist_url)
+
+
+def _iter_entries(ydl, url):
+    result = ydl.extract_info(url, download=False, process=False)
+    # Redirects (e.g. watch?v=...&list=... -> the playlist itself) come back as url results
+    while result and result.get('_type') in ('url', 'url_transparent') and result.get('url') != url:
+        url = result['url']
+        result = ydl.extract_info(url, download=False, process=False)
+    if not result:
+        return
+
+    for entry in _iter_pages(result.get('entries') or []):
+        if not entry:
+            continue
+        if entry.get('ie_key') == 'YoutubeTab' and entry.get('url'):
+            yield from _iter_entries(ydl, entry['url'])
+        elif entry.get('id'):
+            yield PlaylistEntry.from_entry(entry)
+
+
+def _iter_pages(entries):
+    if hasattr(entries, 'getpage'):
+        # PagedList: fetch one of its own pages at a time and drop each page from its cache once read
+        pagesize, pagecount = entries._pagesize, entries._pagecount
+        pagenum = 0
+        while pagenum < pagecount:
+            page = entries.getpage(pagenum)
+            entries._cache.pop(pagenum, None)
+            yield from page
+            if pagecount == float('inf') and len(page) < pagesize:
+                return  # OnDemandPagedList: a page that is not full is the last one
+            pagenum += 1
+    else:
+        # Generators and LazyLists already fetch pages on demand
+        yield from entries
@@ -0,0 +1,187 @@
+import os
+import heapq
+import shutil
+
+from bandwidth import parse_rate
+from format_selection import RESOLUTION_FORMATS, format_size
+
+# Highest video height allowed by each playlist resolution choice, None means no limit
+RESOLUTION_HEIGHTS = {"best": None, "4k": 2160, "1440p": 1440, "1080p": 1080, "720p": 720, "360p": 360}
+DISK_RESERVE = 1024**3  # Left free on the download disk when the budget comes from free space
+
+
+def parse_size(text):
+    """
+    Parses '700M', '4G', '1.5g' or a plain number of bytes. Empty or 0 means no limit (None).
+    """
+    return parse_rate(text)
+
+
+def free_space_budget(download_path, reserve=DISK_RESERVE):
+    """
+    Bytes that can be written to the disk holding `download_path` while keeping `reserve` free.
+    """
+    path = download_path
+    while path and not os.path.exists(path):
+        path = os.path.dirname(path)
+    return max(shutil.disk_usage(path or '.').free - reserve, 0)
+
+
+class PlannedItem:
+    """
+    One playlist entry of a plan: the format picked for it and its estimated download size.
+    `options` are the (selector, size, height) choices that fit the constraints, best first.
+    """
+    __slots__ = ('url', 'title', 'options', 'choice', 'status')
+
+    def __init__(self, url, title, options, status='planned'):
+        self.url = url
+        self.title = title
+        self.options = options
+        self.choice = 0
+        self.status = status  # 'planned', 'unknown' (no size estimate), 'too large', 'over budget' or 'archived'
+
+    @property
+    def selector(self):
+        return self.options[self.choice][0] if self.options else None
+
+    @property
+    def size(self):
+        return self.options[self.choice][1] if self.options else None
+
+    @property
+    def height(self):
+        return self.options[self.choice][2] if self.options else None
+
+
+def item_options(table, resolution, max_item_bytes=None):
+    """
+    (selector, size, height) for every format of `table` allowed by `resolution` and the per-item cap,
+    best first, each smaller than the one before. A selector falls back to the resolution's own selector
+    in case the format is gone by the time the download starts.
+    """
+    fallback = RESOLUTION_FORMATS.get(resolution, RESOLUTION_FORMATS['best'])
+    audio = table.best_audio()
+    if resolution == "audio only":
+        records = table.filter(video=False, max_bytes=max_item_bytes)
+    else:
+        records = table.filter(max_height=RESOLUTION_HEIGHTS.get(resolution), max_bytes=max_item_bytes, video=True)
+    options = []
+    for record in records:
+        size = table.download_size(record)
+        if size is None:
+            continue
+        if options and size >= options[-1][1]:
+            continue  # Same or more bytes for a lower ranked format
+        if record.has_video and not record.has_audio and audio:
+            selector = f'{record.format_id}+{audio.format_id}/{fallback}'
+        else:
+            selector = f'{record.format_id}/{fallback}'
+        options.append((selector, size, record.height))
+    return options
+
+
+class PlaylistPlan:
+    """
+    Formats picked for a whole playlist so that the projected total fits `budget` bytes.
+    The budget only covers entries whose size can be estimated: entries of unknown size are still
+    downloaded on top of it (best effort), unless `skip_unknown` makes the budget a hard cap.
+    """
+
+    def __init__(self, resolution, budget=None, max_item_bytes=None, skip_unknown=False):
+        self.resolution = resolution
+        self.budget = budget
+        self.max_item_bytes = max_item_bytes
+        self.skip_unknown = skip_unknown
+        self.items = []
+
+    def add(self, url, title, table):
+        """
+        Adds an entry with its FormatTable (None when its metadata could not be resolved).
+        """
+        if table is None:
+            self.items.append(PlannedItem(url, title, [], status='unknown'))
+            return
+        options = item_options(table, self.resolution, self.max_item_bytes)
+        if options:
+            self.items.append(PlannedItem(url, title, options))
+        elif self.max_item_bytes and item_options(table, self.resolution):
+            self.items.append(PlannedItem(url, title, [], status='too large'))
+        else:
+            self.items.append(PlannedItem(url, title, [], status='unknown'))
+
+    def add_archived(self, url, title):
+        """
+        Adds an entry that is already downloaded: it is not resolved, planned or downloaded again.
+        """
+        self.items.append(PlannedItem(url, title, [], status='archived'))
+
+    def fit(self):
+        """
+        Steps items down to smaller formats until the total fits the budget. The item currently at the
+        highest resolution (then the largest) is stepped down first, so quality stays even across the
+        playlist instead of the last entries getting whatever is left. Items that still do not fit at
+        their smallest format are dropped from the end of the playlist.
+        """
+        planned = [item for item in self.items if item.status in ('planned', 'over budget')]
+        for item in planned:
+            item.choice = 0
+            item.status = 'planned'
+        if self.budget is None:
+            return self
+        total = sum(item.size for item in planned)
+        heap = [(-item.height, -item.size, index) for index, item in enumerate(planned) if len(item.options) > 1]
+        heapq.heapify(heap)
+        while total > self.budget and heap:
+            _, _, index = heapq.heappop(heap)
+            item = planned[index]
+            total -= item.size
+            item.choice += 1
+            total += item.size
+            if item.choice < len(item.options) - 1:
+                heapq.heappush(heap, (-item.height, -item.size, index))
+        for item in reversed(planned):
+            if total <= self.budget:
+                break
+            total -= item.size
+            item.status = 'over budget'
+        return self
+
+    @property
+    def total(self):
+        return sum(item.size for item in self.items if item.status == 'planned')
+
+    def downloads(self):
+        """
+        (url, format selector) of every entry to download. Entries without a size estimate use the
+        plain resolution selector, they are counted in the summary as unknown (and left out with skip_unknown).
+        """
+        selector = RESOLUTION_FORMATS.get(self.resolution, RESOLUTION_FORMATS['best'])
+        statuses = ('planned',) if self.skip_unknown else ('planned', 'unknown')
+        return [(item.url, item.selector if item.status == 'planned' else selector)
+                for item in self.items if item.status in statuses]
+
+    def count(self, status):
+        return sum(item.status == status for item in self.items)
+
+    def summary(self):
+        """
+        One line projection shown before anything is downloaded.
+        """
+        planned = self.count('planned')
+        parts = [f"{planned} video(s), ~{format_size(self.total)} projected"]
+        if self.budget is not None:
+            parts[0] += f" (budget {format_size(self.budget)})"
+        downgraded = sum(item.choice > 0 for item in self.items if item.status == 'planned')
+        if downgraded:
+            parts.append(f"{downgraded} at a lower quality to fit")
+        for status in ('unknown', 'too large', 'over budget', 'archived'):
+            if self.count(status):
+                if status == 'unknown':
+                    label = 'skipped, size unknown' if self.skip_unknown else 'size unknown, not in the budget'
+                elif status == 'archived':
+                    label = 'already downloaded'
+                else:
+                    label = f'skipped, {status}'
+                parts.append(f"{self.count(status)} {label}")
+        return ', '.join(parts)
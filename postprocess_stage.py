@@ -0,0 +1,120 @@
+import os
+import shutil
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+
+def default_merge_workers():
+    # Stream-copy merges are mostly disk bound, half the cores leaves room for the download threads
+    return max(1, (os.cpu_count() or 2) // 2)
+
+
+def merge_streams(ffmpeg, stream_paths, output_path, keep_streams=False):
+    """
+    Muxes a video stream and an audio stream into `output_path` without re-encoding
+    (what yt-dlp's Merger does), then removes the stream files unless keep_streams is set.
+    """
+    temp_path = f'{os.path.splitext(output_path)[0]}.temp{os.path.splitext(output_path)[1]}'
+    command = [ffmpeg, '-y', '-loglevel', 'error', '-nostdin']
+    for path in stream_paths:
+        command += ['-i', path]
+    # First video track of the first input and first audio track of the others, like yt-dlp
+    command += ['-map', '0:v:0?']
+    for index in range(1, len(stream_paths)):
+        command += ['-map', f'{index}:a:0?']
+    command += ['-c', 'copy', temp_path]
+    completed = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if completed.returncode != 0:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise RuntimeError(f"ffmpeg failed merging {output_path}: {completed.stderr.decode(errors='replace').strip()}")
+    os.replace(temp_path, output_path)
+    if not keep_streams:
+        for path in stream_paths:
+            if os.path.exists(path):
+                os.remove(path)
+    return output_path
+
+
+class PostProcessStage:
+    """
+    The CPU stage of the download pipeline. Download workers hand it finished streams and go back to
+    downloading while merges run here, on their own bounded pool and queue.
+
+    Each worker thread only drives one ffmpeg process, the muxing itself happens in ffmpeg, so threads
+    give the same isolation a process pool would without starting a Python interpreter per worker.
+    """
+
+    def __init__(self, max_workers=None, ffmpeg=None):
+        self.ffmpeg = ffmpeg or shutil.which('ffmpeg')
+        self.max_workers = max_workers or default_merge_workers()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='postprocess')
+        self._pending = 0
+        self._futures = set()
+        self._idle = threading.Condition()
+
+    @property
+    def available(self):
+        return bool(self.ffmpeg)
+
+    def submit_merge(self, stream_paths, output_path, on_started=None, on_done=None):
+        """
+        Queues a merge. on_started() runs when a worker picks it up and may raise to skip the merge,
+        on_done(output_path, error) runs when it is over; error is None on success.
+        Both run on the stage's worker thread.
+        """
+        with self._idle:
+            self._pending += 1
+            future = self._executor.submit(self._run, list(stream_paths), output_path, on_started, on_done)
+            self._futures.add(future)
+        future.add_done_callback(self._forget)
+        return future
+
+    def pending_count(self):
+        """
+        Merges queued or running.
+        """
+        with self._idle:
+            return self._pending
+
+    def join(self, timeout=None):
+        """
+        Waits until every submitted merge is done. Returns False on timeout.
+        """
+        with self._idle:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout)
+
+    def shutdown(self, wait=True):
+        """
+        Without wait, merges that have not started are dropped (their streams stay on disk).
+        """
+        if not wait:
+            with self._idle:
+                futures = list(self._futures)
+            for future in futures:
+                if future.cancel():
+                    with self._idle:
+                        self._pending -= 1
+                        self._idle.notify_all()
+        self._executor.shutdown(wait=wait)
+
+    def _forget(self, future):
+        with self._idle:
+            self._futures.discard(future)
+
+    def _run(self, stream_paths, output_path, on_started, on_done):
+        try:
+            error = None
+            try:
+                if on_started:
+                    on_started()
+                merge_streams(self.ffmpeg, stream_paths, output_path)
+            except Exception as e:
+                error = e
+            if on_done:
+                on_done(output_path, error)
+        finally:
+            with self._idle:
+                self._pending -= 1
+                self._idle.notify_all()
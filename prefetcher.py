@@ -0,0 +1,152 @@
+import time
+import heapq
+import itertools
+import threading
+
+from retry_policy import classify_error, THROTTLED
+from url_utils import cache_key_for_url
+
+# Lower runs first
+CLIPBOARD_PRIORITY = 0  # The user just copied it, formats will be asked for any moment
+LOOKAHEAD_PRIORITY = 1  # Next queued downloads
+
+
+class MetadataPrefetcher:
+    """
+    Resolves video metadata ahead of need on a few background threads, so neither the format menu
+    nor a download worker has to wait for extraction.
+
+    - The queue is bounded (`max_queued`) and ordered by priority; a clipboard URL evicts lookahead work.
+    - At most `budget_per_minute` extractions are started per minute (token bucket) so prefetching
+      does not get us throttled, and a throttling error pauses prefetching for `throttle_backoff` seconds.
+    - wait_for() lets a foreground caller join an extraction already in flight instead of repeating it.
+
+    `resolve(url)` must extract and cache the metadata, `is_cached(url)` says whether that is still needed.
+    """
+
+    def __init__(self, resolve, is_cached, max_workers=2, max_queued=32, budget_per_minute=30, throttle_backoff=60):
+        self.resolve = resolve
+        self.is_cached = is_cached
+        self.max_queued = max_queued
+        self.budget = budget_per_minute
+        self.throttle_backoff = throttle_backoff
+        self.prefetched = 0
+        self.skipped = 0
+        self.failed = 0
+        self._heap = []  # (priority, sequence, key, url)
+        self._queued = set()
+        self._in_flight = {}  # key -> Event set when the extraction is over
+        self._sequence = itertools.count()
+        self._tokens = float(budget_per_minute)
+        self._refilled = time.monotonic()
+        self._paused_until = 0.0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._workers = [threading.Thread(target=self._worker_loop, name=f'prefetch-{i}', daemon=True)
+                         for i in range(max_workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def prefetch(self, url, priority=LOOKAHEAD_PRIORITY):
+        """
+        Queues `url`. Returns False when it is already cached, queued or in flight, or the queue is full
+        of work at least as urgent.
+        """
+        key = cache_key_for_url(url)
+        with self._cond:
+            if self._closed or key in self._queued or key in self._in_flight:
+                return False
+        if self.is_cached(url):
+            return False
+        with self._cond:
+            if key in self._queued or key in self._in_flight:
+                return False
+            if len(self._heap) >= self.max_queued:
+                least_urgent = max(self._heap)
+                if least_urgent[0] <= priority:
+                    return False
+                self._heap.remove(least_urgent)
+                heapq.heapify(self._heap)
+                self._queued.discard(least_urgent[2])
+            heapq.heappush(self._heap, (priority, next(self._sequence), key, url))
+            self._queued.add(key)
+            self._cond.notify()
+        return True
+
+    def wait_for(self, url, timeout=60):
+        """
+        Called before a foreground extraction of `url`: waits for a prefetch of it already in flight,
+        and drops it from the queue if it has not started (the caller is about to do it anyway).
+        """
+        key = cache_key_for_url(url)
+        with self._cond:
+            if key in self._queued:
+                self._heap = [item for item in self._heap if item[2] != key]
+                heapq.heapify(self._heap)
+                self._queued.discard(key)
+            in_flight = self._in_flight.get(key)
+        if in_flight:
+            in_flight.wait(timeout)
+
+    def stats(self):
+        with self._cond:
+            return {'queued': len(self._heap), 'in_flight': len(self._in_flight), 'prefetched': self.prefetched,
+                    'skipped': self.skipped, 'failed': self.failed, 'tokens': int(self._tokens),
+                    'paused': max(0.0, self._paused_until - time.monotonic())}
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._heap.clear()
+            self._queued.clear()
+            self._cond.notify_all()
+
+    def _refill(self, now):
+        self._tokens = min(self.budget, self._tokens + (now - self._refilled) * self.budget / 60)
+        self._refilled = now
+
+    def _next_item(self):
+        # Called with the condition held. Blocks until an item may start, returns None once closed.
+        while not self._closed:
+            now = time.monotonic()
+            self._refill(now)
+            timeout = None
+            if self._heap:
+                if now < self._paused_until:
+                    timeout = self._paused_until - now
+                elif self._tokens < 1:
+                    timeout = (1 - self._tokens) * 60 / self.budget
+                else:
+                    _, _, key, url = heapq.heappop(self._heap)
+                    self._queued.discard(key)
+                    self._tokens -= 1
+                    self._in_flight[key] = threading.Event()
+                    return key, url
+            self._cond.wait(timeout)
+        return None
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                item = self._next_item()
+            if item is None:
+                return
+            key, url = item
+            try:
+                if self.is_cached(url):
+                    with self._cond:
+                        self.skipped += 1
+                        self._tokens += 1  # Nothing was fetched, give the budget back
+                else:
+                    self.resolve(url)
+                    with self._cond:
+                        self.prefetched += 1
+            except Exception as e:
+                with self._cond:
+                    self.failed += 1
+                    if classify_error(e)[0] == THROTTLED:
+                        print(f"Prefetching paused for {self.throttle_backoff}s, the site is throttling us ({e})")
+                        self._paused_until = time.monotonic() + self.throttle_backoff
+            finally:
+                with self._cond:
+                    self._in_flight.pop(key).set()
@@ -0,0 +1,305 @@
+import os
+import time
+import queue
+import signal
+import threading
+import multiprocessing
+from collections import OrderedDict
+
+from job_control import CANCELLED, PAUSED, STOPPED
+
+PROGRESS_INTERVAL = 0.25  # Seconds between two progress messages of a job, status changes are always sent
+TASKS_PER_THREAD = 2  # Tasks a worker holds per download thread, the extra ones are prefetched while others download
+
+# Messages from the workers to the parent, plain tuples so each one pickles to a few dozen bytes:
+#   ('ready', worker_index, capacity)    the worker can hold `capacity` tasks
+#   ('progress', job_id, status, downloaded_bytes, total_bytes, speed, eta, filename, title)
+#   ('result', result)                   the job-finished dict: done, failed, cancelled or skipped
+#   ('released', job_id)                 the job left the worker without a result (paused)
+#   ('throttled', worker_index, host, seconds)   the worker's circuit breaker opened for `host`
+#   ('exited', worker_index)             clean exit, anything else is a crash
+# and from the parent to one worker:
+#   (RUN, (job_id, video_url, download_path, format_id)), (CANCELLED | PAUSED, job_id), (RATE_LIMIT, bytes/s),
+#   (HOLD_HOST, (host, seconds)), (STOPPED, None) to interrupt everything or (EXIT, None) to finish the jobs
+#   it has and exit.
+RUN = 'run'
+RATE_LIMIT = 'rate_limit'
+HOLD_HOST = 'hold_host'
+EXIT = 'exit'
+# Worker options that are totals for the whole pool, split between the workers so they add up exactly
+SPLIT_OPTIONS = ('max_workers', 'max_per_host')
+
+
+def default_processes():
+    return os.cpu_count() or 1
+
+
+def _worker_main(index, options, commands, events):
+    """
+    Worker process: a DownloadService of its own (threads, yt-dlp sessions, merges) on the parent's
+    journal, archive and metadata cache files, running the tasks the parent sends it.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C reaches the whole process group, the parent decides
+    from download_archive import DownloadArchive
+    from download_service import DownloadService
+    from job_journal import JobJournal
+    from metadata_cache import MetadataCache
+    from metrics import Metrics
+
+    options = dict(options)
+    service = DownloadService(journal=JobJournal(options.pop('journal_path')),
+                              archive=DownloadArchive(options.pop('archive_path')),
+                              metadata_cache=MetadataCache(options.pop('cache_dir')),
+                              metrics=Metrics(log_path=None, textfile_path=None),  # The parent logs and exports
+                              quiet=True, **options)
+    last_sent = {}  # job_id -> (status, monotonic time) of the last progress message
+    lock = threading.Lock()
+
+    def on_progress(d, job_id):
+        status = d['status']
+        now = time.monotonic()
+        with lock:
+            previous = last_sent.get(job_id)
+            if previous and previous[0] == status and now - previous[1] < PROGRESS_INTERVAL:
+                return
+            last_sent[job_id] = (status, now)
+        events.put(('progress', job_id, status, d.get('downloaded_bytes'),
+                    d.get('total_bytes') or d.get('total_bytes_estimate'), d.get('speed'), d.get('eta'),
+                    d.get('filename'), (d.get('info_dict') or {}).get('title')))
+        if status == 'paused':
+            events.put(('released', job_id))
+
+    def on_result(result):
+        with lock:
+            last_sent.pop(result['job_id'], None)
+        events.put(('result', result))
+
+    service.progress_listeners.append(on_progress)
+    service.job_listeners.append(on_result)
+    service.throttle_listeners.append(lambda host, seconds: events.put(('throttled', index, host, seconds)))
+    events.put(('ready', index, service.scheduler.max_workers * TASKS_PER_THREAD))
+    try:
+        while True:
+            command, arg = commands.get()
+            if command == RUN:
+                service.submit_job(*arg)
+            elif command == CANCELLED:
+                service.cancel_job(arg)
+            elif command == PAUSED:
+                service.pause_job(arg)
+            elif command == RATE_LIMIT:
+                service.bandwidth.set_rate_limit(arg)
+            elif command == HOLD_HOST:
+                service.breaker.hold(*arg)
+            elif command == STOPPED:
+                service.stop_all()  # Running jobs go back to 'queued' in the journal
+                break
+            elif command == EXIT:
+                service.join()
+                break
+    finally:
+        service.close()
+        events.put(('exited', index))
+
+
+class ProcessPool:
+    """
+    Runs bulk download jobs in worker processes, so the CPU-bound part of yt-dlp (extraction: regexes,
+    JSON, signature deciphering) uses one core per worker instead of sharing one GIL.
+
+    Tasks wait here until a worker has room for them (each worker says how many it can hold) and then
+    belong to that worker, so cancel / pause requests go to exactly one process and tasks not handed
+    out yet can simply be taken back. Workers send progress (throttled) and results as tuples on one
+    queue, read by a thread here that calls on_progress(job_id, status, downloaded, total, speed, eta,
+    filename, title), on_result(result) and on_lost(job_id) (the job's worker crashed).
+    `worker_options` are DownloadService arguments plus journal_path, archive_path and cache_dir;
+    max_workers and max_per_host are totals, each worker gets its share.
+
+    Every worker has its own circuit breaker. When one opens for a host, the others are told to hold
+    that host for as long, and on_throttled(host, seconds) lets the parent's breaker do the same.
+    """
+
+    def __init__(self, processes, worker_options, on_progress, on_result, on_lost, on_throttled=None):
+        self.processes = processes
+        self.worker_options = worker_options
+        self.on_progress = on_progress
+        self.on_result = on_result
+        self.on_lost = on_lost
+        self.on_throttled = on_throttled
+        # spawn: forking a process that already runs threads (and holds SQLite connections) is not safe
+        self._context = multiprocessing.get_context('spawn')
+        self._events = self._context.Queue()
+        self._commands = [self._context.Queue() for _ in range(processes)]
+        self._workers = [None] * processes
+        self._capacity = [0] * processes  # Tasks each worker can still take
+        self._exited = set()
+        self._pending = OrderedDict()  # job_id -> task, not handed to a worker yet
+        self._owners = {}  # job_id -> worker index
+        self._closing = False
+        self._idle = threading.Condition()
+        for index in range(processes):
+            self._start_worker(index)
+        self._reader = threading.Thread(target=self._read_events, name='process-pool-events', daemon=True)
+        self._reader.start()
+
+    def _start_worker(self, index):
+        options = dict(self.worker_options)
+        for key in SPLIT_OPTIONS:
+            if options.get(key):
+                options[key] = options[key] // self.processes + (index < options[key] % self.processes)
+        worker = self._context.Process(target=_worker_main, name=f'download-shard-{index}', daemon=True,
+                                       args=(index, options, self._commands[index], self._events))
+        worker.start()
+        self._workers[index] = worker
+
+    def submit(self, job_id, video_url, download_path, format_id):
+        with self._idle:
+            self._pending[job_id] = (job_id, video_url, download_path, format_id)
+            self._hand_out()
+
+    def _hand_out(self):
+        # Next task to the worker with the most room, which spreads a playlist evenly over the processes
+        while self._pending and not self._closing:
+            index = max(range(self.processes), key=lambda i: self._capacity[i])
+            if not self._capacity[index]:
+                return
+            job_id, task = self._pending.popitem(last=False)
+            self._capacity[index] -= 1
+            self._owners[job_id] = index
+            self._commands[index].put((RUN, task))
+
+    def remove(self, job_id):
+        """
+        Takes back a job no worker has received yet. Returns False if it is not waiting here.
+        """
+        with self._idle:
+            if self._pending.pop(job_id, None) is None:
+                return False
+            self._idle.notify_all()
+            return True
+
+    def request(self, job_id, reason):
+        """
+        Asks the worker running the job to cancel or pause it. Returns False when no worker has it.
+        """
+        with self._idle:
+            index = self._owners.get(job_id)
+        if index is None:
+            return False
+        self._commands[index].put((reason, job_id))
+        return True
+
+    def set_rate_limit(self, rate_limit):
+        """
+        Splits a new total rate limit evenly between the workers.
+        """
+        share = rate_limit / self.processes if rate_limit else None
+        self.worker_options['rate_limit'] = share  # For workers restarted later
+        for commands in self._commands:
+            commands.put((RATE_LIMIT, share))
+
+    def hold_host(self, host, seconds, except_index=None):
+        """
+        Has every worker (but `except_index`) keep new jobs off `host` for `seconds`, as if its own
+        circuit breaker had opened.
+        """
+        for index, commands in enumerate(self._commands):
+            if index != except_index:
+                commands.put((HOLD_HOST, (host, seconds)))
+
+    def pending_count(self):
+        """
+        Jobs waiting here or queued and running in the workers.
+        """
+        with self._idle:
+            return len(self._pending) + len(self._owners)
+
+    def join(self, timeout=None):
+        with self._idle:
+            return self._idle.wait_for(lambda: not self._pending and not self._owners, timeout)
+
+    def stop(self):
+        """
+        Interrupts every worker. Their jobs and the ones still waiting here stay queued in the journal.
+        """
+        with self._idle:
+            self._closing = True
+            self._pending.clear()
+            self._owners.clear()
+            self._idle.notify_all()
+        for commands in self._commands:
+            commands.put((STOPPED, None))
+
+    def close(self, timeout=30):
+        with self._idle:
+            self._closing = True
+        for commands in self._commands:
+            commands.put((EXIT, None))
+        for worker in self._workers:
+            worker.join(timeout)
+            if worker.is_alive():
+                worker.terminate()
+        self._events.put(None)
+        self._reader.join()
+
+    def _release(self, job_id):
+        with self._idle:
+            index = self._owners.pop(job_id, None)
+            if index is not None:
+                self._capacity[index] += 1
+                self._hand_out()
+            self._idle.notify_all()
+
+    def _read_events(self):
+        while True:
+            try:
+                message = self._events.get(timeout=1.0)
+            except queue.Empty:
+                self._check_workers()
+                continue
+            if message is None:
+                return
+            try:
+                self._dispatch(message)
+            except Exception as e:
+                print(f"Error handling a message from a download worker: {e}")
+
+    def _dispatch(self, message):
+        kind = message[0]
+        if kind == 'progress':
+            self.on_progress(*message[1:])
+        elif kind == 'result':
+            result = message[1]
+            self.on_result(result)  # Before _release, so join() returns after the listeners ran
+            self._release(result['job_id'])
+        elif kind == 'released':
+            self._release(message[1])
+        elif kind == 'ready':
+            with self._idle:
+                self._capacity[message[1]] = message[2]
+                self._hand_out()
+        elif kind == 'throttled':
+            _, index, host, seconds = message
+            self.hold_host(host, seconds, except_index=index)
+            if self.on_throttled:
+                self.on_throttled(host, seconds)
+        elif kind == 'exited':
+            self._exited.add(message[1])
+
+    def _check_workers(self):
+        # A worker that died without saying so (killed, out of memory...) takes its jobs down with it
+        for index, worker in enumerate(self._workers):
+            if worker.is_alive() or index in self._exited or self._closing:
+                continue
+            with self._idle:
+                lost = [job_id for job_id, owner in self._owners.items() if owner == index]
+                self._capacity[index] = 0  # Until the new worker says it is ready
+                # A new queue: tasks the dead worker never read are lost jobs now, they must not run again
+                old_commands, self._commands[index] = self._commands[index], self._context.Queue()
+            old_commands.cancel_join_thread()
+            old_commands.close()
+            print(f"Download worker {index} exited with code {worker.exitcode}, restarting it")
+            self._start_worker(index)
+            for job_id in lost:
+                self.on_lost(job_id)
+                self._release(job_id)
@@ -0,0 +1,145 @@
+import time
+import queue
+from collections import namedtuple
+
+ProgressEvent = namedtuple('ProgressEvent', 'job_id status downloaded total speed label timestamp')
+
+
+class ProgressBus:
+    """
+    Thread-safe hand-off of progress events from download workers to the UI thread.
+    publish() is cheap and never touches Tk, the UI drains the queue at its own pace.
+    """
+
+    def __init__(self):
+        self._events = queue.SimpleQueue()
+
+    def publish(self, job_id, d):
+        """
+        Queues a progress dict from a yt-dlp progress hook.
+        """
+        info_dict = d.get('info_dict') or {}
+        self._events.put(ProgressEvent(
+            job_id,
+            d['status'],
+            d.get('downloaded_bytes') or 0,
+            d.get('total_bytes') or d.get('total_bytes_estimate'),
+            d.get('speed'),
+            info_dict.get('title') or d.get('filename'),
+            time.monotonic(),
+        ))
+
+    def publish_finished(self, job_id, status):
+        """
+        Tells the UI that a job is over ('done', 'failed', 'skipped' or 'cancelled') so it stops showing it.
+        """
+        self._events.put(ProgressEvent(job_id, status, 0, None, None, None, time.monotonic()))
+
+    def drain(self, max_events=None):
+        events = []
+        while max_events is None or len(events) < max_events:
+            try:
+                events.append(self._events.get_nowait())
+            except queue.Empty:
+                break
+        return events
+
+
+class ProgressAggregator:
+    """
+    Coalesces progress events to the latest state per job and computes aggregate throughput and ETA.
+    """
+    FINISHED_STATUSES = ('done', 'failed', 'skipped', 'cancelled')
+
+    def __init__(self):
+        self.jobs = {}  # job_id -> latest ProgressEvent
+        self.completed = 0
+
+    def apply(self, events):
+        for event in events:
+            if event.status in self.FINISHED_STATUSES:
+                self.jobs.pop(event.job_id, None)
+                self.completed += 1
+            elif event.status in ('downloading', 'finished'):
+                self.jobs[event.job_id] = event
+            elif event.status in ('paused', 'queued'):
+                # Paused by the user, or preempted back into the queue: keep the row and its progress
+                previous = self.jobs.get(event.job_id)
+                self.jobs[event.job_id] = previous._replace(status=event.status, speed=None) if previous else event
+
+    def snapshot(self):
+        """
+        Returns the aggregate (downloaded, total, speed, eta, percent) and the per-job rows.
+        """
+        downloaded = total = speed = 0
+        rows = []
+        for job_id, event in self.jobs.items():
+            downloaded += event.downloaded
+            total += event.total or event.downloaded
+            speed += event.speed or 0
+            percent = int(event.downloaded / event.total * 100) if event.total else 0
+            rows.append((job_id, event.label, percent, event.speed, event.status))
+        remaining = max(total - downloaded, 0)
+        return {
+            'active': sum(event.status in ('downloading', 'finished') for event in self.jobs.values()),
+            'completed': self.completed,
+            'downloaded': downloaded,
+            'total': total,
+            'speed': speed,
+            'eta': remaining / speed if speed else None,
+            'percent': int(downloaded / total * 100) if total else 0,
+            'jobs': rows,
+        }
+
+
+class ProgressPump:
+    """
+    Runs on the Tk main thread: every 1/fps seconds it drains the bus, coalesces the events
+    and calls render(snapshot) once if anything changed.
+    """
+
+    def __init__(self, root, bus, render, fps=10):
+        self.root = root
+        self.bus = bus
+        self.render = render
+        self.interval_ms = int(1000 / fps)
+        self.aggregator = ProgressAggregator()
+        self._running = False
+
+    def start(self):
+        self._running = True
+        self.root.after(self.interval_ms, self._tick)
+
+    def stop(self):
+        self._running = False
+
+    def pump_once(self):
+        events = self.bus.drain()
+        if events:
+            self.aggregator.apply(events)
+            self.render(self.aggregator.snapshot())
+        return len(events)
+
+    def _tick(self):
+        if not self._running:
+            return
+        try:
+            self.pump_once()
+        finally:
+            self.root.after(self.interval_ms, self._tick)
+
+
+def format_speed(speed):
+    if not speed:
+        return "-"
+    if speed >= 1024**2:
+        return f"{speed / 1024**2:.1f} MB/s"
+    return f"{speed / 1024:.0f} KB/s"
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return "--:--"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes:02d}:{seconds:02d}"
@@ -0,0 +1,195 @@
+import re
+import time
+import errno
+import random
+import threading
+
+# What a failure says about trying again
+TRANSIENT = 'transient'  # Network hiccup or server error: retry after a short backoff
+THROTTLED = 'throttled'  # The site is rate limiting us: back off, and slow down every job on that host
+PERMANENT = 'permanent'  # Retrying will not help (video gone, private, unsupported, disk full...)
+
+THROTTLE_STATUSES = (429, 403)  # YouTube answers 403 on stream URLs when it throttles or the signature expired
+TRANSIENT_STATUSES = (408, 425, 500, 502, 503, 504)
+STALE_URL_STATUSES = (403, 404, 410)  # What an expired stream URL gets, fresh metadata may fix it
+THROTTLE_PATTERNS = ('too many requests', "confirm you're not a bot", 'confirm you’re not a bot', 'rate limit', 'rate-limit')
+PERMANENT_PATTERNS = ('video unavailable', 'private video', 'has been removed', 'unsupported url', 'members-only',
+                      'requested format is not available', 'copyright', 'account associated with this video has been terminated')
+DISK_ERRNOS = (errno.ENOSPC, errno.EACCES, errno.EROFS, getattr(errno, 'EDQUOT', errno.ENOSPC))
+HTTP_STATUS_RE = re.compile(r'HTTP Error (\d{3})')
+
+
+def _error_chain(error):
+    # yt-dlp wraps the original exception: DownloadError.exc_info, ExtractorError.cause, or plain chaining
+    seen = set()
+    while isinstance(error, BaseException) and id(error) not in seen:
+        seen.add(id(error))
+        yield error
+        exc_info = getattr(error, 'exc_info', None)
+        error = (getattr(error, 'cause', None) or (exc_info[1] if exc_info else None)
+                 or error.__cause__ or error.__context__)
+
+
+def _http_status(error):
+    for attribute in ('status', 'code'):  # yt-dlp's networking HTTPError has .status, urllib's .code
+        status = getattr(error, attribute, None)
+        if isinstance(status, int) and 100 <= status < 600:
+            return status
+    return None
+
+
+def classify_error(error):
+    """
+    Returns (TRANSIENT | THROTTLED | PERMANENT, HTTP status or None) for an exception raised by a
+    download or an extraction. Unknown errors count as transient, the retry limit bounds them.
+    """
+    status = None
+    expected = False
+    for e in _error_chain(error):
+        if isinstance(e, OSError) and e.errno in DISK_ERRNOS:
+            return PERMANENT, None
+        status = status or _http_status(e)
+        expected = expected or getattr(e, 'expected', False) is True  # ExtractorError the site meant to raise
+    text = str(error)
+    if status is None:
+        match = HTTP_STATUS_RE.search(text)
+        status = int(match.group(1)) if match else None
+    text = text.lower()
+    if status in THROTTLE_STATUSES or any(pattern in text for pattern in THROTTLE_PATTERNS):
+        return THROTTLED, status
+    if status in TRANSIENT_STATUSES or (status and status >= 500):
+        return TRANSIENT, status
+    if status and 400 <= status < 500:
+        return PERMANENT, status
+    if expected or any(pattern in text for pattern in PERMANENT_PATTERNS):
+        return PERMANENT, status
+    return TRANSIENT, status
+
+
+class RetryPolicy:
+    """
+    How often and after how long a failed job is tried again: exponential backoff with jitter
+    (half the delay fixed, half random), so jobs that failed together do not come back together.
+    Throttled failures start from a longer delay than transient ones.
+    """
+
+    def __init__(self, max_attempts=4, base_delay=2.0, throttle_delay=15.0, max_delay=300.0, rng=None):
+        self.max_attempts = max_attempts  # Including the first try
+        self.base_delay = base_delay
+        self.throttle_delay = throttle_delay
+        self.max_delay = max_delay
+        self._rng = rng or random.Random()
+
+    def should_retry(self, kind, attempt, max_attempts=None):
+        """
+        `attempt` is the number of tries that failed so far.
+        """
+        return kind != PERMANENT and attempt < (max_attempts or self.max_attempts)
+
+    def delay(self, kind, attempt, max_delay=None):
+        base = self.throttle_delay if kind == THROTTLED else self.base_delay
+        ceiling = min(max_delay or self.max_delay, base * 2 ** (attempt - 1))
+        return ceiling / 2 + self._rng.uniform(0, ceiling / 2)
+
+
+class _HostState:
+    __slots__ = ('open_until', 'trips', 'failures', 'limit')
+
+    def __init__(self):
+        self.open_until = 0.0
+        self.trips = 0  # Times opened in a row without a success in between
+        self.failures = 0  # Transient failures in a row
+        self.limit = None  # Jobs allowed to run at once while recovering, None for no limit
+
+
+class HostCircuitBreaker:
+    """
+    Per-host guard against throttling, shared by every job of the scheduler. A throttled answer
+    opens the host's circuit: no new job starts on that host for `cooldown` seconds, doubling with
+    each throttle in a row up to `max_cooldown`. A run of `failure_threshold` transient failures
+    opens it too. When it closes, jobs start again one at a time and every success doubles the
+    number allowed until `recovered_limit`, where the host is back to normal.
+    """
+
+    def __init__(self, cooldown=30.0, max_cooldown=600.0, failure_threshold=5, recovered_limit=16, clock=time.monotonic):
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.failure_threshold = failure_threshold
+        self.recovered_limit = recovered_limit
+        self.clock = clock
+        self.trips_total = 0
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def record_failure(self, host, kind):
+        """
+        Returns the seconds the host is now closed for, or None when the failure did not open it.
+        """
+        with self._lock:
+            state = self._hosts.setdefault(host, _HostState())
+            if kind == TRANSIENT:
+                state.failures += 1
+                if state.failures < self.failure_threshold:
+                    return None
+            elif kind != THROTTLED:
+                return None
+            state.trips += 1
+            state.failures = 0
+            state.limit = 1
+            seconds = min(self.max_cooldown, self.cooldown * 2 ** (state.trips - 1))
+            state.open_until = max(state.open_until, self.clock() + seconds)
+            self.trips_total += 1
+        print(f"Too many errors from {host or 'host'}, no new downloads from it for {seconds:.0f}s")
+        return seconds
+
+    def hold(self, host, seconds):
+        """
+        Opens the host's circuit for `seconds` because another breaker's did (a worker process was throttled),
+        without counting a trip here. Jobs restart one at a time afterwards, as after a trip.
+        """
+        with self._lock:
+            state = self._hosts.setdefault(host, _HostState())
+            state.limit = 1
+            state.open_until = max(state.open_until, self.clock() + seconds)
+
+    def record_success(self, host):
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None:
+                return
+            state.failures = 0
+            state.trips = 0
+            if state.limit is not None:
+                state.limit *= 2
+                if state.limit >= self.recovered_limit:
+                    del self._hosts[host]
+
+    def limit(self, host):
+        """
+        How many jobs may run on `host` right now: 0 while its circuit is open, None for no limit.
+        """
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None:
+                return None
+            if self.clock() < state.open_until:
+                return 0
+            return state.limit
+
+    def retry_in(self, host):
+        """
+        Seconds until the host's circuit closes, None when it is not open.
+        """
+        with self._lock:
+            state = self._hosts.get(host)
+            remaining = state.open_until - self.clock() if state else 0
+        return remaining if remaining > 0 else None
+
+    def snapshot(self):
+        """
+        {host: {'open_for', 'limit', 'trips'}} of the hosts that are not back to normal.
+        """
+        now = self.clock()
+        with self._lock:
+            return {host: {'open_for': round(max(state.open_until - now, 0), 1), 'limit': state.limit, 'trips': state.trips}
+                    for host, state in self._hosts.items()}
@@ -0,0 +1,276 @@
+import os
+import json
+import time
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from output_writer import OutputWriter, DEFAULT_BUFFER_SIZE
+
+MIN_SEGMENT_SIZE = 8 * 1024**2  # Below this a second connection costs more than it brings, also the piece size
+CHUNK_SIZE = 256 * 1024
+RETRYABLE_ERRORS = (urllib.error.URLError, ConnectionError, TimeoutError, OSError)
+RESUME_SUFFIX = '.resume'  # Next to the .part: its size and how much of it is downloaded
+
+
+def remove_partial(tmpfilename):
+    """
+    Removes a .part file and, when SegmentedDownloader wrote it, its resume state.
+    """
+    for path in (tmpfilename, tmpfilename + RESUME_SUFFIX):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def discard_interrupted(filename):
+    """
+    Removes the .part an interrupted SegmentedDownloader left for `filename`, if there is one: it is
+    preallocated to full size, yt-dlp would take it for a finished download. yt-dlp's own .part files stay.
+    """
+    tmpfilename = filename + '.part'
+    if os.path.exists(tmpfilename + RESUME_SUFFIX):
+        remove_partial(tmpfilename)
+
+
+class RangeNotSupported(Exception):
+    pass
+
+
+class SegmentedDownloader:
+    """
+    Downloads one HTTP(S) file over several connections. The file is preallocated and cut into
+    `min_segment_size` pieces that the connections take in order, each written at its offset.
+    A failed piece is retried on its own, resuming from the last byte written.
+    When the server does not honour Range (or the file is small) it falls back to a single GET.
+
+    Writes go through an OutputWriter: `buffer_size` blocks, and a SHA-256 computed while the bytes
+    arrive (`sha256` once done). Connections stay within a few pieces of the first unwritten byte,
+    which bounds the memory held for hashing out-of-order pieces.
+
+    An interrupted download keeps its .part with a `.part.resume` file next to it recording how much
+    of it is contiguous from the start; the next download() of the same file continues from there
+    (the prefix is read back once for the hash). discard() removes both instead.
+
+    progress_callback receives yt-dlp style progress dicts, so it can be one of our progress hooks.
+    """
+
+    def __init__(self, url, filename, headers=None, connections=4, min_segment_size=MIN_SEGMENT_SIZE,
+                 retries=3, timeout=20, progress_callback=None, buffer_size=DEFAULT_BUFFER_SIZE):
+        self.url = url
+        self.filename = filename
+        self.tmpfilename = filename + '.part'
+        self.resumefilename = self.tmpfilename + RESUME_SUFFIX
+        self.headers = dict(headers or {})
+        self.connections = connections
+        self.min_segment_size = min_segment_size
+        self.retries = retries
+        self.timeout = timeout
+        self.progress_callback = progress_callback
+        self.buffer_size = buffer_size
+        self.total_bytes = None
+        self.downloaded_bytes = 0
+        self.segments_used = 1
+        self.segment_retries = 0
+        self.resumed_from = 0  # Bytes taken over from an interrupted earlier download
+        self.sha256 = None
+        self.io = None  # IOStats of the finished file
+        self._started = None
+        self._pieces = None
+        self._writer = None
+        self._lock = threading.Lock()
+        self._abort = threading.Event()
+
+    def download(self):
+        """
+        Downloads to `<filename>.part`, renames it to `filename` when complete and returns the filename.
+        """
+        self._started = time.monotonic()
+        self.total_bytes, accepts_ranges = self.probe()
+        connection_count = min(self.connections, (self.total_bytes or 0) // self.min_segment_size)
+        try:
+            if accepts_ranges and connection_count >= 2:
+                try:
+                    self._download_segments(connection_count, self._resume_offset())
+                except RangeNotSupported:
+                    self._writer = None
+                    self._download_single()
+            else:
+                self._download_single()
+        except BaseException:
+            self._save_state(self._writer.hashed_offset if self._writer else 0)
+            raise
+        os.replace(self.tmpfilename, self.filename)
+        if os.path.exists(self.resumefilename):
+            os.remove(self.resumefilename)
+        self._report('finished')
+        return self.filename
+
+    def discard(self):
+        """
+        Removes what an interrupted download left behind. The .part is preallocated to the full size,
+        another downloader (yt-dlp) would take it for a finished file.
+        """
+        remove_partial(self.tmpfilename)
+
+    def _resume_offset(self):
+        # Only a .part of the same size we preallocated ourselves, anything else starts over
+        try:
+            with open(self.resumefilename, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            if state['total_bytes'] == self.total_bytes and os.path.getsize(self.tmpfilename) == self.total_bytes:
+                return min(int(state['done']), self.total_bytes)
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        return 0
+
+    def _save_state(self, done):
+        if self.total_bytes and os.path.exists(self.tmpfilename):
+            with open(self.resumefilename, 'w', encoding='utf-8') as f:
+                json.dump({'total_bytes': self.total_bytes, 'done': done}, f)
+
+    def probe(self):
+        """
+        Returns (total size or None, whether the server answers Range requests with 206).
+        """
+        request = urllib.request.Request(self.url, headers={**self.headers, 'Range': 'bytes=0-0'})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            content_range = response.headers.get('Content-Range', '')
+            total = content_range.rpartition('/')[2]
+            if response.status == 206 and total.isdigit():
+                return int(total), True
+            length = response.headers.get('Content-Length', '')
+            return (int(length) if length.isdigit() else None), False
+
+    def _download_segments(self, connection_count, resume_from=0):
+        self._writer = OutputWriter(self.tmpfilename, self.total_bytes, self.buffer_size, resume_from=resume_from)
+        self.resumed_from = self.downloaded_bytes = resume_from
+        self._pieces = iter(range(resume_from, self.total_bytes, self.min_segment_size))
+        self.segments_used = connection_count
+        try:
+            with ThreadPoolExecutor(max_workers=connection_count, thread_name_prefix='segment') as executor:
+                futures = [executor.submit(self._connection_loop, connection_count * self.min_segment_size)
+                           for _ in range(connection_count)]
+                try:
+                    for future in futures:
+                        future.result()
+                except BaseException:
+                    self._abort.set()  # Stop the other connections, there is no point finishing the file
+                    raise
+        except BaseException:
+            self._writer.abort()
+            raise
+        self.sha256 = self._writer.close()
+        self.io = self._writer.stats
+
+    def _connection_loop(self, window):
+        while not self._abort.is_set():
+            with self._lock:
+                start = next(self._pieces, None)
+            if start is None:
+                return
+            # Wait until the piece is within `window` bytes of the hash position
+            while not self._writer.wait_for_hash(start - window, timeout=0.5):
+                if self._abort.is_set():
+                    return
+            self._download_piece(start, min(start + self.min_segment_size, self.total_bytes) - 1)
+
+    def _download_piece(self, start, end):
+        position = start  # Next byte to write to the file
+        attempt = 0
+        while position <= end:
+            if self._abort.is_set():
+                return
+            headers = {**self.headers, 'Range': f'bytes={position}-{end}'}
+            buffer = bytearray()
+            try:
+                with urllib.request.urlopen(urllib.request.Request(self.url, headers=headers),
+                                            timeout=self.timeout) as response:
+                    if response.status != 206:
+                        raise RangeNotSupported(f"Server answered {response.status} to a Range request")
+                    while position + len(buffer) <= end and not self._abort.is_set():
+                        chunk = response.read(min(CHUNK_SIZE, end - position - len(buffer) + 1))
+                        if not chunk:
+                            break
+                        buffer += chunk
+                        if len(buffer) >= self.buffer_size:
+                            position = self._write_buffer(position, buffer)
+                        self._add_progress(len(chunk))
+                position = self._write_buffer(position, buffer)
+                if position <= end and not self._abort.is_set():
+                    raise ConnectionError(f"Piece {start}-{end} ended early at byte {position}")
+            except RETRYABLE_ERRORS as e:
+                position = self._write_buffer(position, buffer)  # Keep what did arrive, the retry continues after it
+                attempt += 1
+                if attempt > self.retries:
+                    raise
+                with self._lock:
+                    self.segment_retries += 1
+                print(f"Retrying piece {start}-{end} from byte {position} ({e})")
+                time.sleep(min(2 ** attempt * 0.5, 10))
+
+    def _write_buffer(self, position, buffer):
+        if buffer:
+            self._writer.write_at(position, buffer)
+            position += len(buffer)
+            buffer.clear()
+        return position
+
+    def _download_single(self):
+        self.segments_used = 1
+        for attempt in range(self.retries + 1):
+            with self._lock:
+                self.downloaded_bytes = 0
+            writer = None
+            try:
+                request = urllib.request.Request(self.url, headers=self.headers)
+                with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                    length = response.headers.get('Content-Length', '')
+                    self.total_bytes = int(length) if length.isdigit() else self.total_bytes
+                    writer = OutputWriter(self.tmpfilename, self.total_bytes, self.buffer_size)
+                    while chunk := response.read(CHUNK_SIZE):
+                        writer.write(chunk)
+                        self._add_progress(len(chunk))
+                if self.total_bytes is None or self.downloaded_bytes >= self.total_bytes:
+                    self.sha256 = writer.close()
+                    self.io = writer.stats
+                    return
+                raise ConnectionError(f"Download ended early at byte {self.downloaded_bytes}")
+            except BaseException as e:
+                if writer:
+                    writer.abort()
+                if not isinstance(e, RETRYABLE_ERRORS) or attempt == self.retries:
+                    raise
+                print(f"Retrying download of {self.filename} ({e})")
+                time.sleep(min(2 ** attempt * 0.5, 10))
+
+    def _add_progress(self, received):
+        # Reported under the lock so the hook sees a monotonic byte count; if the hook throttles
+        # (bandwidth limit) every segment of this job waits, which is what we want
+        with self._lock:
+            self.downloaded_bytes += received
+            self._report('downloading')
+
+    def _report(self, status):
+        if not self.progress_callback:
+            return
+        elapsed = time.monotonic() - self._started
+        self.progress_callback({
+            'status': status,
+            'filename': self.filename,
+            'tmpfilename': self.tmpfilename,
+            'downloaded_bytes': self.downloaded_bytes,
+            'total_bytes': self.total_bytes,
+            'elapsed': elapsed,
+            'speed': self.downloaded_bytes / elapsed if elapsed > 0 else None,
+        })
+
+
+def download_file(url, filename, headers=None, connections=4, progress_callback=None, **kwargs):
+    """
+    Convenience wrapper around SegmentedDownloader, returns the downloader so callers can read its stats.
+    """
+    downloader = SegmentedDownloader(url, filename, headers=headers, connections=connections,
+                                     progress_callback=progress_callback, **kwargs)
+    downloader.download()
+    return downloader
@@ -0,0 +1,117 @@
+import json
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from startup import load_youtube_dl
+
+# Options that change from job to job. They are applied to a pooled instance on checkout
+# instead of being part of the pool key, so jobs that only differ in these share sessions.
+PER_JOB_OPTIONS = ('progress_hooks', 'postprocessor_hooks', 'outtmpl', 'format', 'ratelimit')
+
+
+class YoutubeDLPool:
+    """
+    Keeps warm YoutubeDL instances around, keyed by their (shared) options, so extractor setup,
+    the cookie jar and open HTTP connections are reused between jobs.
+    Each instance is only ever used by one thread at a time.
+    """
+
+    def __init__(self, max_idle_per_key=4):
+        self.max_idle_per_key = max_idle_per_key
+        self.created = 0
+        self.reused = 0
+        self._idle = defaultdict(list)
+        self._lock = threading.Lock()
+        self._closed = False
+
+    @staticmethod
+    def signature(ydl_opts):
+        shared_opts = {k: v for k, v in ydl_opts.items() if k not in PER_JOB_OPTIONS}
+        return json.dumps(shared_opts, sort_keys=True, default=repr)
+
+    @contextmanager
+    def session(self, ydl_opts):
+        """
+        Context manager handing out a YoutubeDL configured with `ydl_opts`.
+        Per-job options (hooks, outtmpl, format...) are applied for the duration of the block only.
+        """
+        key = self.signature(ydl_opts)
+        ydl = self._checkout(key, ydl_opts)
+        saved = self._apply_job_options(ydl, ydl_opts)
+        try:
+            yield ydl
+        finally:
+            self._restore_job_options(ydl, saved)
+            self._checkin(key, ydl)
+
+    def prewarm(self, ydl_opts):
+        """
+        Builds an instance for `ydl_opts` ahead of time (this loads all extractors) and parks it in the pool.
+        """
+        key = self.signature(ydl_opts)
+        with self._lock:
+            if self._idle[key]:
+                return
+        ydl = self._checkout(key, ydl_opts)
+        self._checkin(key, ydl)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            idle = [ydl for instances in self._idle.values() for ydl in instances]
+            self._idle.clear()
+        for ydl in idle:
+            ydl.close()
+
+    def stats(self):
+        with self._lock:
+            return {'created': self.created, 'reused': self.reused,
+                    'idle': sum(len(instances) for instances in self._idle.values())}
+
+    def _checkout(self, key, ydl_opts):
+        with self._lock:
+            if self._idle[key]:
+                self.reused += 1
+                return self._idle[key].pop()
+            self.created += 1
+        shared_opts = {k: v for k, v in ydl_opts.items() if k not in PER_JOB_OPTIONS}
+        return load_youtube_dl()(shared_opts)
+
+    def _checkin(self, key, ydl):
+        with self._lock:
+            if not self._closed and len(self._idle[key]) < self.max_idle_per_key:
+                self._idle[key].append(ydl)
+                return
+        ydl.close()
+
+    def _apply_job_options(self, ydl, ydl_opts):
+        saved = {
+            'params': {k: ydl.params.get(k) for k in PER_JOB_OPTIONS},
+            'progress_hooks': ydl._progress_hooks,
+            'postprocessor_hooks': ydl._postprocessor_hooks,
+            'format_selector': ydl.format_selector,
+        }
+        ydl._progress_hooks = list(ydl_opts.get('progress_hooks', []))
+        ydl._postprocessor_hooks = list(ydl_opts.get('postprocessor_hooks', []))
+        if 'outtmpl' in ydl_opts:
+            outtmpl = ydl_opts['outtmpl']
+            ydl.params['outtmpl'] = dict(outtmpl) if isinstance(outtmpl, dict) else {'default': outtmpl}
+            ydl._parse_outtmpl()
+        if 'format' in ydl_opts:
+            ydl.params['format'] = ydl_opts['format']
+            ydl.format_selector = ydl.build_format_selector(ydl_opts['format'])
+        if 'ratelimit' in ydl_opts:
+            ydl.params['ratelimit'] = ydl_opts['ratelimit']
+        return saved
+
+    def _restore_job_options(self, ydl, saved):
+        for k, v in saved['params'].items():
+            if v is None:
+                ydl.params.pop(k, None)
+            else:
+                ydl.params[k] = v
+        ydl._parse_outtmpl()
+        ydl._progress_hooks = saved['progress_hooks']
+        ydl._postprocessor_hooks = saved['postprocessor_hooks']
+        ydl.format_selector = saved['format_selector']
@@ -0,0 +1,82 @@
+import os
+import sys
+import time
+import threading
+
+# Options used for metadata extraction, shared so the pre-warmed session is the one fetch_formats gets
+INFO_OPTIONS = {
+    'quiet': True,
+    'no_warnings': True,
+}
+
+
+def load_youtube_dl():
+    """
+    Imports yt_dlp on first use and returns the YoutubeDL class.
+    Importing yt_dlp and its extractor registry is the largest part of our cold start,
+    so nothing imports it at module level.
+    """
+    from yt_dlp import YoutubeDL
+    return YoutubeDL
+
+
+def prewarm_in_background(session_pool, ydl_opts=INFO_OPTIONS, profiler=None):
+    """
+    Imports yt_dlp and builds one YoutubeDL (which loads every extractor) on a daemon thread,
+    then parks it in the session pool so the first fetch finds a warm session.
+    """
+    def prewarm():
+        load_youtube_dl()
+        if profiler:
+            profiler.mark('yt_dlp imported')
+        session_pool.prewarm(ydl_opts)
+        if profiler:
+            profiler.mark('extractors loaded')
+            profiler.report()
+
+    thread = threading.Thread(target=prewarm, name='yt-dlp-prewarm', daemon=True)
+    thread.start()
+    return thread
+
+
+class StartupProfiler:
+    """
+    Records how long each start-up phase took. Enabled with --startup-profile or YTDL_STARTUP_PROFILE=1,
+    otherwise every call is a no-op.
+    """
+
+    def __init__(self, enabled=None):
+        if enabled is None:
+            enabled = '--startup-profile' in sys.argv or os.environ.get('YTDL_STARTUP_PROFILE') == '1'
+        self.enabled = enabled
+        self.started = time.perf_counter()
+        self.phases = []
+        self._lock = threading.Lock()
+        self._expected = set()
+
+    def expect(self, *phases):
+        """
+        report() waits until all of these phases have been marked, whichever thread marks them.
+        """
+        self._expected.update(phases)
+
+    def mark(self, phase):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.phases.append((phase, time.perf_counter(), threading.current_thread().name))
+
+    def report(self):
+        if not self.enabled:
+            return
+        with self._lock:
+            if not self._expected.issubset(phase for phase, _, _ in self.phases):
+                return
+            phases = sorted(self.phases, key=lambda phase: phase[1])
+            self.enabled = False  # Report once
+        print("Startup profile (ms since start, delta, thread):", file=sys.stderr)
+        previous = self.started
+        for phase, timestamp, thread_name in phases:
+            print(f"  {(timestamp - self.started) * 1000:8.1f}  {(timestamp - previous) * 1000:+8.1f}  {thread_name:<16} {phase}",
+                  file=sys.stderr)
+            previous = timestamp
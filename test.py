@@ -1,5 +1,292 @@
+"""
+Checks that need no network: downloads go to the local media server of benchmark.py.
 
+    python -m unittest test
+"""
+import os
+import copy
+import shutil
+import hashlib
+import tempfile
+import unittest
+import importlib.util
+from unittest import mock
 
+from benchmark import (MediaServer, BenchmarkEnvironment, SyntheticPlaylist, synthetic_media, progressive_info,
+                       run_service, bench_memory_ceiling, MEMORY_SLACK_MB)
+from playlist_expander import _iter_pages
+from download_archive import DownloadArchive
+from retry_policy import RetryPolicy, HostCircuitBreaker, TRANSIENT, PERMANENT
+from segmented_download import SegmentedDownloader
 
+SEGMENT_SIZE = 256 * 1024  # Small pieces so a few MB already use every connection
+HAS_YT_DLP = importlib.util.find_spec('yt_dlp') is not None
 
-''''''
\ No newline at end of file
+
+class SegmentedDownloadTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = MediaServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='ytdl-test-')
+        self.addCleanup(shutil.rmtree, self.folder, ignore_errors=True)
+
+    def download(self, name, size, ranges=True, **kwargs):
+        downloader = SegmentedDownloader(self.server.media_url(name, size, ranges=ranges), os.path.join(self.folder, name),
+                                         connections=4, min_segment_size=SEGMENT_SIZE, buffer_size=64 * 1024, **kwargs)
+        downloader.download()
+        with open(downloader.filename, 'rb') as f:
+            content = f.read()
+        expected = synthetic_media(size)
+        self.assertEqual(len(content), size)
+        self.assertTrue(content == expected, f"{name}: downloaded bytes differ from the source")
+        self.assertEqual(downloader.sha256, hashlib.sha256(expected).hexdigest())
+        self.assertFalse(os.path.exists(downloader.tmpfilename))
+        return downloader
+
+    def test_segments_match_the_source(self):
+        for size in (8 * SEGMENT_SIZE, 8 * SEGMENT_SIZE + 12345, 3 * SEGMENT_SIZE - 1):
+            with self.subTest(size=size):
+                downloader = self.download(f'segmented-{size}.mp4', size)
+                self.assertEqual(downloader.segments_used, min(4, size // SEGMENT_SIZE))
+
+    def test_server_without_range_gets_one_request(self):
+        downloader = self.download('no-range.mp4', 8 * SEGMENT_SIZE + 777, ranges=False)
+        self.assertEqual(downloader.segments_used, 1)
+
+    def test_interrupted_download_continues_its_part_file(self):
+        size = 16 * SEGMENT_SIZE + 999
+
+        def interrupt(d):
+            if d['downloaded_bytes'] >= size // 2:
+                raise KeyboardInterrupt("paused")
+
+        with self.assertRaises(KeyboardInterrupt):
+            self.download('interrupted.mp4', size, progress_callback=interrupt)
+        part = os.path.join(self.folder, 'interrupted.mp4.part')
+        self.assertTrue(os.path.exists(part + '.resume'))
+        downloader = self.download('interrupted.mp4', size)
+        self.assertGreater(downloader.resumed_from, 0)
+        self.assertFalse(os.path.exists(part + '.resume'))
+
+    def test_small_file_is_not_split(self):
+        downloader = self.download('small.mp4', SEGMENT_SIZE + 1)
+        self.assertEqual(downloader.segments_used, 1)
+
+
+class ArchiveScanTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='ytdl-test-')
+        self.addCleanup(shutil.rmtree, self.folder, ignore_errors=True)
+        self.db_path = os.path.join(self.folder, 'archive.sqlite3')
+
+    def media_file(self, name, size):
+        path = os.path.join(self.folder, name)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        return path
+
+    def test_every_scanned_copy_is_kept_and_the_best_fit_returned(self):
+        heights = {self.media_file('Clip [scancopy001].mp4', 10): 720,
+                   self.media_file('Clip (2) [scancopy001].mkv', 20): 1080,
+                   self.media_file('Clip [scancopy001].m4a', 5): 0}
+        archive = DownloadArchive(self.db_path)
+        self.addCleanup(archive.close)
+        self.assertEqual(archive.scan_folders([self.folder]), 3)
+        with mock.patch('download_archive.probe_height', side_effect=lambda path: heights[path]):
+            for selector, height in (('720p', 1080), ('1080p', 1080), ('audio only', 0)):
+                with self.subTest(selector=selector):
+                    self.assertEqual(heights[archive.lookup('scancopy001', selector)['path']], height)
+            self.assertIsNone(archive.lookup('scancopy001', '4k'))
+
+            reopened = DownloadArchive(self.db_path)
+            self.addCleanup(reopened.close)
+            self.assertEqual(len(reopened), 3)
+            os.remove(next(path for path, height in heights.items() if height == 1080))
+            self.assertEqual(heights[reopened.lookup('scancopy001', '720p')['path']], 720)
+            self.assertEqual(len(reopened), 2)
+
+
+@unittest.skipUnless(HAS_YT_DLP, "needs yt-dlp")
+class PlaylistMemoryTest(unittest.TestCase):
+    def test_paged_listing_keeps_one_page(self):
+        from yt_dlp.utils import OnDemandPagedList
+
+        playlist = SyntheticPlaylist('PLpages', 1234)
+        paged = OnDemandPagedList(lambda pagenum: playlist[pagenum * 100:(pagenum + 1) * 100], 100)
+        cached = []
+        ids = []
+        for entry in _iter_pages(paged):
+            ids.append(entry['id'])
+            cached.append(len(paged._cache))
+        self.assertEqual(ids, [playlist.entry(i)['id'] for i in range(1234)])
+        self.assertEqual(max(cached), 0, "Pages read stay in the PagedList's cache")
+
+    def test_streamed_listing_stays_flat(self):
+        server = MediaServer().start()
+        try:
+            results = bench_memory_ceiling(server, quick=True)
+        finally:
+            server.stop()
+        if 'skipped' in results:
+            self.skipTest(results['skipped'])
+        self.assertEqual(results['entries_5000']['streamed']['entries'], 5000)
+        self.assertLess(results['streamed_growth_mb'], MEMORY_SLACK_MB,
+                        "Peak RSS of a streamed playlist listing grows with the playlist size")
+        # Kept records must stay far below the yt-dlp entry dicts they replace
+        self.assertLess(results['listed_bytes_per_entry'], results['raw_dicts_bytes_per_entry'] / 4)
+
+
+@unittest.skipUnless(HAS_YT_DLP, "needs yt-dlp")
+class CachedMetadataTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = MediaServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def test_download_uses_its_own_selector_on_cached_metadata(self):
+        from yt_dlp import YoutubeDL
+
+        with BenchmarkEnvironment(self.server) as env:
+            info_dict = progressive_info(self.server, 'cachedsel01', 4 * 1024**2)
+            info_dict['formats'] += [
+                {'format_id': '137', 'url': self.server.media_url('cachedsel01-137.mp4', 3 * 1024**2), 'ext': 'mp4',
+                 'protocol': 'http', 'vcodec': 'avc1.640033', 'acodec': 'none', 'width': 3840, 'height': 2160, 'tbr': 16000},
+                {'format_id': '140', 'url': self.server.media_url('cachedsel01-140.m4a', 512 * 1024), 'ext': 'm4a',
+                 'protocol': 'http', 'vcodec': 'none', 'acodec': 'mp4a.40.2', 'abr': 128, 'tbr': 128},
+            ]
+            # What a format listing or a prefetch caches: extract_info's result, selected with yt-dlp's default
+            # selector (when ffmpeg is installed)
+            with YoutubeDL({'quiet': True, 'format': 'bestvideo*+bestaudio/best'}) as ydl:
+                listed = ydl.sanitize_info(ydl.process_ie_result(copy.deepcopy(info_dict), download=False))
+            self.assertEqual([f['format_id'] for f in listed['requested_formats']], ['137', '140'])
+            env.seed(listed)
+
+            service = env.service()
+            try:
+                _, jobs = run_service(service, ['https://www.youtube.com/watch?v=cachedsel01'], env.download_path,
+                                      format_id='18/best')
+            finally:
+                service.close()
+            self.assertEqual([job['status'] for job in jobs], ['done'])
+            names = os.listdir(env.download_path)
+            self.assertEqual(len(names), 1, names)
+            self.assertEqual(os.path.getsize(os.path.join(env.download_path, names[0])), 1024**2)  # Format 18
+
+
+
+@unittest.skipUnless(HAS_YT_DLP, "needs yt-dlp")
+class DownloadServiceTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = MediaServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.env = BenchmarkEnvironment(self.server)
+        self.addCleanup(self.env.__exit__)
+
+    def run_urls(self, service, urls, format_id='1080p'):
+        try:
+            _, jobs = run_service(service, urls, self.env.download_path, format_id=format_id)
+        finally:
+            service.close()
+        return jobs
+
+    def test_job_left_running_by_an_earlier_run_is_downloaded(self):
+        url = 'https://www.youtube.com/watch?v=stalejob001'
+        self.env.seed(progressive_info(self.server, 'stalejob001', 1024**2))
+        service = self.env.service()
+        job_id, _ = service.journal.add_job(url, '1080p', self.env.download_path)
+        service.journal.mark_running(job_id)  # Killed mid-download, nothing resumed it
+        service.close()
+
+        jobs = self.run_urls(self.env.service(), [url])
+        self.assertEqual([(job['job_id'], job['status']) for job in jobs], [(job_id, 'done')])
+
+
+    def test_plan_does_not_resolve_archived_entries(self):
+        video_ids = [f'planarch{i:03d}' for i in range(3)]
+        for video_id in video_ids:
+            self.env.seed(progressive_info(self.server, video_id, 1024**2))
+        self.server.playlists['PLplanarch'] = [{'id': video_id, 'title': video_id, 'url': video_id} for video_id in video_ids]
+        self.addCleanup(self.server.playlists.pop, 'PLplanarch')
+        service = self.env.service()
+        self.addCleanup(service.close)
+        existing = os.path.join(self.env.download_path, 'existing.mp4')
+        with open(existing, 'wb') as f:
+            f.write(b'x')
+        service.archive.add(video_ids[0], '1080p', existing)
+        resolved = []
+        get_video_info = service.get_video_info
+        service.get_video_info = lambda url: resolved.append(url) or get_video_info(url)
+
+        plan = service.plan_playlist('https://www.youtube.com/playlist?list=PLplanarch', '1080p', budget=10 * 1024**2)
+        statuses = {item.url.rsplit('=', 1)[1]: item.status for item in plan.items}
+        self.assertEqual(statuses, {video_ids[0]: 'archived', video_ids[1]: 'planned', video_ids[2]: 'planned'})
+        self.assertEqual(sorted(url.rsplit('=', 1)[1] for url in resolved), video_ids[1:])
+        self.assertEqual(len(plan.downloads()), 2)
+        self.assertIn('1 already downloaded', plan.summary())
+
+    def retry_service(self, max_attempts=4):
+        # The default delays scaled down to fractions of a second
+        return self.env.service(retry_policy=RetryPolicy(max_attempts=max_attempts, base_delay=0.05, throttle_delay=0.1,
+                                                         max_delay=0.5),
+                                breaker=HostCircuitBreaker(cooldown=0.2, max_cooldown=1.0))
+
+    def video(self, video_id, *statuses):
+        # Seeds a video whose 1080p stream answers `statuses` before the media
+        self.env.seed(progressive_info(self.server, video_id, 1024**2))
+        self.server.inject_errors(f'{video_id}-37.mp4', *statuses)
+        self.addCleanup(self.server.faults.pop, f'{video_id}-37.mp4', None)
+        return f'https://www.youtube.com/watch?v={video_id}'
+
+    def test_server_errors_are_retried(self):
+        url = self.video('retry503aaa', 503, 503)
+        jobs = self.run_urls(self.retry_service(), [url])
+        self.assertEqual([(job['status'], job['retries']) for job in jobs], [('done', 2)])
+
+    def test_refused_download_fails_without_retries(self):
+        url = self.video('retry401aaa', 401, 401, 401)
+        jobs = self.run_urls(self.retry_service(), [url])
+        self.assertEqual([(job['status'], job['error_kind'], job['retries'] or 0) for job in jobs],
+                         [('failed', PERMANENT, 0)])
+
+    def test_throttling_opens_the_circuit_and_lowers_the_host_limit(self):
+        url = self.video('retry429aaa', 429, 429)
+        service = self.retry_service()
+        jobs = self.run_urls(service, [url])
+        self.assertEqual([(job['status'], job['retries']) for job in jobs], [('done', 2)])
+        self.assertEqual(service.breaker.trips_total, 2)
+        # One job at a time after the circuit closed, doubled by the success, not yet back to no limit
+        self.assertEqual(service.breaker.limit('www.youtube.com'), 2)
+
+    def test_end_of_run_pass_retries_transient_failures_only(self):
+        transient = self.video('retryendaaa', 503, 503)
+        permanent = self.video('retryendbbb', 401, 401)
+        service = self.retry_service(max_attempts=2)
+        try:
+            _, jobs = run_service(service, [transient, permanent], self.env.download_path)
+            failed = {job['url']: job for job in jobs if job['status'] == 'failed'}
+            self.assertEqual({url: job['error_kind'] for url, job in failed.items()},
+                             {transient: TRANSIENT, permanent: PERMANENT})
+            jobs.clear()
+            self.assertEqual(service.retry_failed_jobs(), [failed[transient]['job_id']])
+            service.join()
+        finally:
+            service.close()
+        self.assertEqual([(job['url'], job['status']) for job in jobs], [(transient, 'done')])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+from urllib.parse import urlparse, parse_qs
+
+YOUTUBE_HOSTS = ('youtube.com', 'www.youtube.com', 'm.youtube.com', 'music.youtube.com')
+SHORT_HOSTS = ('youtu.be', 'www.youtu.be')
+
+
+def canonical_video_id(url):
+    """
+    Returns the YouTube video ID for a URL, or None if the URL does not point at a single video.
+    Handles watch?v=, youtu.be/, /shorts/, /embed/ and /live/ forms and ignores extra query
+    parameters such as &t= or si=.
+    """
+    try:
+        parsed_url = urlparse(url.strip())
+    except (AttributeError, ValueError):
+        return None
+    host = (parsed_url.hostname or '').lower()
+    path_segments = [segment for segment in parsed_url.path.split('/') if segment]
+
+    if host in SHORT_HOSTS:
+        return path_segments[0] if path_segments else None
+    if host in YOUTUBE_HOSTS:
+        query_params = parse_qs(parsed_url.query)
+        if 'v' in query_params:
+            return query_params['v'][0]
+        if len(path_segments) >= 2 and path_segments[0] in ('shorts', 'embed', 'live', 'v'):
+            return path_segments[1]
+    return None
+
+
+def cache_key_for_url(url):
+    """
+    Key used for caching metadata: the canonical video ID when we can find one, else the stripped URL.
+    A video URL with a list= parameter keeps it ('<id>&list=<playlist id>'): yt-dlp may extract the
+    playlist for it, which must not share a cache entry (or an extraction) with the video alone.
+    """
+    video_id = canonical_video_id(url)
+    if not video_id:
+        return url.strip()
+    playlist_id = canonical_playlist_id(url)
+    return f'{video_id}&list={playlist_id}' if playlist_id else video_id
+
+
+def canonical_playlist_id(url):
+    """
+    Returns the playlist ID (the list= parameter) of a YouTube URL, or None.
+    """
+    try:
+        parsed_url = urlparse(url.strip())
+    except (AttributeError, ValueError):
+        return None
+    host = (parsed_url.hostname or '').lower()
+    if host not in YOUTUBE_HOSTS and host not in SHORT_HOSTS:
+        return None
+    return parse_qs(parsed_url.query).get('list', [None])[0]
+
+
+def canonicalize_url(url):
+    """
+    Normalizes a YouTube URL so trivially different forms (&t=, si=, youtu.be, shorts...) compare equal.
+    Returns (key, url): key is ('playlist', id), ('video', id) or ('url', url) for anything else,
+    url is the normalized URL to hand to yt-dlp.
+    """
+    url = url.strip()
+    playlist_id = canonical_playlist_id(url)
+    if playlist_id:
+        return ('playlist', playlist_id), f'https://www.youtube.com/playlist?list={playlist_id}'
+    video_id = canonical_video_id(url)
+    if video_id:
+        return ('video', video_id), f'https://www.youtube.com/watch?v={video_id}'
+    return ('url', url), url